@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict
+
+
+def log_event(event_type, data):
+    logging.info(json.dumps({"event": event_type, "data": data}))
+
+
+def connection_fingerprint(db_connection) -> str:
+    """Stable hash of everything that decides which database an agent talks to."""
+    payload = json.dumps(
+        [db_connection.get_connection_string(), db_connection.kwargs],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class AgentRegistry:
+    """
+    Process-wide cache of warm agents (DBExpertAgent instances) built by `factory`.
+
+    Agents are keyed by (connection_id, connection fingerprint) so that editing a
+    connection's credentials or URL never serves an agent built for the old target.
+    Entries are evicted least-recently-used once `max_size` is reached and expire
+    after `ttl` seconds.
+    """
+
+    def __init__(self, factory: Callable[[object], object], max_size: int = 16, ttl: int = 1800):
+        self.factory = factory  # db_connection -> agent
+        self.max_size = max_size
+        self.ttl = ttl
+        self._agents = OrderedDict()  # (connection_id, fingerprint) -> (agent, created_at)
+        self._lock = Lock()
+        self._build_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_agent(self, connection_id, db_connection):
+        key = (str(connection_id), connection_fingerprint(db_connection))
+
+        with self._lock:
+            agent = self._lookup(key)
+            if agent is not None:
+                self.hits += 1
+                return agent
+            build_lock = self._build_locks.setdefault(key, Lock())
+
+        # Build outside the registry lock; concurrent requests for the same key wait here
+        with build_lock:
+            with self._lock:
+                agent = self._lookup(key)
+                if agent is not None:
+                    self.hits += 1
+                    return agent
+                self.misses += 1
+
+            agent = self.factory(db_connection)
+
+            with self._lock:
+                self._drop_connection(key[0])
+                self._agents[key] = (agent, time.monotonic())
+                while len(self._agents) > self.max_size:
+                    self._agents.popitem(last=False)
+                    self.evictions += 1
+                self._build_locks.pop(key, None)
+            log_event("agent_cache_miss", {"connection_id": connection_id})
+            return agent
+
+    def invalidate(self, connection_id) -> int:
+        """Drop every cached agent for a connection and its pooled engine. Returns the number removed."""
+        with self._lock:
+            stale = [entry[0] for key, entry in self._agents.items() if key[0] == str(connection_id)]
+            self._drop_connection(str(connection_id))
+        for agent in stale:
+            agent.db_connection.dispose()
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._agents),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _lookup(self, key):
+        entry = self._agents.get(key)
+        if entry is None:
+            return None
+        agent, created_at = entry
+        if time.monotonic() - created_at > self.ttl:
+            del self._agents[key]
+            self.evictions += 1
+            return None
+        self._agents.move_to_end(key)
+        return agent
+
+    def _drop_connection(self, connection_id) -> int:
+        stale = [key for key in self._agents if key[0] == connection_id]
+        for key in stale:
+            del self._agents[key]
+        return len(stale)
@@ -1,6 +1,303 @@
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Lock, Timer
+from weakref import WeakSet
 from langchain_community.utilities import SQLDatabase
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool, StaticPool, NullPool
+
+# ---------------------- Engine Cache ----------------------
+# Seconds between liveness probes of an already pooled engine
+HEALTH_CHECK_INTERVAL = int(os.getenv("DB_HEALTH_CHECK_INTERVAL", 300))
+
+_engine_cache = {}  # (connection string, pool settings) -> Engine
+_last_health_check = {}  # engine key -> monotonic time of last probe
+_engine_users = {}  # engine key -> WeakSet of DBConnections sharing the engine
+_engine_lock = Lock()
+
+_POOL_SETTINGS = {
+    "postgresql": {
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800
+    },
+    "mysql": {
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_pre_ping": True,
+        # Stay below the server-side wait_timeout
+        "pool_recycle": 3600
+    },
+    "mssql": {
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800
+    },
+    "oracle": {
+        "poolclass": QueuePool,
+        "pool_size": 3,
+        "max_overflow": 5,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800
+    },
+    "snowflake": {
+        # Warehouse sessions are expensive; keep few and recycle before token expiry
+        "poolclass": QueuePool,
+        "pool_size": 2,
+        "max_overflow": 3,
+        "pool_pre_ping": True,
+        "pool_recycle": 3000
+    },
+    "bigquery": {
+        # HTTP-based driver, nothing to keep warm
+        "poolclass": NullPool
+    },
+    "athena": {
+        "poolclass": NullPool
+    },
+    "duckdb": {
+        # A DuckDB connection must not be used by two threads at once; pooled
+        # connections of one process share the same database instance
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 5
+    },
+    "default": {
+        "pool_pre_ping": True,
+        "pool_recycle": 1800
+    }
+}
+
+_TEST_QUERIES = {
+    "sqlite": "SELECT name FROM sqlite_master LIMIT 1",
+    "postgresql": "SELECT 1",
+    "mysql": "SELECT 1",
+    "mssql": "SELECT 1",
+    "oracle": "SELECT 1 FROM dual",
+    "snowflake": "SELECT CURRENT_VERSION()",
+    "bigquery": "SELECT 1",
+    "duckdb": "SELECT 1",
+    "clickhouse": "SELECT 1",
+    "ibm": "SELECT 1 FROM SYSIBM.SYSDUMMY1",
+    "firebird": "SELECT 1 FROM RDB$DATABASE",
+    "sqlanywhere": "SELECT 1",
+    "exasol": "SELECT 1",
+    "phoenix": "SELECT table_name FROM system.catalog LIMIT 1",
+    "hive": "SHOW TABLES",
+    "athena": "SELECT 1",
+    "vertica": "SELECT version()"
+}
+
+
+# ---------------------- Statement Timeouts ----------------------
+# Default seconds a single statement may run; per connection via the "statement_timeout" option
+DEFAULT_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", 120))
+SQLITE_PROGRESS_STEPS = 10000  # VM instructions between SQLite deadline checks
+
+logger = logging.getLogger(__name__)
+
+_running_queries = {}  # query_id -> RunningQuery
+_running_lock = Lock()
+
+
+class QueryTimeout(TimeoutError):
+    """Raised when a statement exceeds its timeout."""
+
+
+class QueryCancelled(RuntimeError):
+    """Raised when a running statement was cancelled through cancel_query."""
+
+
+class RunningQuery:
+    """A statement in flight on one DBAPI connection, cancellable from another thread."""
+
+    def __init__(self, query_id, engine, dbapi_connection, timeout=None):
+        self.query_id = query_id
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.dbapi_connection = dbapi_connection
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.cancelled = False
+
+    @property
+    def timed_out(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    @property
+    def cancellable(self):
+        """Whether cancel() has a native mechanism for this driver."""
+        return (self.dialect in ("sqlite", "mysql", "mariadb")
+                or hasattr(self.dbapi_connection, "cancel") or hasattr(self.dbapi_connection, "interrupt"))
+
+    def cancel(self):
+        """Interrupt the statement with the driver's native mechanism."""
+        if not self.cancellable:
+            raise NotImplementedError(f"Cancellation is not supported for {self.dialect}")
+        self.cancelled = True
+        if self.dialect == "sqlite":
+            # The progress handler aborts on its next check; interrupt() covers long steps
+            self.dbapi_connection.interrupt()
+        elif self.dialect in ("mysql", "mariadb"):
+            # MySQL drivers cannot cancel in-band; kill the statement from another session
+            thread_id = self.dbapi_connection.thread_id()
+            with self.engine.connect() as conn:
+                conn.execute(text(f"KILL QUERY {int(thread_id)}"))
+        elif hasattr(self.dbapi_connection, "cancel"):
+            self.dbapi_connection.cancel()  # psycopg2, pyodbc, cx_Oracle, ...
+        else:
+            self.dbapi_connection.interrupt()  # duckdb
+
+    def to_dict(self):
+        return {
+            "query_id": self.query_id,
+            "dialect": self.dialect,
+            "running_for": round(time.monotonic() - self.started, 3),
+            "cancelled": self.cancelled
+        }
+
+
+def cancel_query(query_id):
+    """Cancel a statement started through guarded_connection; False if it is not running."""
+    with _running_lock:
+        running = _running_queries.get(query_id)
+    if running is None:
+        return False
+    running.cancel()
+    return True
+
+
+def running_queries(prefix=""):
+    with _running_lock:
+        return [running.to_dict() for query_id, running in _running_queries.items()
+                if str(query_id).startswith(prefix)]
+
+
+@contextmanager
+def guarded_connection(engine, timeout=None, query_id=None):
+    """
+    Engine connection whose statements stop after `timeout` seconds and can be
+    cancelled with cancel_query(query_id).
+
+    The timeout uses the database's own mechanism where there is one: Postgres
+    statement_timeout, MySQL MAX_EXECUTION_TIME (MariaDB max_statement_time), a
+    SQLite progress handler or the pyodbc query timeout. Other drivers get a
+    timer that cancels the statement at the deadline; drivers that can neither
+    time out nor cancel run without a timeout, with a warning logged.
+    """
+    query_id = query_id or uuid.uuid4().hex
+    with engine.connect() as conn:
+        dbapi_connection = conn.connection.dbapi_connection
+        running = RunningQuery(query_id, engine, dbapi_connection, timeout)
+        with _running_lock:
+            _running_queries[query_id] = running
+
+        restore, timer = None, None
+        try:
+            if timeout:
+                restore = _apply_timeout(conn, running, timeout)
+                if restore is False:
+                    restore = None
+                    if running.cancellable:
+                        timer = Timer(timeout, _cancel_at_deadline, (running,))
+                        timer.daemon = True
+                        timer.start()
+                    else:
+                        running.deadline = None
+                        logger.warning(f"{running.dialect} statements cannot be cancelled; "
+                                       f"running query {query_id} without its {timeout:g}s timeout")
+            yield conn
+        except Exception as e:
+            if running.cancelled and not running.timed_out:
+                raise QueryCancelled(f"Query {query_id} was cancelled") from e
+            if running.timed_out:
+                raise QueryTimeout(f"Query exceeded the {timeout:g}s statement timeout") from e
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if restore is not None:
+                try:
+                    restore()
+                except Exception:
+                    conn.invalidate()  # never hand a connection with a stale limit back to the pool
+            with _running_lock:
+                _running_queries.pop(query_id, None)
+
+
+def _cancel_at_deadline(running):
+    """Timer target; an exception here would vanish with the timer thread."""
+    try:
+        running.cancel()
+    except Exception as e:
+        logger.error(f"Could not cancel query {running.query_id} at its deadline: {e}")
+
+
+def _apply_timeout(conn, running, timeout):
+    """Set a native statement timeout; returns an undo callable, None, or False if unsupported."""
+    dialect = running.dialect
+    milliseconds = max(int(timeout * 1000), 1)
+
+    if dialect == "postgresql":
+        # SET LOCAL ends with the connection's transaction
+        conn.execute(text(f"SET LOCAL statement_timeout = {milliseconds}"))
+        return None
+    if dialect == "mariadb" or (dialect == "mysql" and getattr(conn.dialect, "is_mariadb", False)):
+        conn.execute(text(f"SET SESSION max_statement_time = {timeout:.3f}"))
+        return lambda: conn.execute(text("SET SESSION max_statement_time = 0"))
+    if dialect == "mysql":
+        # Applies to SELECT statements only
+        conn.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {milliseconds}"))
+        return lambda: conn.execute(text("SET SESSION MAX_EXECUTION_TIME = 0"))
+    if dialect == "sqlite":
+        dbapi_connection = running.dbapi_connection
+        dbapi_connection.set_progress_handler(
+            lambda: running.cancelled or running.timed_out, SQLITE_PROGRESS_STEPS)
+        return lambda: dbapi_connection.set_progress_handler(None, 0)
+    if dialect == "mssql" and hasattr(running.dbapi_connection, "timeout"):
+        dbapi_connection = running.dbapi_connection
+        previous = dbapi_connection.timeout
+        dbapi_connection.timeout = max(int(timeout), 1)
+
+        def restore():
+            dbapi_connection.timeout = previous
+        return restore
+    return False
+
+
+def engine_key(conn_str, pool_settings):
+    """Engine cache key: connections with the same URL but different pool settings get their own engine."""
+    return conn_str, json.dumps(pool_settings, sort_keys=True, default=repr)
+
+
+def dispose_engine(key):
+    """Drop a cached engine and close its pooled connections."""
+    with _engine_lock:
+        engine = _engine_cache.pop(key, None)
+        _last_health_check.pop(key, None)
+        _engine_users.pop(key, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def dispose_all_engines():
+    with _engine_lock:
+        engines = list(_engine_cache.values())
+        _engine_cache.clear()
+        _last_health_check.clear()
+        _engine_users.clear()
+    for engine in engines:
+        engine.dispose()
 
 
 class DBConnection:
@@ -26,7 +323,10 @@ class DBConnection:
 
         port = f":{self.port}" if self.port else ""
 
-        if self.db_type == "sqlite":
+        if self.db_type in ("sqlite", "sqlite+pysqlite") and self._option("read_only"):
+            # URI mode lets SQLite open the file read-only and skip write locking
+            return f"{self.db_type}:///file:{self.database}?mode=ro&uri=true"
+        elif self.db_type == "sqlite":
             return f"sqlite:///{self.database}"
         elif self.db_type == "sqlite+pysqlite":
             return f"sqlite+pysqlite:///{self.database}"
@@ -77,68 +377,129 @@ class DBConnection:
             project = self.kwargs.get("project")
             return f"bigquery://{self.username}:{self.password}@{project}/{self.database}"
         elif self.db_type == "duckdb":
-            return f"duckdb:///{self.database}"
+            # A named in-memory database is shared by every pooled connection of the process
+            database = self.database if self.database not in (None, "", ":memory:") else ":memory:sql_agent"
+            return f"duckdb:///{database}"
         else:
             raise ValueError(f"❌ Unsupported db_type: {self.db_type}")
 
     def get_engine(self):
-        """custom Db reading using Sqlalchemy"""
+        """custom Db reading using Sqlalchemy (pooled engines are cached per connection string and pool settings)"""
+        key = None
         try:
-            conn_str = self.get_connection_string()
-            engine = create_engine(conn_str)
+            settings = self.get_pool_settings()
+            key = engine_key(self.get_connection_string(), settings)
+            with _engine_lock:
+                engine = _engine_cache.get(key)
+                created = engine is None
+                if created:
+                    engine = create_engine(key[0], **settings)
+                    _engine_cache[key] = engine
+                _engine_users.setdefault(key, WeakSet()).add(self)
+            self._engine_key = key
 
-            # Test connection with appropriate query
-            with engine.connect() as conn:
-                if self.db_type.startswith("sqlite"):
-                    conn.execute(
-                        text("SELECT name FROM sqlite_master LIMIT 1"))
-                elif self.db_type.startswith(
-                    ("postgresql", "redshift", "cockroachdb", "gcp_postgres")):
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type.startswith(
-                    ("mysql", "mariadb", "gcp_mysql")):
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type.startswith("mssql"):
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "oracle":
-                    conn.execute(text("SELECT 1 FROM dual"))
-                elif self.db_type == "snowflake":
-                    conn.execute(text("SELECT CURRENT_VERSION()"))
-                elif self.db_type == "bigquery":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "duckdb":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "clickhouse":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "ibm":
-                    conn.execute(text("SELECT 1 FROM SYSIBM.SYSDUMMY1"))
-                elif self.db_type == "firebird":
-                    conn.execute(text("SELECT 1 FROM RDB$DATABASE"))
-                elif self.db_type == "sqlanywhere":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "exasol":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "phoenix":
-                    conn.execute(
-                        text("SELECT table_name FROM system.catalog LIMIT 1"))
-                elif self.db_type == "hive":
-                    conn.execute(text("SHOW TABLES"))
-                elif self.db_type == "athena":
-                    conn.execute(text("SELECT 1"))
-                elif self.db_type == "vertica":
-                    conn.execute(text("SELECT version()"))
-                else:
-                    raise ValueError(
-                        f"❌ No test query defined for db_type: {self.db_type}")
-
-            print(f"✅ {self.db_type} DB connection successful")
+            # Probe only on a fresh pool or once the health-check interval has elapsed
+            interval = float(self._option("health_check_interval", HEALTH_CHECK_INTERVAL))
+            now = time.monotonic()
+            if created or now - _last_health_check.get(key, 0) >= interval:
+                with engine.connect() as conn:
+                    conn.execute(text(self._test_query()))
+                _last_health_check[key] = now
+                if created:
+                    print(f"✅ {self.db_type} DB connection successful")
             # return SQLDatabase(engine=engine)
             return engine
 
         except SQLAlchemyError as e:
             print(f"❌ Database connection failed: {e}")
+            if key:
+                dispose_engine(key)  # the pool is unusable for every user of it
             return None
 
+    def test_connection(self):
+        """Probe the database with a throwaway engine; returns (success, message)."""
+        engine = None
+        try:
+            engine = create_engine(self.get_connection_string(), **self.get_pool_settings())
+            with engine.connect() as conn:
+                conn.execute(text(self._test_query()))
+            return True, f"{self.db_type} connection successful"
+        except Exception as e:
+            return False, str(e)
+        finally:
+            if engine is not None:
+                engine.dispose()
+
+    def statement_timeout(self):
+        """Seconds a statement may run on this connection; 0 disables the limit."""
+        return float(self._option("statement_timeout", DEFAULT_STATEMENT_TIMEOUT))
+
+    def dispose(self):
+        """Release this connection's engine; its pool is closed once no other connection shares it."""
+        key = getattr(self, "_engine_key", None)
+        if key is None:
+            return
+        with _engine_lock:
+            users = _engine_users.get(key)
+            if users is not None:
+                users.discard(self)
+                if len(users):
+                    return
+        dispose_engine(key)
+
+    def get_pool_settings(self):
+        """create_engine keyword arguments tuned for the target dialect."""
+        family = self._dialect_family()
+        if family == "sqlite":
+            if self.database in (None, "", ":memory:"):
+                # A single shared connection keeps the in-memory database alive
+                settings = {
+                    "poolclass": StaticPool,
+                    "connect_args": {"check_same_thread": False}
+                }
+            else:
+                settings = {
+                    "poolclass": QueuePool,
+                    "pool_size": 5,
+                    "max_overflow": 10,
+                    "connect_args": {"check_same_thread": False}
+                }
+        else:
+            settings = dict(_POOL_SETTINGS.get(family, _POOL_SETTINGS["default"]))
+
+        # Per-connection overrides, e.g. {"pool": {"pool_size": 20}}
+        settings.update(self._option("pool", None) or {})
+        return settings
+
+    def _option(self, name, default=None):
+        """Look up a connection option passed directly or inside additional_params."""
+        if self.kwargs.get(name) is not None:
+            return self.kwargs[name]
+        additional = self.kwargs.get("additional_params") or {}
+        if isinstance(additional, dict) and additional.get(name) is not None:
+            return additional[name]
+        return default
+
+    def _dialect_family(self):
+        if self.db_type.startswith("sqlite"):
+            return "sqlite"
+        if self.db_type.startswith(
+                ("postgresql", "redshift", "cockroachdb", "gcp_postgres")):
+            return "postgresql"
+        if self.db_type.startswith(("mysql", "mariadb", "gcp_mysql")):
+            return "mysql"
+        if self.db_type.startswith("mssql"):
+            return "mssql"
+        return self.db_type
+
+    def _test_query(self):
+        """Cheapest dialect-specific statement that proves the connection works."""
+        family = self._dialect_family()
+        if family not in _TEST_QUERIES:
+            raise ValueError(
+                f"❌ No test query defined for db_type: {self.db_type}")
+        return _TEST_QUERIES[family]
+
     def get_sql_database(self):
         """ Optional Use using langchain SqlDatabase module directly chat with Db's"""
         try:
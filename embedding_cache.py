@@ -0,0 +1,197 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+GROWTH_ROWS = 4096  # minimum rows added each time the vector file grows
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an `Embeddings` model.
+
+    Vectors are keyed by the SHA-256 of the model name, the call kind (query or
+    document) and the text. Lookups go to an in-process LRU of `max_memory`
+    vectors, then to a float32 file under `cache_dir` that is memory-mapped and
+    shared by every worker process, indexed by a SQLite table (key -> row). Only
+    texts missing from both are sent to the model, in one batch, so identical text
+    is embedded once across requests, workers and restarts. `stats` reports hit
+    rates and the encode time saved, estimated from the model's measured time per text.
+
+    Args:
+        embeddings: The wrapped model.
+        model_name: Namespace for keys and file names; use a new one when the model changes.
+        cache_dir: Directory holding `<model>.f32` and `<model>.db`.
+        max_memory: Vectors kept in the in-process LRU.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_dir: str, max_memory: int = 10000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory = max_memory
+        slug = re.sub(r"[^\w.-]+", "_", model_name)
+        self.vectors_path = os.path.join(cache_dir, f"{slug}.f32")
+        self.db_path = os.path.join(cache_dir, f"{slug}.db")
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = Lock()
+        self._mmap: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._init_db()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self._embed(list(texts), "document")]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0].tolist()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            per_text = self.encode_seconds / self.misses if self.misses else 0.0
+            with self._connect() as conn:
+                stored = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            backend = self.embeddings.stats() if hasattr(self.embeddings, "stats") else None
+            return {
+                "model": self.model_name,
+                "backend": backend,
+                "memory_vectors": len(self._memory),
+                "stored_vectors": stored,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "encode_seconds": round(self.encode_seconds, 3),
+                "saved_seconds": round((self.memory_hits + self.disk_hits) * per_text, 3)
+            }
+
+    def _embed(self, texts: List[str], kind: str) -> List[np.ndarray]:
+        keys = [self._key(kind, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self.memory_hits += len(found)
+
+        on_disk = self._read([key for key in dict.fromkeys(keys) if key not in found])
+        found.update(on_disk)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            first_text = dict(zip(keys, texts))
+            started = time.perf_counter()
+            if kind == "query":
+                computed = [self.embeddings.embed_query(first_text[key]) for key in missing]
+            else:
+                computed = self.embeddings.embed_documents([first_text[key] for key in missing])
+            elapsed = time.perf_counter() - started
+            vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, computed)}
+            self._write(vectors)
+            found.update(vectors)
+            with self._lock:
+                self.misses += len(missing)
+                self.encode_seconds += elapsed
+
+        with self._lock:
+            self.disk_hits += len(on_disk)
+            for key in list(on_disk) + missing:
+                self._memory[key] = found[key]
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+        return [found[key] for key in keys]
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x1f{kind}\x1f{text}".encode()).hexdigest()
+
+    def _read(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        rows = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), 500):  # SQLite bound-parameter limit
+                batch = keys[i:i + 500]
+                rows.update(conn.execute(
+                    f"SELECT key, row FROM vectors WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            if rows and self.dim is None:
+                self.dim = self._stored_dim(conn)
+        if not rows:
+            return {}
+        with self._lock:
+            mmap = self._vectors(max(rows.values()) + 1)
+            return {key: np.array(mmap[row]) for key, row in rows.items()}
+
+    def _write(self, vectors: Dict[str, np.ndarray]):
+        if not vectors:
+            return
+        dim = len(next(iter(vectors.values())))
+        with self._connect() as conn:
+            # Reserve rows under SQLite's write lock; growth of the file is serialized by it too
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                stored_dim = self._stored_dim(conn)
+                if stored_dim is not None and stored_dim != dim:
+                    raise ValueError(f"Embedding cache {self.db_path} holds {stored_dim}-d vectors, got {dim}-d")
+                first = conn.execute("SELECT value FROM meta WHERE name = 'next_row'").fetchone()
+                first = int(first[0]) if first else 0
+                conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?), ('next_row', ?)",
+                             (dim, first + len(vectors)))
+                needed = (first + len(vectors)) * dim * 4
+                if not os.path.exists(self.vectors_path) or os.path.getsize(self.vectors_path) < needed:
+                    with open(self.vectors_path, "ab") as f:
+                        f.truncate(needed + GROWTH_ROWS * dim * 4)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        # Vectors land in the file before their keys become visible to readers
+        with self._lock:
+            self.dim = dim
+            mmap = self._vectors(first + len(vectors))
+            for row, vector in enumerate(vectors.values(), start=first):
+                mmap[row] = vector
+            mmap.flush()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO vectors (key, row) VALUES (?, ?)",
+                             [(key, row) for row, key in enumerate(vectors, start=first)])
+
+    def _vectors(self, rows: int) -> np.memmap:
+        """Memory map covering at least `rows` rows, remapped when another worker grew the file."""
+        if self._mmap is None or self._mmap.shape[0] < rows:
+            size = os.path.getsize(self.vectors_path) // (self.dim * 4)
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(size, self.dim))
+        return self._mmap
+
+    @staticmethod
+    def _stored_dim(conn) -> Optional[int]:
+        row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        return int(row[0]) if row else None
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
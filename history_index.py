@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+from langchain.schema import Document
+from langchain.vectorstores.faiss import FAISS
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class HistoryShard:
+    """One session's history vectors plus the bookkeeping persisted next to them."""
+
+    def __init__(self, session_id: str, path: str):
+        self.session_id = session_id
+        self.path = path
+        self.lock = Lock()
+        self.vectorstore: Optional[FAISS] = None
+        self.watermark = 0  # messages of the session already vectorized
+        self.summary_upto = 0  # messages covered by the latest indexed summary
+        self.summary: Optional[str] = None  # latest summary; its chunks' originals are compacted away
+
+    @property
+    def size(self) -> int:
+        return self.vectorstore.index.ntotal if self.vectorstore is not None else 0
+
+    def ids(self) -> List[str]:
+        """Docstore ids in insertion order (oldest first)."""
+        if self.vectorstore is None:
+            return []
+        mapping = self.vectorstore.index_to_docstore_id
+        return [mapping[i] for i in sorted(mapping)]
+
+    def doc(self, doc_id: str) -> Document:
+        return self.vectorstore.docstore.search(doc_id)
+
+    def load(self, embeddings):
+        if os.path.exists(os.path.join(self.path, "index.faiss")):
+            self.vectorstore = FAISS.load_local(
+                self.path, embeddings=embeddings, allow_dangerous_deserialization=True
+            )
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.watermark = meta.get("watermark", 0)
+            self.summary_upto = meta.get("summary_upto", 0)
+            self.summary = meta.get("summary")
+
+    def save_local(self, path: str):
+        """Same signature as FAISS.save_local so the shard can go through the deferred saver."""
+        os.makedirs(path, exist_ok=True)
+        if self.vectorstore is not None:
+            self.vectorstore.save_local(path)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({
+                "session_id": self.session_id,
+                "watermark": self.watermark,
+                "summary_upto": self.summary_upto,
+                "summary": self.summary
+            }, f)
+
+
+class ShardedHistoryIndex:
+    """
+    Conversation-history vectors sharded by session id.
+
+    Each session gets its own FAISS store under `folder/<hash of session id>`, so a
+    similarity search only scans that user's history and never returns another
+    tenant's messages. At most `max_loaded_shards` shards are kept in RAM (least
+    recently used ones are written back synchronously and dropped; until that write
+    finishes, an access is served from the evicted copy rather than from the stale
+    file), each shard holds at most
+    `max_vectors` vectors (oldest message chunks go first), and whenever a new summary
+    is indexed the chunks it supersedes are compacted away.
+
+    Chunk ids are content hashes, which makes re-adding the same text a no-op.
+    """
+
+    def __init__(self, folder: str, embeddings, saver=None,
+                 max_loaded_shards: int = 64, max_vectors: int = 2000):
+        self.folder = folder
+        self.embeddings = embeddings
+        self.saver = saver
+        self.max_loaded_shards = max_loaded_shards
+        self.max_vectors = max_vectors
+        self._shards: "OrderedDict[str, HistoryShard]" = OrderedDict()
+        self._evicting: Dict[str, HistoryShard] = {}  # dropped from RAM, still being written back
+        self._loading: Dict[str, Lock] = {}  # per-session locks so a shard is read from disk once
+        self._lock = Lock()
+        self.evicted_shards = 0
+        self.evicted_vectors = 0
+        self.compacted_vectors = 0
+
+    def shard(self, session_id: str) -> HistoryShard:
+        with self._lock:
+            shard, cold = self._take(session_id)
+            if shard is None:
+                loading = self._loading.setdefault(session_id, Lock())
+        if shard is None:
+            # Read the FAISS files outside the index lock so other sessions are not blocked
+            with loading:
+                with self._lock:
+                    shard, cold = self._take(session_id)
+                if shard is None:
+                    shard = HistoryShard(session_id, self._shard_path(session_id))
+                    shard.load(self.embeddings)
+                    with self._lock:
+                        self._shards[session_id] = shard
+                        cold = self._evict()
+                        self._loading.pop(session_id, None)
+        self._write_back(cold)
+        return shard
+
+    def add_messages(self, session_id: str, chunks: List[Document], watermark: int) -> int:
+        """Index message chunks not seen before and advance the session watermark."""
+        shard = self.shard(session_id)
+        with shard.lock:
+            if watermark < shard.watermark:
+                shard.summary_upto = 0  # the session's memory was reset
+                shard.summary = None
+            known = set(shard.ids())
+            new_chunks, new_ids = [], []
+            for chunk in chunks:
+                chunk_id = content_hash(chunk.page_content)
+                if chunk_id in known:
+                    continue
+                known.add(chunk_id)
+                chunk.metadata.setdefault("kind", "message")
+                new_chunks.append(chunk)
+                new_ids.append(chunk_id)
+
+            if new_chunks:
+                self._add(shard, new_chunks, new_ids)
+                self._enforce_cap(shard)
+            shard.watermark = watermark
+        self._persist(shard)
+        return len(new_chunks)
+
+    def add_summary(self, session_id: str, summary: str, upto: Optional[int] = None):
+        """Index a roll-up summary and compact the chunks it supersedes."""
+        shard = self.shard(session_id)
+        summary_doc = Document(page_content=summary, metadata={"kind": "summary", "upto": upto})
+        with shard.lock:
+            summary_id = content_hash(summary)
+            if summary_id not in shard.ids():
+                self._add(shard, [summary_doc], [summary_id])
+            if upto is not None:
+                shard.summary_upto = max(shard.summary_upto, upto)
+            shard.summary = summary
+            self._compact(shard)
+        self._persist(shard)
+
+    def summary(self, session_id: str) -> Optional[str]:
+        """
+        Latest persisted summary of a session. Read from disk so that a summary written
+        by another worker (or before a restart) is found too.
+        """
+        shard = self.shard(session_id)
+        meta_path = os.path.join(shard.path, "meta.json")
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path) as f:
+                    summary = json.load(f).get("summary")
+                if summary:
+                    return summary
+            except (OSError, ValueError):
+                pass  # being rewritten; fall back to this worker's copy
+        return shard.summary
+
+    def watermark(self, session_id: str) -> int:
+        return self.shard(session_id).watermark
+
+    def search(self, session_id: str, query: str, k: int = 3) -> List[Document]:
+        shard = self.shard(session_id)
+        with shard.lock:
+            if not shard.size:
+                return []
+            return shard.vectorstore.similarity_search(query, k=k)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "loaded_shards": len(self._shards),
+                "loaded_vectors": sum(shard.size for shard in self._shards.values()),
+                "evicted_shards": self.evicted_shards,
+                "evicted_vectors": self.evicted_vectors,
+                "compacted_vectors": self.compacted_vectors
+            }
+
+    def _take(self, session_id: str):
+        """(loaded or still-evicting shard made most recent, or None; shards evicted to make room)."""
+        shard = self._shards.get(session_id)
+        if shard is not None:
+            self._shards.move_to_end(session_id)
+            return shard, []
+        shard = self._evicting.pop(session_id, None)
+        if shard is None:
+            return None, []
+        self._shards[session_id] = shard
+        return shard, self._evict()
+
+    def _evict(self) -> List[HistoryShard]:
+        cold = []
+        while len(self._shards) > self.max_loaded_shards:
+            session_id, shard = self._shards.popitem(last=False)
+            self._evicting[session_id] = shard
+            cold.append(shard)
+            self.evicted_shards += 1
+        return cold
+
+    def _write_back(self, shards: List[HistoryShard]):
+        """Save evicted shards now, not after the deferred saver's interval, then release them."""
+        for shard in shards:
+            with shard.lock:
+                shard.save_local(shard.path)
+            with self._lock:
+                if self._evicting.get(shard.session_id) is shard:
+                    del self._evicting[shard.session_id]
+
+    def _shard_path(self, session_id: str) -> str:
+        return os.path.join(self.folder, content_hash(session_id)[:16])
+
+    def _add(self, shard: HistoryShard, docs: List[Document], ids: List[str]):
+        if shard.vectorstore is None:
+            shard.vectorstore = FAISS.from_documents(docs, self.embeddings, ids=ids)
+        else:
+            shard.vectorstore.add_documents(docs, ids=ids)
+
+    def _delete(self, shard: HistoryShard, ids: List[str]):
+        if ids:
+            shard.vectorstore.delete(ids)
+
+    def _enforce_cap(self, shard: HistoryShard):
+        overflow = shard.size - self.max_vectors
+        if overflow <= 0:
+            return
+        # Drop the oldest message chunks; summaries carry the gist of what is removed
+        oldest = [
+            doc_id for doc_id in shard.ids()
+            if shard.doc(doc_id).metadata.get("kind") != "summary"
+        ][:overflow]
+        self._delete(shard, oldest)
+        self.evicted_vectors += len(oldest)
+
+    def _compact(self, shard: HistoryShard):
+        """Remove older summaries and message chunks already covered by the latest summary."""
+        latest_summary_id = None
+        superseded = []
+        for doc_id in shard.ids():
+            metadata = shard.doc(doc_id).metadata
+            if metadata.get("kind") == "summary":
+                if latest_summary_id is not None:
+                    superseded.append(latest_summary_id)
+                latest_summary_id = doc_id
+            elif metadata.get("msg_index", shard.summary_upto) < shard.summary_upto:
+                superseded.append(doc_id)
+        self._delete(shard, superseded)
+        self.compacted_vectors += len(superseded)
+
+    def _persist(self, shard: HistoryShard):
+        if self.saver is not None:
+            self.saver.schedule(shard, shard.path, shard.lock)
+        else:
+            with shard.lock:
+                shard.save_local(shard.path)
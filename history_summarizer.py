@@ -0,0 +1,145 @@
+import logging
+import queue
+from collections import OrderedDict
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HistorySummarizer:
+    """
+    Rolls long conversations up into a running summary on a background worker.
+
+    Callers hand over new meaningful messages with `add`; once a session has collected
+    `threshold` unsummarized messages the segment is queued. The worker calls
+    `summarize_fn(previous_summary, texts)` so each job only covers the new segment,
+    folded into the last summary. The request path reads `latest` and never waits.
+
+    Args:
+        summarize_fn: Callable (previous_summary or None, list of texts) -> summary text.
+            Any local stub works, which keeps the worker testable without a remote LLM.
+        max_queue: Maximum number of queued session jobs before new ones are dropped.
+        max_sessions: Summaries kept in RAM; least recently used ones are dropped and
+            read back through `load_summary` when needed.
+        on_summary: Optional callback (session_id, summary, upto) run after each roll-up,
+            where `upto` is the marker passed with the last text the summary covers.
+        load_summary: Optional callable (session_id) -> persisted summary or None, used
+            when this process has not summarized the session itself (after a restart,
+            or when another worker did).
+    """
+
+    def __init__(self,
+                 summarize_fn: Callable[[Optional[str], List[str]], str],
+                 max_queue: int = 256,
+                 max_sessions: int = 1024,
+                 on_summary: Optional[Callable[[str, str, Optional[int]], None]] = None,
+                 load_summary: Optional[Callable[[str], Optional[str]]] = None):
+        self.summarize_fn = summarize_fn
+        self.on_summary = on_summary
+        self.load_summary = load_summary
+        self.max_sessions = max_sessions
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = Lock()
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._buffers: Dict[str, List[str]] = {}  # texts not yet summarized
+        self._upto: Dict[str, Optional[int]] = {}  # caller's position marker for the buffered texts
+        self._queued = set()  # sessions with a job waiting in the queue
+        self._thread = None
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def add(self, session_id: str, texts: List[str], threshold: int = 20, upto: Optional[int] = None) -> bool:
+        """Buffer new texts for a session; queue a roll-up once `threshold` is reached."""
+        with self._lock:
+            buffer = self._buffers.setdefault(session_id, [])
+            buffer.extend(texts)
+            if upto is not None:
+                self._upto[session_id] = upto
+            if len(buffer) <= threshold or session_id in self._queued:
+                return False
+            try:
+                self._queue.put_nowait(session_id)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self._queued.add(session_id)
+            self._ensure_worker()
+            return True
+
+    def latest(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(session_id)
+            if summary is not None:
+                self._summaries.move_to_end(session_id)
+        if summary is None and self.load_summary is not None:
+            try:
+                summary = self.load_summary(session_id)
+            except Exception as e:
+                logger.error(f"Loading the history summary failed for {session_id}: {e}")
+        return summary
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._summaries.pop(session_id, None)
+            self._buffers.pop(session_id, None)
+            self._upto.pop(session_id, None)
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._queue.join()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._summaries),
+                "queued": self._queue.qsize(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "dropped": self.dropped
+            }
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="history-summarizer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            session_id = self._queue.get()
+            try:
+                self._summarize(session_id)
+            finally:
+                self._queue.task_done()
+
+    def _summarize(self, session_id: str):
+        with self._lock:
+            self._queued.discard(session_id)
+            texts = self._buffers.pop(session_id, [])
+            upto = self._upto.pop(session_id, None)
+        if not texts:
+            return
+        previous = self.latest(session_id)
+
+        try:
+            summary = self.summarize_fn(previous, texts).strip()
+        except Exception as e:
+            # Put the segment back so the next roll-up retries it
+            with self._lock:
+                self._buffers[session_id] = texts + self._buffers.get(session_id, [])
+                self.failed += 1
+            logger.error(f"History summarization failed for {session_id}: {e}")
+            return
+
+        with self._lock:
+            self._summaries[session_id] = summary
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+            self.completed += 1
+        if self.on_summary is not None:
+            try:
+                self.on_summary(session_id, summary, upto)
+            except Exception as e:
+                logger.error(f"History summary callback failed for {session_id}: {e}")
@@ -0,0 +1,230 @@
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+INTENTS = ("SQL_ANALYSIS", "CODE_SCRIPTING", "DB_KNOWLEDGE", "GENERAL")
+
+# Labelled examples for the k-NN vote; extend these rather than the keyword rules
+LABELLED_EXAMPLES = [
+    ("Get total load per substation", "SQL_ANALYSIS"),
+    ("Show me the top 10 customers by revenue", "SQL_ANALYSIS"),
+    ("How many orders were placed last month?", "SQL_ANALYSIS"),
+    ("List all products that are out of stock", "SQL_ANALYSIS"),
+    ("What is the average order value per country", "SQL_ANALYSIS"),
+    ("Which categories had the highest sales in 2023", "SQL_ANALYSIS"),
+    ("Count users who signed up this week", "SQL_ANALYSIS"),
+    ("Find orders with no matching payment", "SQL_ANALYSIS"),
+    ("Monthly revenue trend for the last year", "SQL_ANALYSIS"),
+    ("Give me the total quantity sold for each product", "SQL_ANALYSIS"),
+    ("Write a python script to export the orders table to CSV", "CODE_SCRIPTING"),
+    ("Generate pyspark code to aggregate sales by region", "CODE_SCRIPTING"),
+    ("Create a pandas function that cleans the customer data", "CODE_SCRIPTING"),
+    ("Write a bash script to back up the database", "CODE_SCRIPTING"),
+    ("Give me java code to connect to this database", "CODE_SCRIPTING"),
+    ("Write an airflow DAG that loads the orders daily", "CODE_SCRIPTING"),
+    ("Code a REST API endpoint that returns product details", "CODE_SCRIPTING"),
+    ("Write a unit test for the order total calculation", "CODE_SCRIPTING"),
+    ("What is the ERD of this DB?", "DB_KNOWLEDGE"),
+    ("Describe the relationships between the tables", "DB_KNOWLEDGE"),
+    ("Which tables reference the customers table?", "DB_KNOWLEDGE"),
+    ("Explain the structure of this database", "DB_KNOWLEDGE"),
+    ("What are the primary and foreign keys in the schema", "DB_KNOWLEDGE"),
+    ("How is the orders table related to order items", "DB_KNOWLEDGE"),
+    ("Draw the entity relationship diagram", "DB_KNOWLEDGE"),
+    ("What columns does the products table have", "DB_KNOWLEDGE"),
+    ("Hello!", "GENERAL"),
+    ("Hi there, how are you?", "GENERAL"),
+    ("Thanks, that was helpful", "GENERAL"),
+    ("What can you do?", "GENERAL"),
+    ("Who are you?", "GENERAL"),
+    ("Good morning", "GENERAL"),
+    ("Can you explain what a database index is in general?", "GENERAL"),
+    ("Tell me a joke", "GENERAL"),
+]
+
+# (pattern, intent, weight) — cheap, high-precision cues added to the k-NN vote
+KEYWORD_RULES = [
+    (re.compile(r"\b(python|pyspark|pandas|java|scala|bash|shell|airflow|dag|script|code|function|class|unit test)\b", re.I),
+     "CODE_SCRIPTING", 1.0),
+    (re.compile(r"\b(erd|entity[- ]relationship|relationships? between|foreign keys?|primary keys?|schema structure)\b", re.I),
+     "DB_KNOWLEDGE", 1.0),
+    (re.compile(r"^\s*(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|bye)\b[\s!.,]*$", re.I),
+     "GENERAL", 2.0),
+    (re.compile(r"\b(how many|total|average|avg|sum|count|top \d+|per|by (month|year|day|week)|list|show me|highest|lowest)\b", re.I),
+     "SQL_ANALYSIS", 0.5),
+]
+
+
+class LocalIntentClassifier:
+    """
+    In-process intent classifier that runs before the LLM intent chain.
+
+    Labelled examples are embedded once with the shared embedding model; a query is
+    classified by a similarity-weighted k-NN vote plus keyword rules. When the winning
+    share of the vote reaches `threshold` the label is used directly, otherwise
+    `classify` defers to the supplied fallback (the LLM chain).
+    """
+
+    def __init__(self, embeddings, examples: List[Tuple[str, str]] = None, k: int = 5,
+                 threshold: float = 0.75, min_similarity: float = 0.3):
+        self.embeddings = embeddings
+        self.examples = examples or LABELLED_EXAMPLES
+        self.k = k
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self._vectors = None
+        self._labels = [label for _, label in self.examples]
+        self._lock = Lock()
+        self.local_decisions = 0
+        self.fallbacks = 0
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Return (intent, confidence in [0, 1]) without calling any remote model."""
+        votes = defaultdict(float)
+
+        query = self._normalize(np.asarray(self.embeddings.embed_query(text), dtype=np.float32))
+        similarities = self._example_vectors() @ query
+        nearest = np.argsort(similarities)[::-1][:self.k]
+        if similarities[nearest[0]] >= self.min_similarity:
+            for i in nearest:
+                votes[self._labels[i]] += max(float(similarities[i]), 0.0)
+
+        for pattern, intent, weight in KEYWORD_RULES:
+            if pattern.search(text):
+                votes[intent] += weight
+
+        total = sum(votes.values())
+        if not total:
+            return "GENERAL", 0.0
+        intent = max(votes, key=votes.get)
+        return intent, votes[intent] / total
+
+    def classify(self, text: str, fallback: Optional[Callable[[str], str]] = None) -> str:
+        intent, confidence = self.predict(text)
+        if confidence >= self.threshold or fallback is None:
+            self.local_decisions += 1
+            return intent
+        self.fallbacks += 1
+        return fallback(text)
+
+    def stats(self) -> Dict:
+        decisions = self.local_decisions + self.fallbacks
+        return {
+            "local_decisions": self.local_decisions,
+            "fallbacks": self.fallbacks,
+            "local_ratio": round(self.local_decisions / decisions, 4) if decisions else 0.0,
+            "threshold": self.threshold
+        }
+
+    def _example_vectors(self) -> np.ndarray:
+        with self._lock:
+            if self._vectors is None:
+                vectors = np.asarray(
+                    self.embeddings.embed_documents([text for text, _ in self.examples]), dtype=np.float32
+                )
+                self._vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            return self._vectors
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def evaluate(classifier: LocalIntentClassifier, labelled: List[Tuple[str, str]]) -> Dict:
+    """
+    Offline accuracy/latency report of the local path against a labelled set.
+
+    Reports overall accuracy, how many inputs clear the threshold (coverage), the
+    accuracy on those confident decisions, per-call latency and the confusion counts.
+    `labelled` must not overlap `classifier.examples`, or accuracy is overstated;
+    see `cross_validate` for scoring the shipped examples themselves.
+    """
+    return _report(_predictions(classifier, labelled), classifier.threshold)
+
+
+def cross_validate(embeddings, labelled: List[Tuple[str, str]], folds: int = 5,
+                   threshold: float = 0.75, seed: int = 0) -> Dict:
+    """
+    `evaluate` over `folds` held-out splits: each example is classified by a
+    classifier built from the other folds only, so none is scored against itself.
+    """
+    order = list(range(len(labelled)))
+    random.Random(seed).shuffle(order)
+    rows = []
+    for fold in range(folds):
+        held_out = set(order[fold::folds])
+        train = [example for i, example in enumerate(labelled) if i not in held_out]
+        test = [example for i, example in enumerate(labelled) if i in held_out]
+        if train and test:
+            rows.extend(_predictions(LocalIntentClassifier(embeddings, examples=train, threshold=threshold), test))
+    return {"folds": folds, **_report(rows, threshold)}
+
+
+def _predictions(classifier: LocalIntentClassifier, labelled: List[Tuple[str, str]]) -> List[Tuple]:
+    """(expected, predicted, confidence, latency in ms) per labelled input."""
+    classifier._example_vectors()  # exclude the one-off example embedding from timings
+    rows = []
+    for text, expected in labelled:
+        started = time.perf_counter()
+        predicted, confidence = classifier.predict(text)
+        rows.append((expected, predicted, confidence, (time.perf_counter() - started) * 1000))
+    return rows
+
+
+def _report(rows: List[Tuple], threshold: float) -> Dict:
+    correct, confident, confident_correct = 0, 0, 0
+    confusion = Counter()
+    for expected, predicted, confidence, _ in rows:
+        confusion[(expected, predicted)] += 1
+        correct += predicted == expected
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += predicted == expected
+
+    latencies = sorted(latency for *_, latency in rows)
+    total = len(rows)
+    return {
+        "samples": total,
+        "accuracy": round(correct / total, 4) if total else 0.0,
+        "coverage": round(confident / total, 4) if total else 0.0,
+        "confident_accuracy": round(confident_correct / confident, 4) if confident else 0.0,
+        "latency_ms_p50": round(latencies[total // 2], 2) if total else 0.0,
+        "latency_ms_p95": round(latencies[min(total - 1, int(total * 0.95))], 2) if total else 0.0,
+        "confusion": {f"{expected}->{predicted}": n for (expected, predicted), n in sorted(confusion.items())}
+    }
+
+
+def load_labelled_set(path: str) -> List[Tuple[str, str]]:
+    """Read a JSONL file of {"text": ..., "intent": ...} records."""
+    with open(path) as f:
+        return [
+            (record["text"], record["intent"].strip().upper())
+            for record in (json.loads(line) for line in f if line.strip())
+        ]
+
+
+if __name__ == "__main__":
+    # python intent_classifier.py [held_out.jsonl|-] [threshold]
+    # With a file: score the shipped examples on it (inputs that are also examples are dropped).
+    # Without one (or "-"): 5-fold cross-validation over the shipped examples.
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.75
+    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    if len(sys.argv) > 1 and sys.argv[1] != "-":
+        known = {text.strip().lower() for text, _ in LABELLED_EXAMPLES}
+        labelled = load_labelled_set(sys.argv[1])
+        held_out = [(text, intent) for text, intent in labelled if text.strip().lower() not in known]
+        report = evaluate(LocalIntentClassifier(embeddings, threshold=threshold), held_out)
+        report["dropped_training_examples"] = len(labelled) - len(held_out)
+    else:
+        report = cross_validate(embeddings, LABELLED_EXAMPLES, threshold=threshold)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from threading import Condition, Lock, Semaphore
+from typing import Dict, Optional
+
+from prompt_builder import count_tokens
+
+# Concurrency, requests-per-minute and tokens-per-minute. A provider entry caps all of that
+# provider's models together and is the default for each model; "provider:model" entries
+# override it for one model. Override with LLM_RATE_LIMITS='{"groq:llama3-70b-8192": {"rpm": 60, "tpm": 12000}}'
+DEFAULT_LIMITS = {
+    "groq": {"concurrency": 4, "rpm": 30, "tpm": 6000},
+    "google": {"concurrency": 4, "rpm": 30, "tpm": 1000000},
+    "openai": {"concurrency": 8, "rpm": 500, "tpm": 200000},
+    "default": {"concurrency": 4, "rpm": 60, "tpm": 100000},
+}
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 30))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("LLM_BREAKER_RESET", 30))
+
+
+def load_limits() -> Dict[str, Dict]:
+    limits = {name: dict(settings) for name, settings in DEFAULT_LIMITS.items()}
+    for name, settings in json.loads(os.getenv("LLM_RATE_LIMITS", "{}")).items():
+        limits.setdefault(name, {}).update(settings)
+    return limits
+
+
+def estimate_tokens(prompt) -> int:
+    """Prompt size in tokens for the TPM bucket."""
+    if hasattr(prompt, "to_string"):
+        prompt = prompt.to_string()
+    elif isinstance(prompt, list):
+        prompt = " ".join(str(getattr(message, "content", message)) for message in prompt)
+    return max(1, count_tokens(str(prompt)))
+
+
+class LLMQueueTimeout(TimeoutError):
+    """Raised when a call cannot get a concurrency slot or rate budget within its timeout."""
+
+
+class LLMUnavailable(RuntimeError):
+    """Raised when every provider in a failover chain failed or has its circuit open."""
+
+
+_RETRYABLE_NAMES = ("ratelimit", "resourceexhausted", "timeout", "connection", "serviceunavailable",
+                    "internalserver", "overloaded", "apiconnection")
+
+
+def is_rate_limited(error: Exception) -> bool:
+    status = _status_code(error)
+    if status == 429:
+        return True
+    name = type(error).__name__.lower()
+    message = str(error).lower()
+    return ("ratelimit" in name or "resourceexhausted" in name
+            or "429" in message or "quota" in message or "rate limit" in message)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, 5xx responses, timeouts and connection errors; not bad requests."""
+    if is_rate_limited(error):
+        return True
+    status = _status_code(error)
+    if status is not None:
+        return status >= 500
+    name = type(error).__name__.lower()
+    return isinstance(error, (TimeoutError, ConnectionError)) or any(part in name for part in _RETRYABLE_NAMES)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    for candidate in (error, getattr(error, "response", None)):
+        status = getattr(candidate, "status_code", None) or getattr(candidate, "code", None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: opens after `failure_threshold` consecutive failures, rejects calls
+    for `reset_timeout` seconds, then lets a single probe through (half-open).
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release_probe(self):
+        """End a half-open probe that produced no verdict (queue timeout, cancellation)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self._state(),
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `capacity`; `take` blocks until units are available."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._cond = Condition(Lock())
+
+    def take(self, amount: float, deadline: Optional[float] = None):
+        amount = min(amount, self.capacity)  # oversized requests wait for a full bucket
+        with self._cond:
+            while True:
+                self._refill()
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                wait = (amount - self._available) / self.rate
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMQueueTimeout("rate limit budget not available before timeout")
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+
+    def try_take(self, amount: float) -> bool:
+        amount = min(amount, self.capacity)
+        with self._cond:
+            self._refill()
+            if self._available >= amount:
+                self._available -= amount
+                return True
+            return False
+
+    def refund(self, amount: float):
+        """Give back units taken for a call that never ran."""
+        with self._cond:
+            self._refill()
+            self._available = min(self.capacity, self._available + min(amount, self.capacity))
+            self._cond.notify_all()
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units would be available, without taking them."""
+        with self._cond:
+            self._refill()
+            missing = min(amount, self.capacity) - self._available
+            return max(0.0, missing / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class ModelLimiter:
+    """
+    Concurrency slots plus RPM/TPM buckets for one provider/model, with queue-wait metrics.
+
+    With a `parent` (the provider's limiter), a call needs a slot and budget from both;
+    budget already taken is refunded when a later step times out.
+    """
+
+    def __init__(self, name: str, concurrency: int = 4, rpm: float = 60, tpm: float = 100000,
+                 parent: Optional["ModelLimiter"] = None):
+        self.name = name
+        self.parent = parent
+        self._slots = Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = Lock()
+        self._waits = deque(maxlen=1000)
+        self.calls = 0
+        self.timeouts = 0
+
+    @property
+    def chain(self):
+        return [self] if self.parent is None else [self, self.parent]
+
+    @contextmanager
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None):
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        held, taken = [], []  # slots held and (bucket, amount) taken, undone on timeout
+
+        try:
+            for limiter in self.chain:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not limiter._slots.acquire(timeout=remaining):
+                    raise LLMQueueTimeout(f"no free {limiter.name} slot within {timeout}s")
+                held.append(limiter)
+            for limiter in self.chain:
+                for bucket, amount in ((limiter.requests, 1), (limiter.tokens, tokens)):
+                    bucket.take(amount, deadline)
+                    taken.append((bucket, amount))
+        except LLMQueueTimeout:
+            self._undo(held, taken)
+            raise
+
+        self._record_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            for limiter in held:
+                limiter._slots.release()
+
+    @asynccontextmanager
+    async def acquire_async(self, tokens: int = 1, timeout: Optional[float] = None):
+        """Same as `acquire`, but waits with asyncio.sleep instead of blocking the thread."""
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        held, taken = [], []
+
+        def check_deadline(wait: float = 0.0):
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise LLMQueueTimeout(f"{self.name} budget not available within {timeout}s")
+
+        try:
+            for limiter in self.chain:
+                while not limiter._slots.acquire(blocking=False):
+                    check_deadline()
+                    await asyncio.sleep(0.05)
+                held.append(limiter)
+            for limiter in self.chain:
+                for bucket, amount in ((limiter.requests, 1), (limiter.tokens, tokens)):
+                    while not bucket.try_take(amount):
+                        wait = bucket.wait_time(amount)
+                        check_deadline(wait)
+                        await asyncio.sleep(max(wait, 0.01))
+                    taken.append((bucket, amount))
+        except BaseException:  # LLMQueueTimeout, or the task was cancelled while waiting
+            self._undo(held, taken)
+            raise
+
+        self._record_wait(time.monotonic() - started)
+        try:
+            yield
+        finally:
+            for limiter in held:
+                limiter._slots.release()
+
+    def _undo(self, held, taken):
+        for bucket, amount in taken:
+            bucket.refund(amount)
+        for limiter in held:
+            limiter._slots.release()
+        for limiter in self.chain:
+            limiter._record_timeout()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "concurrency": self.concurrency,
+                "queue_wait_ms_avg": round(1000 * sum(waits) / len(waits), 2) if waits else 0.0,
+                "queue_wait_ms_p95": round(1000 * waits[int(len(waits) * 0.95)], 2) if waits else 0.0,
+                "queue_wait_ms_max": round(1000 * waits[-1], 2) if waits else 0.0
+            }
+
+    def _record_wait(self, seconds: float):
+        for limiter in self.chain:
+            with limiter._lock:
+                limiter.calls += 1
+                limiter._waits.append(seconds)
+
+    def _record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_limiters_lock = Lock()
+
+
+def get_limiter(provider: str, model_name: str) -> ModelLimiter:
+    """
+    Shared limiter for a provider/model, chained to one limiter for the whole provider.
+    Model settings fall back from model to provider to default.
+    """
+    key = f"{provider}:{model_name}"
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = load_limits()
+            settings = dict(limits["default"])
+            settings.update(limits.get(provider, {}))
+            parent = _limiters.get(provider)
+            if parent is None:
+                parent = _limiters[provider] = ModelLimiter(provider, **settings)
+            settings.update(limits.get(key, {}))
+            limiter = ModelLimiter(key, parent=parent, **settings)
+            _limiters[key] = limiter
+        return limiter
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    with _limiters_lock:
+        return {key: limiter.stats() for key, limiter in _limiters.items()}
+
+
+def get_breaker(provider: str, model_name: str) -> CircuitBreaker:
+    key = f"{provider}:{model_name}"
+    with _limiters_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(key)
+        return breaker
+
+
+def breaker_stats() -> Dict[str, Dict]:
+    with _limiters_lock:
+        return {key: breaker.stats() for key, breaker in _breakers.items()}
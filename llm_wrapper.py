@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Dict
+
+from langchain_core.runnables import Runnable
+
+from llm_limits import (
+    LLM_QUEUE_TIMEOUT, LLMQueueTimeout, LLMUnavailable, estimate_tokens, get_breaker, get_limiter, is_retryable
+)
+
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))  # primary latency percentile before hedging
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.1))  # max fraction of calls that may be hedged
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 3))  # used until enough samples exist
+HEDGE_MIN_SAMPLES = 20
+
+
+def log_event(event_type, data):
+    logging.info(json.dumps({"event": event_type, "data": data}))
+
+
+class LLMRoute:
+    """One provider/model in a failover chain, with its shared limiter, breaker and latency samples."""
+
+    def __init__(self, llm, provider: str, model_name: str):
+        self.llm = llm
+        self.provider = provider
+        self.model_name = model_name
+        self.limiter = get_limiter(provider, model_name)
+        self.breaker = get_breaker(provider, model_name)
+        self._latencies = deque(maxlen=200)
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model_name}"
+
+    def record_latency(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def latency_percentile(self, percentile: float, default: float) -> float:
+        samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return default
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+# Threads for hedged calls; a losing thread cannot be interrupted, its result is discarded
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_WORKERS", 16)),
+                                     thread_name_prefix="llm-hedge")
+
+
+class SafeLLMWrapper(Runnable):
+    """
+    Rate-limited, failover-aware wrapper around a chat model.
+
+    Each call walks the provider chain (primary first, then `fallbacks`), skipping
+    models whose circuit breaker is open. Retryable errors (rate limits, 5xx,
+    timeouts) trip the model's breaker and move on to the next provider immediately;
+    only after the whole chain has failed does the wrapper back off before the next
+    round. `ainvoke` does the same with non-blocking waits.
+
+    With `hedge=True`, a call still running after the primary's `hedge_percentile`
+    latency gets an identical backup request (next healthy provider, or the primary
+    again when there is none); the first response wins. At most `hedge_budget` of
+    calls may be hedged.
+    """
+
+    def __init__(self, llm, retries=3, delay_base=2, jitter=True,
+                 provider="default", model_name=None, queue_timeout=LLM_QUEUE_TIMEOUT,
+                 fallbacks=None, hedge=False, hedge_percentile=HEDGE_PERCENTILE,
+                 hedge_budget=HEDGE_BUDGET):
+        self.llm = llm
+        self.retries = retries
+        self.delay_base = delay_base
+        self.jitter = jitter
+        self.queue_timeout = queue_timeout
+        self.routes = [LLMRoute(llm, provider, model_name or type(llm).__name__)]
+        for fallback_llm, fallback_provider, fallback_model in fallbacks or []:
+            self.routes.append(LLMRoute(fallback_llm, fallback_provider, fallback_model))
+
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self._hedge_lock = Lock()
+        self.calls = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        self.hedge_losses = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        """
+        Invoke the first healthy model in the chain within its rate limits.
+
+        Pass `queue_timeout` (seconds) to fail fast with LLMQueueTimeout instead of
+        waiting for a slot or rate budget longer than that.
+        """
+        queue_timeout = kwargs.pop("queue_timeout", self.queue_timeout)
+        tokens = estimate_tokens(input)
+        errors = []
+
+        pair = self._hedge_pair()
+        if pair is not None:
+            try:
+                return self._invoke_hedged(pair, input, config, kwargs, tokens, queue_timeout, errors)
+            except Exception as e:
+                if not (isinstance(e, LLMQueueTimeout) or is_retryable(e)):
+                    raise
+                # fall through to the regular failover loop
+
+        for attempt in range(self.retries):
+            for route in self.routes:
+                if not route.breaker.allow():
+                    continue
+                try:
+                    return self._call_route(route, input, config, kwargs, tokens, queue_timeout)
+                except Exception as e:
+                    if not self._handle_failure(route, e, errors):
+                        raise
+
+            if attempt < self.retries - 1:
+                time.sleep(self._backoff(attempt))
+        raise self._exhausted(errors)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        """Async `invoke`: limiter waits and retry backoff never block the event loop."""
+        queue_timeout = kwargs.pop("queue_timeout", self.queue_timeout)
+        tokens = estimate_tokens(input)
+        errors = []
+
+        pair = self._hedge_pair()
+        if pair is not None:
+            try:
+                return await self._ainvoke_hedged(pair, input, config, kwargs, tokens, queue_timeout, errors)
+            except Exception as e:
+                if not (isinstance(e, LLMQueueTimeout) or is_retryable(e)):
+                    raise
+
+        for attempt in range(self.retries):
+            for route in self.routes:
+                if not route.breaker.allow():
+                    continue
+                try:
+                    return await self._acall_route(route, input, config, kwargs, tokens, queue_timeout)
+                except Exception as e:
+                    if not self._handle_failure(route, e, errors):
+                        raise
+
+            if attempt < self.retries - 1:
+                await asyncio.sleep(self._backoff(attempt))
+        raise self._exhausted(errors)
+
+    def hedge_stats(self) -> Dict:
+        with self._hedge_lock:
+            return {
+                "enabled": self.hedge,
+                "calls": self.calls,
+                "hedges_sent": self.hedges_sent,
+                "hedge_wins": self.hedge_wins,
+                "hedge_losses": self.hedge_losses,
+                "hedge_rate": round(self.hedges_sent / self.calls, 4) if self.calls else 0.0,
+                "hedge_delays_s": {
+                    route.name: round(route.latency_percentile(self.hedge_percentile, HEDGE_DEFAULT_DELAY), 3)
+                    for route in self.routes
+                }
+            }
+
+    def _call_route(self, route: LLMRoute, input, config, kwargs, tokens, queue_timeout):
+        try:
+            with route.limiter.acquire(tokens, timeout=queue_timeout):
+                started = time.monotonic()
+                response = route.llm.invoke(input, config=config, **kwargs)
+        except LLMQueueTimeout:
+            # Never reached the provider: a half-open probe must not stay taken
+            route.breaker.release_probe()
+            raise
+        route.record_latency(time.monotonic() - started)
+        route.breaker.record_success()
+        return response
+
+    async def _acall_route(self, route: LLMRoute, input, config, kwargs, tokens, queue_timeout):
+        try:
+            async with route.limiter.acquire_async(tokens, timeout=queue_timeout):
+                started = time.monotonic()
+                response = await route.llm.ainvoke(input, config=config, **kwargs)
+        except (LLMQueueTimeout, asyncio.CancelledError):
+            # No verdict on the provider (queue timeout, or the losing side of a hedge)
+            route.breaker.release_probe()
+            raise
+        route.record_latency(time.monotonic() - started)
+        route.breaker.record_success()
+        return response
+
+    def _hedge_pair(self):
+        """(primary, backup) routes when this call may be hedged, else None."""
+        with self._hedge_lock:
+            self.calls += 1
+            if not self.hedge or self.hedges_sent >= self.hedge_budget * self.calls:
+                return None
+        healthy = [route for route in self.routes if route.breaker.state == "closed"]
+        if not healthy:
+            return None
+        return healthy[0], healthy[1] if len(healthy) > 1 else healthy[0]
+
+    def _record_hedge(self, backup_won: bool):
+        with self._hedge_lock:
+            if backup_won:
+                self.hedge_wins += 1
+            else:
+                self.hedge_losses += 1
+
+    def _invoke_hedged(self, pair, input, config, kwargs, tokens, queue_timeout, errors):
+        primary, backup = pair
+        delay = primary.latency_percentile(self.hedge_percentile, HEDGE_DEFAULT_DELAY)
+        futures = {_hedge_executor.submit(self._call_route, primary, input, config, kwargs, tokens, queue_timeout): primary}
+
+        done, _ = wait(futures, timeout=delay)
+        hedged = not done
+        if hedged:
+            with self._hedge_lock:
+                self.hedges_sent += 1
+            futures[_hedge_executor.submit(self._call_route, backup, input, config, kwargs, tokens, queue_timeout)] = backup
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                route = futures[future]
+                error = future.exception()
+                if error is None:
+                    for loser in pending:
+                        loser.cancel()  # only effective while still queued
+                    if hedged:
+                        self._record_hedge(backup_won=future is not next(iter(futures)))
+                    return future.result()
+                if not self._handle_failure(route, error, errors):
+                    raise error
+        raise errors[-1]
+
+    async def _ainvoke_hedged(self, pair, input, config, kwargs, tokens, queue_timeout, errors):
+        primary, backup = pair
+        delay = primary.latency_percentile(self.hedge_percentile, HEDGE_DEFAULT_DELAY)
+        primary_task = asyncio.ensure_future(
+            self._acall_route(primary, input, config, kwargs, tokens, queue_timeout)
+        )
+        tasks = {primary_task: primary}
+
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        hedged = not done
+        if hedged:
+            with self._hedge_lock:
+                self.hedges_sent += 1
+            backup_task = asyncio.ensure_future(
+                self._acall_route(backup, input, config, kwargs, tokens, queue_timeout)
+            )
+            tasks[backup_task] = backup
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                route = tasks[task]
+                error = task.exception()
+                if error is None:
+                    for loser in pending:
+                        loser.cancel()  # cancels the in-flight HTTP request
+                    if hedged:
+                        self._record_hedge(backup_won=task is not primary_task)
+                    return task.result()
+                if not self._handle_failure(route, error, errors):
+                    raise error
+        raise errors[-1]
+
+    def _handle_failure(self, route: LLMRoute, error: Exception, errors: list) -> bool:
+        """Record a failed call; returns False when the error should propagate unchanged."""
+        if isinstance(error, LLMQueueTimeout):
+            # Our own queue is full; try the next provider without blaming this one
+            errors.append(error)
+            return True
+        if not is_retryable(error):
+            # The provider answered (e.g. a bad request), so it counts as healthy
+            route.breaker.record_success()
+            return False
+        route.breaker.record_failure()
+        errors.append(error)
+        log_event("llm_failover", {"model": route.name, "error": str(error)[:200]})
+        print(f"⚠️ {route.name} failed ({type(error).__name__}), trying next provider...")
+        return True
+
+    def _backoff(self, attempt: int) -> float:
+        wait_time = self.delay_base ** attempt
+        if self.jitter:
+            wait_time += random.uniform(0, 1)
+        print(f"⚠️ All providers failed, retry in {wait_time:.1f}s (Attempt {attempt+1}/{self.retries})...")
+        return wait_time
+
+    def _exhausted(self, errors: list) -> Exception:
+        if errors and all(isinstance(e, LLMQueueTimeout) for e in errors):
+            return errors[-1]
+        names = ", ".join(route.name for route in self.routes)
+        error = LLMUnavailable(f"LLM quota exhausted or API call failed after retries ({names}).")
+        error.__cause__ = errors[-1] if errors else None
+        return error
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
@@ -0,0 +1,281 @@
+import json
+import os
+import queue
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import onnxruntime as ort
+except ImportError:  # only needed with EMBEDDING_BACKEND=onnx
+    ort = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+MODEL_FILES = ("model_quantized.onnx", "model.onnx")  # int8 export first
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings from an exported, int8-quantized ONNX transformer.
+
+    Matches the sentence-transformers pipeline of all-MiniLM-L6-v2: tokenize
+    (truncated to `max_length`), mean-pool the last hidden state over the attention
+    mask, L2-normalize. Texts are sorted by length and padded per batch of
+    `max_batch`, so short texts do not pay for long ones. Small calls from
+    concurrent requests (single queries, a few history chunks) are coalesced by a
+    background thread that waits up to `max_wait_ms` to fill a batch; calls of
+    `max_batch` texts or more run directly on the calling thread.
+
+    Args:
+        model_dir: Directory from `export_model`, holding the .onnx file and tokenizer.json.
+        max_batch: Texts per inference call.
+        max_wait_ms: How long a small call may wait for others to share its batch.
+        max_length: Token limit per text (256 for all-MiniLM-L6-v2).
+        threads: onnxruntime intra-op threads; None lets onnxruntime decide.
+    """
+
+    def __init__(self, model_dir: str, max_batch: int = 32, max_wait_ms: float = 5.0,
+                 max_length: int = 256, threads: Optional[int] = None):
+        if ort is None or Tokenizer is None:
+            raise ImportError("EMBEDDING_BACKEND=onnx needs the onnxruntime and tokenizers packages")
+        model_path = next(
+            (os.path.join(model_dir, name) for name in MODEL_FILES if os.path.exists(os.path.join(model_dir, name))),
+            None
+        )
+        if model_path is None:
+            raise FileNotFoundError(f"No ONNX model in {model_dir}; run `python onnx_embeddings.py export {model_dir}`")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.model_path = model_path
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        pad_id = self.tokenizer.token_to_id("[PAD]")
+        self.tokenizer.enable_padding(pad_id=pad_id or 0, pad_token="[PAD]")
+
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = None
+        self._lock = Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model_path,
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_batch": round(self.texts / self.batches, 2) if self.batches else 0.0
+            }
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if len(texts) >= self.max_batch:
+            return self._encode(texts)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.max_batch):
+            batch = order[start:start + self.max_batch]
+            for i, vector in zip(batch, self._run([texts[i] for i in batch])):
+                vectors[i] = vector
+        return np.stack(vectors)
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)  # padded to the longest text of this batch
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        with self._lock:
+            self.batches += 1
+            self.texts += len(texts)
+        return pooled.astype(np.float32)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = Thread(target=self._batch_loop, name="onnx-embeddings", daemon=True)
+                self._worker.start()
+
+    def _batch_loop(self):
+        while True:
+            pending = [self._queue.get()]
+            count = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                count += len(pending[-1][0])
+
+            try:
+                vectors = self._encode([text for texts, _ in pending for text in texts])
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for texts, future in pending:
+                future.set_result(vectors[offset:offset + len(texts)])
+                offset += len(texts)
+
+
+def export_model(output_dir: str, model_name: str = MODEL_NAME):
+    """Export `model_name` to ONNX and quantize its weights to int8 (dynamic quantization)."""
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    quantizer = ORTQuantizer.from_pretrained(output_dir)
+    quantizer.quantize(save_dir=output_dir,
+                       quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False))
+
+
+def schema_documents(db_path: str) -> List[Tuple[str, str]]:
+    """(table, text) per table of a SQLite file, in the same layout as the agent's schema index."""
+    from sqlalchemy import MetaData, create_engine
+
+    metadata = MetaData()
+    metadata.reflect(bind=create_engine(f"sqlite:///{db_path}"))
+    database = os.path.splitext(os.path.basename(db_path))[0]
+    docs = []
+    for table_name, table in metadata.tables.items():
+        lines = []
+        for column in table.columns:
+            line = f"{column.name} ({column.type})"
+            if column.primary_key:
+                line += " [PK]"
+            if column.foreign_keys:
+                line += f" [FK → {list(column.foreign_keys)[0].target_fullname}]"
+            lines.append(line)
+        docs.append((table_name, f"Schema: {database}\nTable: {table_name}\nColumns:\n" + "\n".join(lines)))
+    return docs
+
+
+def benchmark(reference: Embeddings, candidate: Embeddings, docs: List[Tuple[str, str]],
+              queries: List[str], k: int = 3, concurrency: int = 8) -> Dict:
+    """
+    Throughput, latency and retrieval parity of `candidate` against `reference`.
+
+    Parity is the overlap of the top-`k` tables each model retrieves per query, and
+    the cosine similarity between both models' vectors of the same documents.
+    """
+    texts = [text for _, text in docs]
+    report = {"documents": len(texts), "queries": len(queries), "k": k}
+    vectors = {}
+    for name, model in (("reference", reference), ("candidate", candidate)):
+        model.embed_documents(texts[:1] or ["warm up"])
+        started = time.perf_counter()
+        doc_vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+        doc_seconds = time.perf_counter() - started
+
+        latencies = []
+        query_vectors = []
+        for query in queries:
+            started = time.perf_counter()
+            query_vectors.append(model.embed_query(query))
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(model.embed_query, queries * 4))
+        concurrent_seconds = time.perf_counter() - started
+
+        vectors[name] = (doc_vectors, np.asarray(query_vectors, dtype=np.float32))
+        report[name] = {
+            "docs_per_second": round(len(texts) / doc_seconds, 1) if doc_seconds else None,
+            "query_ms_p50": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "query_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else None,
+            f"queries_per_second_x{concurrency}": round(len(queries) * 4 / concurrent_seconds, 1) if queries else None
+        }
+
+    (ref_docs, ref_queries), (cand_docs, cand_queries) = vectors["reference"], vectors["candidate"]
+    overlaps = []
+    for ref_query, cand_query in zip(ref_queries, cand_queries):
+        ref_top = set(np.argsort(-(ref_docs @ ref_query))[:k])
+        cand_top = set(np.argsort(-(cand_docs @ cand_query))[:k])
+        overlaps.append(len(ref_top & cand_top) / max(len(ref_top), 1))
+    report["parity"] = {
+        f"top{k}_overlap": round(float(np.mean(overlaps)), 4) if overlaps else None,
+        "top1_agreement": round(float(np.mean([
+            np.argmax(ref_docs @ r) == np.argmax(cand_docs @ c) for r, c in zip(ref_queries, cand_queries)
+        ])), 4) if overlaps else None,
+        "doc_cosine_mean": round(float(np.mean(np.sum(ref_docs * cand_docs, axis=1))), 4) if len(texts) else None
+    }
+    return report
+
+
+def default_queries(docs: List[Tuple[str, str]]) -> List[str]:
+    """Questions naming each table and one of its columns, in the phrasing users tend to use."""
+    queries = []
+    for table, text in docs:
+        columns = [line.split(" ", 1)[0] for line in text.split("Columns:\n", 1)[-1].splitlines()]
+        queries.append(f"how many {table} are there")
+        if len(columns) > 1:
+            queries.append(f"show {columns[-1].replace('_', ' ')} for each {table.rstrip('s')}")
+    return queries
+
+
+if __name__ == "__main__":
+    # python onnx_embeddings.py export [model_dir]
+    # python onnx_embeddings.py benchmark [model_dir] [path/to/db.sqlite] [questions.txt]
+    command = sys.argv[1] if len(sys.argv) > 1 else "benchmark"
+    model_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join("onnx_models", "all-MiniLM-L6-v2")
+    if command == "export":
+        export_model(model_dir)
+    else:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        docs = schema_documents(sys.argv[3] if len(sys.argv) > 3 else "ecommerce.db")
+        if len(sys.argv) > 4:
+            with open(sys.argv[4]) as f:
+                questions = [line.strip() for line in f if line.strip()]
+        else:
+            questions = default_queries(docs)
+        candidate = OnnxEmbeddings(model_dir)
+        report = benchmark(HuggingFaceEmbeddings(model_name=MODEL_NAME), candidate, docs, questions)
+        report["candidate"]["batching"] = candidate.stats()
+        print(json.dumps(report, indent=2))
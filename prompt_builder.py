@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+from functools import lru_cache
+from threading import Lock
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Input-token budget per model (context window minus room for the answer, capped for cost).
+# Override with PROMPT_BUDGETS='{"llama3-70b-8192": 5000}'
+DEFAULT_BUDGETS = {
+    "llama3-70b-8192": 6000,
+    "llama-3.1-8b-instant": 8000,
+    "llama-3.3-70b-versatile": 16000,
+    "gemini-2.0-flash": 32000,
+    "gemini-2.0-flash-lite": 32000,
+    "default": 8000,
+}
+TRIM_MARKER = "[...]"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """cl100k_base as a close-enough tokenizer for every provider; None if it cannot be loaded."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.getenv("PROMPT_TOKEN_ENCODING", "cl100k_base"))
+    except Exception as e:  # offline without a cached BPE file
+        logger.warning(f"tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """Cut `text` to `max_tokens`, keeping its start ("head") or its end ("tail")."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is None:
+        limit = max_tokens * 4
+        if len(text) <= limit:
+            return text
+        return text[:limit] + TRIM_MARKER if keep == "head" else TRIM_MARKER + text[-limit:]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    if keep == "head":
+        return encoding.decode(tokens[:max_tokens]) + TRIM_MARKER
+    return TRIM_MARKER + encoding.decode(tokens[-max_tokens:])
+
+
+def prompt_budget(model_names: List[str]) -> int:
+    """Budget for a failover chain: the smallest budget among its models."""
+    budgets = dict(DEFAULT_BUDGETS)
+    budgets.update(json.loads(os.getenv("PROMPT_BUDGETS", "{}")))
+    return min(budgets.get(name, budgets["default"]) for name in model_names or ["default"])
+
+
+class _Section:
+    __slots__ = ("name", "text", "priority", "keep", "tokens")
+
+    def __init__(self, name: str, text: str, priority: int, keep: str):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.keep = keep
+        self.tokens = count_tokens(self.text)
+
+
+class PromptBuilder:
+    """
+    Fills a prompt template while keeping it within a token budget.
+
+    Each placeholder of `template` is a section with a priority (0 = never trimmed).
+    Sections are granted budget in priority order, so lower-priority sections are
+    trimmed, and then dropped, first: the request, then schema, then recent history,
+    then older history. `keep` chooses which end of a trimmed section survives:
+    "head" for text ranked best-first (retrieved history), "tail" for chronological
+    text whose newest part matters most (the chat buffer).
+    After `build`, `report` holds the per-section token counts.
+    """
+
+    def __init__(self, template: str, budget: int, name: str = "prompt"):
+        self.template = template
+        self.budget = budget
+        self.name = name
+        self.sections: List[_Section] = []
+        self.report: Optional[Dict] = None
+
+    def add(self, name: str, text: str, priority: int = 0, keep: str = "head") -> "PromptBuilder":
+        self.sections.append(_Section(name, text, priority, keep))
+        return self
+
+    def build(self) -> str:
+        fixed = count_tokens(self.template.format(**{section.name: "" for section in self.sections}))
+        available = self.budget - fixed
+        filled = {}
+        report = {}
+        for section in sorted(self.sections, key=lambda s: s.priority):
+            if section.priority == 0 or section.tokens <= available:
+                text = section.text
+            else:
+                text = truncate_tokens(section.text, available, section.keep)
+            used = count_tokens(text)
+            available -= used
+            filled[section.name] = text
+            report[section.name] = {"tokens": section.tokens, "kept": used}
+
+        prompt = self.template.format(**filled)
+        total = count_tokens(prompt)
+        self.report = {
+            "prompt": self.name,
+            "budget": self.budget,
+            "template_tokens": fixed,
+            "total_tokens": total,
+            "trimmed_tokens": sum(entry["tokens"] - entry["kept"] for entry in report.values()),
+            "sections": report
+        }
+        prompt_stats.record(self.report)
+        logger.info(f"prompt_tokens {json.dumps(self.report)}")
+        return prompt
+
+
+class PromptStats:
+    """Per-prompt token totals, to measure what budgeting saves."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._prompts: Dict[str, Dict] = {}
+
+    def record(self, report: Dict):
+        with self._lock:
+            entry = self._prompts.setdefault(report["prompt"], {
+                "calls": 0, "total_tokens": 0, "trimmed_tokens": 0, "max_tokens": 0
+            })
+            entry["calls"] += 1
+            entry["total_tokens"] += report["total_tokens"]
+            entry["trimmed_tokens"] += report["trimmed_tokens"]
+            entry["max_tokens"] = max(entry["max_tokens"], report["total_tokens"])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                name: {**entry, "avg_tokens": round(entry["total_tokens"] / entry["calls"], 1)}
+                for name, entry in self._prompts.items()
+            }
+
+
+prompt_stats = PromptStats()
@@ -0,0 +1,382 @@
+import logging
+import os
+import pickle
+import secrets
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+ACTIVE = (QUEUED, RUNNING)
+
+JOB_COLUMNS = ("job_id", "owner", "connection_id", "sql", "status", "submitted_at", "started_at",
+               "finished_at", "error", "result_path", "row_count", "truncated", "worker")
+
+
+def worker_id() -> str:
+    """Host and process of the current worker; read per call, since gunicorn forks after import."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobLimitExceeded(RuntimeError):
+    """Raised when a user already has the maximum number of active jobs."""
+
+
+class QueryJob:
+    def __init__(self, owner, connection_id, sql: str):
+        self.job_id = secrets.token_urlsafe(12)
+        self.owner = owner
+        self.connection_id = connection_id
+        self.sql = sql
+        self.status = QUEUED
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result_path = None
+        self.row_count = None
+        self.truncated = False
+        self.worker = worker_id()
+        self.cancel_requested = Event()
+        self.cancel_fn: Optional[Callable[[], None]] = None  # interrupts the running statement
+        self.future = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "QueryJob":
+        """A read-only view of a job stored by any worker."""
+        job = cls.__new__(cls)
+        for name in JOB_COLUMNS:
+            setattr(job, name, row[name])
+        job.truncated = bool(job.truncated)
+        job.cancel_requested = Event()
+        if row["cancel_requested"]:
+            job.cancel_requested.set()
+        job.cancel_fn = None
+        job.future = None
+        return job
+
+    @property
+    def execution_time(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "connection_id": self.connection_id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "execution_time": self.execution_time,
+            "row_count": self.row_count,
+            "truncated": self.truncated,
+            "error": self.error
+        }
+
+
+def spill_frame(df: pd.DataFrame, path_stem: str) -> str:
+    """Write a result to Parquet, else Feather, else pickle; returns the file path."""
+    for extension, write in ((".parquet", df.to_parquet), (".feather", df.to_feather)):
+        try:
+            write(path_stem + extension)
+            return path_stem + extension
+        except ImportError:  # no pyarrow/fastparquet
+            continue
+        except (ValueError, TypeError):  # column types the format cannot store
+            continue
+    with open(path_stem + ".pkl", "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path_stem + ".pkl"
+
+
+def load_frame(path: str) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".feather"):
+        return pd.read_feather(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class QueryJobManager:
+    """
+    Runs long queries off the request thread.
+
+    Jobs run on a bounded pool of `max_workers` threads, and each user may have at
+    most `per_user_limit` queued or running jobs. Job records live in a SQLite file
+    at `db_path` and results are spilled to `spill_dir`, both shared by every worker
+    process, so any worker can report a job's status, serve its result or cancel it:
+    a cancel for a job running elsewhere is flagged in the file and picked up by the
+    owning worker within `poll_interval` seconds. Finished jobs and their files are
+    removed `ttl` seconds after completion, and active jobs of workers on this host
+    that have exited are marked failed. `on_finish(job)` runs on the worker thread
+    once a job reaches a final state, e.g. to record it in the query history.
+
+    Args:
+        spill_dir: Directory for result files.
+        db_path: SQLite file holding the job records.
+        max_workers: Number of queries executing at once.
+        per_user_limit: Active (queued or running) jobs allowed per user.
+        ttl: Seconds a finished job and its result are kept.
+        on_finish: Optional callback (job) run after every job.
+        poll_interval: Seconds between checks for cancels flagged by other workers.
+    """
+
+    def __init__(self, spill_dir: str, db_path: str, max_workers: int = 4, per_user_limit: int = 2,
+                 ttl: int = 3600, on_finish: Optional[Callable[[QueryJob], None]] = None,
+                 poll_interval: float = 1.0):
+        self.spill_dir = spill_dir
+        self.db_path = db_path
+        self.per_user_limit = per_user_limit
+        self.ttl = ttl
+        self.on_finish = on_finish
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-job")
+        self._jobs: Dict[str, QueryJob] = {}  # active jobs of this worker, with their futures
+        self._lock = Lock()
+        self._cleaner = None
+        self.submitted = 0
+        self.rejected = 0
+        os.makedirs(spill_dir, exist_ok=True)
+        self._init_db()
+
+    def submit(self, owner, connection_id, sql: str, run: Callable[[QueryJob], pd.DataFrame]) -> QueryJob:
+        """
+        Queue `run(job)` for execution. `run` returns the result DataFrame and may
+        set `job.cancel_fn` so a cancel request can interrupt the statement.
+        """
+        job = QueryJob(owner, connection_id, sql)
+        with self._connect() as conn:
+            # The limit spans all workers; the write lock makes count-and-insert atomic
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN ({','.join('?' * len(ACTIVE))})",
+                (owner, *ACTIVE)
+            ).fetchone()[0]
+            if active >= self.per_user_limit:
+                conn.execute("ROLLBACK")
+                with self._lock:
+                    self.rejected += 1
+                raise JobLimitExceeded(f"At most {self.per_user_limit} running queries per user")
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+                [getattr(job, name) for name in JOB_COLUMNS]
+            )
+            conn.execute("COMMIT")
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self.submitted += 1
+        job.future = self._executor.submit(self._run, job, run)
+        self._ensure_cleaner()
+        return job
+
+    def get(self, job_id: str, owner) -> Optional[QueryJob]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ? AND owner = ?", (job_id, owner)).fetchone()
+        return None if row is None else QueryJob.from_row(row)
+
+    def cancel(self, job_id: str, owner) -> Optional[QueryJob]:
+        job = self.get(job_id, owner)
+        if job is None or job.status in FINISHED:
+            return job
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+        with self._lock:
+            local = self._jobs.get(job_id)
+        if local is not None:
+            self._cancel_local(local)
+        else:
+            # Queued on another worker, which skips it when it gets to it; running ones see the flag
+            self._finish(job, CANCELLED, expected=QUEUED)
+        return self.get(job_id, owner)
+
+    def result(self, job_id: str, owner) -> Optional[pd.DataFrame]:
+        job = self.get(job_id, owner)
+        if job is None or job.status != SUCCEEDED or job.result_path is None:
+            return None
+        try:
+            return load_frame(job.result_path)
+        except FileNotFoundError:
+            return None
+
+    def cleanup(self):
+        """Drop finished jobs older than `ttl` with their result files, and fail jobs of dead workers."""
+        cutoff = time.time() - self.ttl
+        with self._connect() as conn:
+            expired = conn.execute(
+                f"SELECT job_id, result_path FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) "
+                "AND COALESCE(finished_at, 0) < ?", (*FINISHED, cutoff)
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(row["job_id"],) for row in expired])
+            orphaned = [
+                QueryJob.from_row(row) for row in conn.execute(
+                    f"SELECT * FROM jobs WHERE status IN ({','.join('?' * len(ACTIVE))})", ACTIVE
+                ).fetchall()
+                if not self._worker_alive(row["worker"])
+            ]
+        for row in expired:
+            self._remove_file(row["result_path"])
+        for job in orphaned:
+            self._finish(job, FAILED, error="worker exited", expected=job.status)
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            statuses = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        with self._lock:
+            return {
+                "jobs": sum(statuses.values()),
+                "statuses": statuses,
+                "local_active": len(self._jobs),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "per_user_limit": self.per_user_limit
+            }
+
+    def _run(self, job: QueryJob, run: Callable[[QueryJob], pd.DataFrame]):
+        job.started_at = time.time()
+        with self._connect() as conn:
+            started = conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ? WHERE job_id = ? AND status = ? AND cancel_requested = 0",
+                (RUNNING, job.started_at, job.job_id, QUEUED)
+            ).rowcount
+        if not started or job.cancel_requested.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        try:
+            df = run(job)
+            if job.cancel_requested.is_set():
+                self._finish(job, CANCELLED)
+                return
+            if list(df.columns) == ["Error"]:
+                self._finish(job, FAILED, error=str(df["Error"].iloc[0]))
+                return
+            job.result_path = spill_frame(df, os.path.join(self.spill_dir, job.job_id))
+            job.row_count = len(df)
+            job.truncated = bool(df.attrs.get("truncated", False))
+            self._finish(job, SUCCEEDED)
+        except Exception as e:
+            self._finish(job, CANCELLED if job.cancel_requested.is_set() else FAILED, error=str(e))
+
+    def _cancel_local(self, job: QueryJob):
+        job.cancel_requested.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        elif job.cancel_fn is not None:
+            try:
+                job.cancel_fn()
+            except Exception as e:
+                logger.warning(f"Cancelling job {job.job_id} failed: {e}")
+
+    def _finish(self, job: QueryJob, status: str, error: str = None, expected: str = None) -> bool:
+        """Move `job` to a final state once, across workers; False if it already had one."""
+        finished_at = time.time()
+        with self._connect() as conn:
+            changed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, result_path = ?, row_count = ?, "
+                f"truncated = ? WHERE job_id = ? AND status {'= ?' if expected else 'NOT IN (?, ?, ?)'}",
+                (status, error, finished_at, job.result_path, job.row_count, int(job.truncated), job.job_id,
+                 *((expected,) if expected else FINISHED))
+            ).rowcount
+        with self._lock:
+            self._jobs.pop(job.job_id, None)
+        if not changed:
+            if job.result_path and status == SUCCEEDED:
+                self._remove_file(job.result_path)  # cancelled meanwhile
+            return False
+        job.status, job.error, job.finished_at = status, error, finished_at
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logger.error(f"Query job callback failed for {job.job_id}: {e}")
+        return True
+
+    def _poll_cancels(self):
+        """Apply cancels that other workers flagged for jobs running here."""
+        with self._lock:
+            job_ids = [job_id for job_id, job in self._jobs.items() if not job.cancel_requested.is_set()]
+        if not job_ids:
+            return
+        with self._connect() as conn:
+            flagged = [row[0] for row in conn.execute(
+                f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({','.join('?' * len(job_ids))})",
+                job_ids
+            ).fetchall()]
+        for job_id in flagged:
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if job is not None:
+                self._cancel_local(job)
+
+    def _ensure_cleaner(self):
+        with self._lock:
+            if self._cleaner is None:
+                self._cleaner = Thread(target=self._clean_periodically, name="query-job-cleanup", daemon=True)
+                self._cleaner.start()
+
+    def _clean_periodically(self):
+        last_cleanup = time.monotonic()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._poll_cancels()
+                if time.monotonic() - last_cleanup >= min(self.ttl, 300):
+                    last_cleanup = time.monotonic()
+                    self.cleanup()
+            except Exception as e:
+                logger.warning(f"Query job maintenance failed: {e}")
+
+    @staticmethod
+    def _worker_alive(worker: str) -> bool:
+        """False only for workers on this host whose process is gone; other hosts are trusted."""
+        host, _, pid = (worker or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _remove_file(path: Optional[str]):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove result file {path}: {e}")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, owner, connection_id, sql TEXT, "
+                "status TEXT NOT NULL, submitted_at REAL, started_at REAL, finished_at REAL, error TEXT, "
+                "result_path TEXT, row_count INTEGER, truncated INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner_status ON jobs (owner, status)")
@@ -0,0 +1,89 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+_MISSING = object()
+
+
+def normalize_question(question: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.;")
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of chat results with TTL and optional data-version invalidation.
+
+    Keys combine the connection, the schema fingerprint, the user and the normalized
+    question, so identical text on another database or after a DDL change never hits.
+    When a `data_version` is stored with an entry, a lookup with a different version
+    treats the entry as stale.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: int = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, stored_at, data_version)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(connection_key: str, schema_fingerprint: Optional[str], user: str, question: str) -> str:
+        raw = "\x1f".join([connection_key or "", schema_fingerprint or "", user or "", normalize_question(question)])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str, data_version=None) -> Any:
+        """Return the cached value, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return None
+
+            value, stored_at, stored_version = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if stored_version is not None and data_version is not None and stored_version != data_version:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any, data_version=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), data_version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,194 @@
+import gzip
+import json
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow IPC is optional
+    pa = None
+
+try:
+    import brotli
+except ImportError:  # falls back to gzip
+    brotli = None
+
+FORMATS = ("records", "columnar", "arrow")
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+MIN_COMPRESS_BYTES = 1024  # smaller bodies are not worth compressing
+
+
+def read_capped(chunks: Iterable[pd.DataFrame], offset: int, max_rows: int, max_bytes: int) -> pd.DataFrame:
+    """
+    Collect streamed result chunks, skipping the first `offset` rows and stopping once
+    `max_rows` rows or `max_bytes` bytes have been collected. `df.attrs` records
+    `truncated`, `next_offset` (None when exhausted), `row_count` and `bytes`.
+    """
+    kept, rows, size, skipped = [], 0, 0, 0
+    truncated = False
+    columns = None
+    for chunk in chunks:
+        columns = chunk.columns
+        if skipped < offset:
+            drop = min(offset - skipped, len(chunk))
+            skipped += drop
+            chunk = chunk.iloc[drop:]
+            if chunk.empty:
+                continue
+        if rows >= max_rows or size >= max_bytes:
+            truncated = True
+            break
+        page = chunk.iloc[:max_rows - rows]
+        kept.append(page)
+        rows += len(page)
+        size += int(page.memory_usage(deep=True, index=False).sum())
+        if len(page) < len(chunk):
+            truncated = True  # the row cap cut this chunk short
+            break
+
+    if kept:
+        df = pd.concat(kept, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=columns if columns is not None else [])
+    df.attrs.update({
+        "truncated": truncated,
+        "next_offset": offset + rows if truncated else None,
+        "row_count": rows,
+        "bytes": size
+    })
+    return df
+
+
+def column_type(dtype) -> str:
+    """Wire type name for a pandas dtype."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    return "string"
+
+
+def encode_records(df: pd.DataFrame) -> List[Dict]:
+    """One dict per row (the original wire format)."""
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+def encode_rows(df: pd.DataFrame) -> Dict:
+    """Column names once plus one value array per row."""
+    table = json.loads(df.to_json(orient="split", index=False, date_format="iso"))
+    return {"columns": table["columns"], "data": table["data"]}
+
+
+def encode_columnar(df: pd.DataFrame) -> Dict:
+    """Column names and types once, then one typed value array per column."""
+    return {
+        "format": "columnar",
+        "columns": [str(column) for column in df.columns],
+        "types": [column_type(dtype) for dtype in df.dtypes],
+        "values": [
+            json.loads(df.iloc[:, i].to_json(orient="values", date_format="iso"))
+            for i in range(df.shape[1])
+        ],
+        "row_count": len(df)
+    }
+
+
+def encode_arrow(df: pd.DataFrame) -> bytes:
+    """Arrow IPC stream of the frame; requires pyarrow."""
+    if pa is None:
+        raise RuntimeError("Arrow format requires pyarrow")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def negotiate_format(requested: Optional[str]) -> str:
+    requested = (requested or "records").lower()
+    if requested not in FORMATS:
+        raise ValueError(f"Unknown result format '{requested}'; expected one of {', '.join(FORMATS)}")
+    if requested == "arrow" and pa is None:
+        return "columnar"
+    return requested
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported Content-Encoding from an Accept-Encoding header, or None."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Compress `body` with the negotiated encoding; returns (body, encoding actually used)."""
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body, quality=5), "br"
+    return gzip.compress(body, compresslevel=6), "gzip"
+
+
+def encode_json(payload: Dict, accept_encoding: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return compress(body, negotiate_encoding(accept_encoding))
+
+
+def benchmark(db_path: str = "ecommerce.db", repeat: int = 5) -> List[Dict]:
+    """Payload bytes and encode time per format for every table in a SQLite file."""
+    from sqlalchemy import create_engine, inspect
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    encoders = {
+        "records": lambda df: json.dumps(encode_records(df), separators=(",", ":")).encode(),
+        "rows": lambda df: json.dumps(encode_rows(df), separators=(",", ":")).encode(),
+        "columnar": lambda df: json.dumps(encode_columnar(df), separators=(",", ":")).encode(),
+    }
+    if pa is not None:
+        encoders["arrow"] = encode_arrow
+
+    report = []
+    with engine.connect() as conn:
+        for table in inspect(engine).get_table_names():
+            df = pd.read_sql_table(table, conn)
+            for name, encode in encoders.items():
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    body = encode(df)
+                encode_ms = (time.perf_counter() - started) * 1000 / repeat
+                report.append({
+                    "table": table,
+                    "rows": len(df),
+                    "format": name,
+                    "bytes": len(body),
+                    "gzip_bytes": len(gzip.compress(body, compresslevel=6)),
+                    "brotli_bytes": len(brotli.compress(body, quality=5)) if brotli is not None else None,
+                    "encode_ms": round(encode_ms, 2)
+                })
+    return report
+
+
+if __name__ == "__main__":
+    # python result_format.py [path/to/db.sqlite]
+    for row in benchmark(sys.argv[1] if len(sys.argv) > 1 else "ecommerce.db"):
+        print(json.dumps(row))
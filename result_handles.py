@@ -0,0 +1,137 @@
+import base64
+import json
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+
+class ResultHandle:
+    __slots__ = ("handle_id", "owner", "connection_id", "sql", "key_columns", "last_access")
+
+    def __init__(self, handle_id: str, owner, connection_id, sql: str, key_columns: List[str]):
+        self.handle_id = handle_id
+        self.owner = owner
+        self.connection_id = connection_id
+        self.sql = sql
+        self.key_columns = key_columns
+        self.last_access = time.time()
+
+    @property
+    def mode(self) -> str:
+        return "keyset" if self.key_columns else "offset"
+
+
+class ResultHandleStore:
+    """
+    Bounded registry of paginated query results.
+
+    A handle remembers the SQL of a result and how to page it: by keyset on the
+    primary key columns when the query returns them, else by offset. Pages are
+    addressed with opaque cursors that encode the handle and the position after
+    the last row served, so no rows are kept server-side between requests.
+    Handles live in a SQLite file at `db_path` shared by every worker process, so
+    any worker can serve the next page of a result opened by another.
+    """
+
+    def __init__(self, db_path: str, max_handles: int = 256, ttl: int = 1800):
+        self.db_path = db_path
+        self.max_handles = max_handles
+        self.ttl = ttl
+        self._lock = Lock()
+        self.opened = 0
+        self.expired = 0
+        self._init_db()
+
+    def open(self, owner, connection_id, sql: str, key_columns: List[str]) -> ResultHandle:
+        handle = ResultHandle(secrets.token_urlsafe(12), owner, connection_id, sql, list(key_columns))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = self._expire(conn)
+            conn.execute(
+                "INSERT INTO handles (handle_id, owner, connection_id, sql, key_columns, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (handle.handle_id, owner, connection_id, sql, json.dumps(handle.key_columns), handle.last_access)
+            )
+            # Least recently used handles beyond the cap
+            conn.execute(
+                "DELETE FROM handles WHERE handle_id NOT IN "
+                "(SELECT handle_id FROM handles ORDER BY last_access DESC LIMIT ?)", (self.max_handles,)
+            )
+            conn.execute("COMMIT")
+        with self._lock:
+            self.opened += 1
+            self.expired += expired
+        return handle
+
+    def get(self, handle_id: str, owner) -> Optional[ResultHandle]:
+        """The handle if it exists, has not expired and belongs to `owner`."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM handles WHERE handle_id = ? AND owner = ? AND last_access >= ?",
+                (handle_id, owner, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE handles SET last_access = ? WHERE handle_id = ?", (now, handle_id))
+        handle = ResultHandle(row["handle_id"], row["owner"], row["connection_id"], row["sql"],
+                              json.loads(row["key_columns"]))
+        handle.last_access = now
+        return handle
+
+    def close(self, handle_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM handles WHERE handle_id = ?", (handle_id,))
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            handles = conn.execute("SELECT COUNT(*) FROM handles").fetchone()[0]
+        with self._lock:
+            return {
+                "handles": handles,
+                "max_handles": self.max_handles,
+                "ttl": self.ttl,
+                "opened": self.opened,
+                "expired": self.expired
+            }
+
+    @staticmethod
+    def encode_cursor(handle: ResultHandle, position: Dict) -> str:
+        """`position` is {"after": [key values]} for keyset handles or {"offset": n}."""
+        raw = json.dumps({"h": handle.handle_id, **position}, separators=(",", ":"), default=str)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, Dict]:
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return position.pop("h"), position
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError("Invalid cursor")
+
+    def _expire(self, conn) -> int:
+        return conn.execute("DELETE FROM handles WHERE last_access < ?", (time.time() - self.ttl,)).rowcount
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS handles (handle_id TEXT PRIMARY KEY, owner, connection_id, "
+                "sql TEXT NOT NULL, key_columns TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS handles_last_access ON handles (last_access)")
@@ -1,17 +1,119 @@
 import os
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, Response, render_template, request, jsonify, flash, redirect, url_for
 from flask_login import login_required, current_user
 import json
 import os
-from db_connection import DBConnection
+from db_connection import DBConnection, cancel_query, running_queries
 import logging
 from models import Connection, QueryHistory
-from app import db
-from smart_sql_agent import DBExpertAgent, get_memory_for_session, chat_router, get_query_hash
+from app import app, db
+from prompt_builder import prompt_stats
+from smart_sql_agent import QUERY_MAX_ROWS, agent_registry, cost_guard, embedding_model, sql_stats, result_cache, result_handles, intent_classifier, llm_stats, session_store, get_memory_for_session, get_session_payload, save_memory_for_session, chat_router, get_query_hash
+from llm_limits import LLMQueueTimeout, breaker_stats, limiter_stats
+from result_handles import ResultHandleStore
+from query_jobs import JobLimitExceeded, QueryJobManager, SUCCEEDED
+from result_format import ARROW_MIMETYPE, compress, encode_arrow, encode_columnar, encode_json, encode_records, encode_rows, negotiate_encoding, negotiate_format
 
 main = Blueprint('main', __name__)
 logger = logging.getLogger(__name__)
 
+RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', 200))
+RESULT_PAGE_MAX = int(os.getenv('RESULT_PAGE_MAX', 2000))
+QUERY_JOB_MAX_ROWS = int(os.getenv('QUERY_JOB_MAX_ROWS', 1000000))
+QUERY_JOB_MAX_BYTES = int(os.getenv('QUERY_JOB_MAX_BYTES', 1024 * 1024 * 1024))
+QUERY_JOB_TIMEOUT = float(os.getenv('QUERY_JOB_TIMEOUT', 3600))
+
+
+def record_query_job(job):
+    """Save a finished query job to the history; runs on the job's worker thread."""
+    with app.app_context():
+        query_history = QueryHistory()
+        query_history.connection_id = job.connection_id
+        query_history.user_id = job.owner
+        query_history.query_text = job.sql
+        query_history.execution_time = job.execution_time
+        query_history.success = job.status == SUCCEEDED
+        query_history.error_message = job.error or (None if job.status == SUCCEEDED else job.status)
+        db.session.add(query_history)
+        db.session.commit()
+        db.session.remove()
+
+
+query_jobs = QueryJobManager(
+    spill_dir=os.getenv('QUERY_JOB_DIR', os.path.join('instance', 'query_jobs')),
+    db_path=os.getenv('QUERY_JOB_DB', os.path.join('instance', 'query_jobs.db')),
+    max_workers=int(os.getenv('QUERY_JOB_WORKERS', 4)),
+    per_user_limit=int(os.getenv('QUERY_JOB_PER_USER', 2)),
+    ttl=int(os.getenv('QUERY_JOB_TTL', 3600)),
+    on_finish=record_query_job
+)
+
+
+def get_agent_for_connection(connection):
+    """Return a warm DBExpertAgent for a saved connection, building it on first use."""
+    db_engine = DBConnection(
+        db_type=connection.db_type,
+        username=connection.username,
+        password=connection.get_password(),
+        host=connection.host,
+        port=connection.port,
+        database=os.path.normpath(
+            connection.database),  # Normalize database path
+        additional_params=json.loads(connection.additional_params or '{}'))
+    return agent_registry.get_agent(connection.id, db_engine)
+
+
+def result_response(payload, status=200):
+    """JSON response compressed according to the client's Accept-Encoding."""
+    body, encoding = encode_json(payload, request.headers.get('Accept-Encoding'))
+    response = Response(body, status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def table_response(result, result_format, meta):
+    """Encode a result DataFrame in the negotiated format, with `meta` alongside it."""
+    if result_format == 'arrow':
+        body, encoding = compress(encode_arrow(result),
+                                  negotiate_encoding(request.headers.get('Accept-Encoding')))
+        response = Response(body, mimetype=ARROW_MIMETYPE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['X-Result-Info'] = json.dumps(meta)
+        return response
+
+    table = encode_rows(result) if result_format == 'records' else encode_columnar(result)
+    return result_response({'success': True, **table, **meta})
+
+
+def page_limit(value):
+    """A client page size capped at RESULT_PAGE_MAX; ValueError unless it is a positive integer."""
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, RESULT_PAGE_MAX)
+
+
+def fetch_result_page(agent, handle, position, limit, timeout=None, query_id=None):
+    """Run one page of a result handle; returns (DataFrame, cursor for the next page or None)."""
+    result = agent.run_page(handle.sql, handle.key_columns, after=position.get('after'),
+                            offset=position.get('offset', 0), limit=limit,
+                            timeout=timeout, query_id=query_id)
+    if list(result.columns) == ['Error']:
+        raise RuntimeError(result['Error'].iloc[0])
+    if len(result) < limit:
+        return result, None
+
+    if handle.key_columns:
+        last = json.loads(result[handle.key_columns].iloc[-1].to_json(date_format='iso'))
+        position = {'after': [last[key] for key in handle.key_columns]}
+    else:
+        position = {'offset': position.get('offset', 0) + len(result)}
+    return result, ResultHandleStore.encode_cursor(handle, position)
+
 
 @main.route('/')
 def index():
@@ -43,6 +145,10 @@ def chat():
 
     if not user_input:
         return jsonify({'error': 'No message provided'}), 400
+    try:
+        result_format = negotiate_format(data.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Get memory for session
     memory = get_memory_for_session(session_id)
@@ -53,30 +159,14 @@ def chat():
         if not connection:
             return jsonify({'error': 'Connection not found'}), 404
 
-        db_engine = DBConnection(
-            db_type=connection.db_type,
-            username=connection.username,
-            password=connection.get_password(),
-            host=connection.host,
-            port=connection.port,
-            database=os.path.normpath(
-                connection.database),  # Normalize database path
-            additional_params=json.loads(connection.additional_params))
-
-        engine_result = db_engine.get_engine()
-
-        if not engine_result['success']:
-            return jsonify({
-                'success': False,
-                'message': engine_result['message']
-            }), 500
-
-        agent = DBExpertAgent(engine=db_engine)
-        df_dict, response, visualize_flag = chat_router(
+        agent = get_agent_for_connection(connection)
+        df, response, visualize_flag = chat_router(
             user_input, agent, memory)
+        save_memory_for_session(memory)
+        has_rows = df is not None and not df.empty
 
         # Save to query history if SQL was generated
-        if df_dict:
+        if has_rows:
             query_id = get_query_hash(user_input)
             query_history = QueryHistory(connection_id=connection_id,
                                          user_id=current_user.id,
@@ -86,11 +176,11 @@ def chat():
             db.session.commit()
 
         # Format response for frontend
-        if df_dict:
-            return jsonify({
+        if has_rows:
+            return result_response({
                 'success': True,
                 'response': response,
-                'data': df_dict,
+                'data': encode_records(df) if result_format == 'records' else encode_columnar(df),
                 'visualize': visualize_flag,
                 'type': 'sql_result'
             })
@@ -101,11 +191,24 @@ def chat():
                 'type': 'text'
             })
 
+    except LLMQueueTimeout as e:
+        logger.warning(f"LLM queue timeout in chat route: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error in chat route: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@main.route('/api/chat-payloads/<payload_id>')
+@login_required
+def api_chat_payload(payload_id):
+    """Return a full assistant response that chat memory keeps only as a reference."""
+    content = get_session_payload(f"user-{current_user.id}", payload_id)
+    if content is None:
+        return jsonify({'success': False, 'error': 'Payload not found'}), 404
+    return jsonify({'success': True, 'payload_id': payload_id, 'content': content})
+
+
 @main.route('/sql-agent')
 @login_required
 def sql_agent():
@@ -153,6 +256,7 @@ def connection():
                             'message': 'Connection not found'
                         }), 404
                     connection.update_from_dict(data)
+                    agent_registry.invalidate(connection.id)
                 else:
                     # Create new connection
                     connection = Connection.create_from_dict(
@@ -181,14 +285,11 @@ def test_db_connection():
 
     def test_connection(**kwargs):
         try:
-            db_conn = DBConnection(**kwargs)
-            result = db_conn.get_engine()
-            if result and result.get("success"):
-                return {"success": True, "message": result["message"]}
-            return {
-                "success": False,
-                "error": "Could not establish connection"
-            }
+            # A throwaway engine: probing must not leave a pool behind in the engine cache
+            success, message = DBConnection(**kwargs).test_connection()
+            if success:
+                return {"success": True, "message": message}
+            return {"success": False, "error": message or "Could not establish connection"}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -233,6 +334,7 @@ def delete_connection(connection_id):
     try:
         db.session.delete(connection)
         db.session.commit()
+        agent_registry.invalidate(connection_id)
         return jsonify({
             'success': True,
             'message': 'Connection deleted successfully'
@@ -274,25 +376,17 @@ def api_generate_sql():
 
     try:
         # Get AI-generated SQL
-        db_engine = DBConnection(
-            db_type=connection.db_type,
-            username=connection.username,
-            password=connection.get_password(),
-            host=connection.host,
-            port=connection.port,
-            database=os.path.normpath(
-                connection.database),  # Normalize database path
-            additional_params=json.loads(connection.additional_params))
-        engine_result = db_engine.get_engine()
-        if not engine_result['success']:
-            return jsonify({
-                'success': False,
-                'message': engine_result['message']
-            }), 500
-        agent = DBExpertAgent(engine=db_engine)
-        sql_query = agent.generate_sql(prompt, memory)
+        agent = get_agent_for_connection(connection)
+        sql_query = agent.repair_sql(prompt, memory, agent.generate_sql(prompt, memory))
+        save_memory_for_session(memory)
         print(sql_query)
         return jsonify({'success': True, 'sql': sql_query})
+    except LLMQueueTimeout as e:
+        logger.warning(f"LLM queue timeout generating SQL: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'AI service is busy, please retry: {str(e)}'
+        }), 503
     except Exception as e:
         logger.error(f"Error generating SQL: {str(e)}")
         return jsonify({
@@ -308,12 +402,35 @@ def api_run_query():
     data = request.get_json()
     connection_id = data.get('connection_id')
     sql_query = data.get('query')
+    offset = data.get('offset', 0)
+    max_rows = data.get('max_rows')
+    page_size = data.get('page_size')  # set to get a cursor for /api/result-page
+    timeout = data.get('timeout')
+    # Client-chosen id for /api/queries/<query_id>/cancel, scoped to the user
+    query_id = f"{current_user.id}:{data['query_id']}" if data.get('query_id') else None
 
     if not connection_id or not sql_query:
         return jsonify({
             'success': False,
             'message': 'Missing connection_id or query'
         }), 400
+    try:
+        result_format = negotiate_format(data.get('format'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        # Clients may ask for fewer rows than the server cap, never more
+        max_rows = QUERY_MAX_ROWS if max_rows is None else min(int(max_rows), QUERY_MAX_ROWS)
+        offset = int(offset)
+        if page_size is not None:
+            page_size = page_limit(page_size)
+        if max_rows < 1 or offset < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'max_rows and page_size must be positive integers and offset a non-negative integer'
+        }), 400
 
     connection = Connection.query.filter_by(id=connection_id,
                                             user_id=current_user.id).first()
@@ -329,24 +446,26 @@ def api_run_query():
 
     try:
         # Run the query
-        db_engine = DBConnection(
-            db_type=connection.db_type,
-            username=connection.username,
-            password=connection.get_password(),
-            host=connection.host,
-            port=connection.port,
-            database=os.path.normpath(
-                connection.database),  # Normalize database path
-            additional_params=json.loads(connection.additional_params))
-        engine_result = db_engine.get_engine()
-        if not engine_result['success']:
-            return jsonify({
-                'success': False,
-                'message': engine_result['message']
-            }), 500
-        agent = DBExpertAgent(engine=db_engine)
-        result = agent.run_query(sql_query)
+        agent = get_agent_for_connection(connection)
+        # Interactive queries may shorten, never extend, the connection's timeout
+        default_timeout = agent.db_connection.statement_timeout()
+        if timeout is not None and default_timeout:
+            timeout = min(float(timeout), default_timeout)
+        cursor = None
+        # Queries that cannot be paged (PRAGMA, unordered joins...) run in one shot
+        key_columns = agent.result_key_columns(sql_query) if page_size else None
+        if key_columns is not None:
+            handle = result_handles.open(current_user.id, connection.id, sql_query, key_columns)
+            result, cursor = fetch_result_page(agent, handle, {}, page_size, timeout=timeout, query_id=query_id)
+            if cursor is None:
+                result_handles.close(handle.handle_id)
+            result.attrs.update({'truncated': cursor is not None, 'row_count': len(result)})
+        else:
+            result = agent.run_query(sql_query, max_rows=max_rows, offset=offset,
+                                     timeout=timeout, query_id=query_id)
         execution_time = time.time() - start_time
+        if list(result.columns) == ['Error']:
+            raise RuntimeError(result['Error'].iloc[0])
 
         # Save query to history
         query_history = QueryHistory()
@@ -358,12 +477,11 @@ def api_run_query():
         db.session.add(query_history)
         db.session.commit()
 
-        return jsonify({
-            'success': True,
-            'columns': result.get('columns', []),
-            'data': result.get('data', []),
-            'visualization': result.get('visualization'),
-            'explanation': result.get('explanation'),
+        return table_response(result, result_format, {
+            'truncated': result.attrs.get('truncated', False),
+            'next_offset': result.attrs.get('next_offset'),
+            'cursor': cursor,
+            'row_count': result.attrs.get('row_count', len(result)),
             'execution_time': execution_time
         })
     except Exception as e:
@@ -388,6 +506,175 @@ def api_run_query():
         }), 500
 
 
+@main.route('/api/result-page')
+@login_required
+def api_result_page():
+    """Fetch the page of a paginated result that a cursor points to."""
+    try:
+        handle_id, position = ResultHandleStore.decode_cursor(request.args.get('cursor', ''))
+        result_format = negotiate_format(request.args.get('format'))
+        limit = page_limit(request.args.get('limit', RESULT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    handle = result_handles.get(handle_id, current_user.id)
+    if handle is None:
+        return jsonify({
+            'success': False,
+            'message': 'Result expired; run the query again'
+        }), 410
+
+    connection = Connection.query.filter_by(id=handle.connection_id,
+                                            user_id=current_user.id).first()
+    if not connection:
+        return jsonify({
+            'success': False,
+            'message': 'Connection not found'
+        }), 404
+
+    try:
+        agent = get_agent_for_connection(connection)
+        result, cursor = fetch_result_page(agent, handle, position, limit)
+    except Exception as e:
+        logger.error(f"Error fetching result page: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error fetching result page: {str(e)}'
+        }), 500
+    if cursor is None:
+        result_handles.close(handle.handle_id)
+
+    return table_response(result, result_format, {
+        'cursor': cursor,
+        'pagination': handle.mode,
+        'row_count': len(result)
+    })
+
+
+def run_query_job(agent, job):
+    """Job body: run the query under the job's id so cancelling interrupts the statement."""
+    job.cancel_fn = lambda: cancel_query(job.job_id)
+    return agent.run_query(job.sql, max_rows=QUERY_JOB_MAX_ROWS, max_bytes=QUERY_JOB_MAX_BYTES,
+                           timeout=QUERY_JOB_TIMEOUT, query_id=job.job_id)
+
+
+@main.route('/api/query-jobs', methods=['POST'])
+@login_required
+def api_submit_query_job():
+    """Run a SQL query in the background; poll the returned job for its result."""
+    data = request.get_json()
+    connection_id = data.get('connection_id')
+    sql_query = data.get('query')
+
+    if not connection_id or not sql_query:
+        return jsonify({
+            'success': False,
+            'message': 'Missing connection_id or query'
+        }), 400
+
+    connection = Connection.query.filter_by(id=connection_id,
+                                            user_id=current_user.id).first()
+    if not connection:
+        return jsonify({
+            'success': False,
+            'message': 'Connection not found'
+        }), 404
+
+    try:
+        agent = get_agent_for_connection(connection)
+        job = query_jobs.submit(current_user.id, connection.id, sql_query,
+                                lambda job: run_query_job(agent, job))
+    except JobLimitExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
+    except Exception as e:
+        logger.error(f"Error submitting query job: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error submitting query: {str(e)}'
+        }), 500
+
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+
+
+@main.route('/api/query-jobs/<job_id>')
+@login_required
+def api_query_job_status(job_id):
+    """Get the status of a query job."""
+    job = query_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
+@main.route('/api/query-jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def api_cancel_query_job(job_id):
+    """Cancel a queued or running query job."""
+    job = query_jobs.cancel(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+
+@main.route('/api/query-jobs/<job_id>/result')
+@login_required
+def api_query_job_result(job_id):
+    """Fetch rows of a finished query job, `limit` rows from `offset`."""
+    job = query_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    if job.status != SUCCEEDED:
+        return jsonify({
+            'success': False,
+            'message': f'Job is {job.status}',
+            'job': job.to_dict()
+        }), 409
+
+    try:
+        result_format = negotiate_format(request.args.get('format'))
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = page_limit(request.args.get('limit', RESULT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    result = query_jobs.result(job_id, current_user.id)
+    if result is None:
+        return jsonify({'success': False, 'message': 'Result expired'}), 410
+    page = result.iloc[offset:offset + limit].reset_index(drop=True)
+    next_offset = offset + len(page) if offset + len(page) < len(result) else None
+    return table_response(page, result_format, {
+        'row_count': job.row_count,
+        'truncated': job.truncated,
+        'next_offset': next_offset,
+        'execution_time': job.execution_time
+    })
+
+
+@main.route('/api/queries')
+@login_required
+def api_running_queries():
+    """List the current user's running queries that were started with a query_id."""
+    prefix = f"{current_user.id}:"
+    queries = running_queries(prefix)
+    for query in queries:
+        query['query_id'] = query['query_id'][len(prefix):]
+    return jsonify({'success': True, 'queries': queries})
+
+
+@main.route('/api/queries/<query_id>/cancel', methods=['POST'])
+@login_required
+def api_cancel_query(query_id):
+    """Cancel a running query started through /api/run-query with this query_id."""
+    try:
+        cancelled = cancel_query(f"{current_user.id}:{query_id}")
+    except Exception as e:
+        logger.error(f"Error cancelling query {query_id}: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error cancelling query: {str(e)}'}), 500
+    if not cancelled:
+        return jsonify({'success': False, 'message': 'Query is not running'}), 404
+    return jsonify({'success': True})
+
+
 @main.route('/api/schema-info/<int:connection_id>')
 @login_required
 def api_schema_info(connection_id):
@@ -401,22 +688,7 @@ def api_schema_info(connection_id):
         }), 404
 
     try:
-        db_engine = DBConnection(
-            db_type=connection.db_type,
-            username=connection.username,
-            password=connection.get_password(),
-            host=connection.host,
-            port=connection.port,
-            database=os.path.normpath(
-                connection.database),  # Normalize database path
-            additional_params=json.loads(connection.additional_params))
-        engine_result = db_engine.get_engine()
-        if not engine_result['success']:
-            return jsonify({
-                'success': False,
-                'message': engine_result['message']
-            }), 500
-        agent = DBExpertAgent(engine=db_engine)
+        agent = get_agent_for_connection(connection)
         schema = agent.schema_info
         return jsonify({'success': True, 'schema': schema})
     except Exception as e:
@@ -425,3 +697,25 @@ def api_schema_info(connection_id):
             'success': False,
             'message': f'Error getting schema info: {str(e)}'
         }), 500
+
+
+@main.route('/api/cache-stats')
+@login_required
+def api_cache_stats():
+    """Report hit/miss counters for the agent and result caches and the local intent path."""
+    return jsonify({
+        'success': True,
+        'agents': agent_registry.stats(),
+        'results': result_cache.stats(),
+        'intents': intent_classifier.stats(),
+        'llm_limits': limiter_stats(),
+        'llm_breakers': breaker_stats(),
+        'llm_hedging': llm_stats(),
+        'result_handles': result_handles.stats(),
+        'query_jobs': query_jobs.stats(),
+        'sql_guard': cost_guard.stats(),
+        'sql_validation': sql_stats.stats(),
+        'prompt_tokens': prompt_stats.stats(),
+        'sessions': session_store.stats(),
+        'embeddings': embedding_model.stats()
+    })
@@ -0,0 +1,102 @@
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+# (table, column, referenced table, referenced column)
+Join = Tuple[str, str, str, str]
+
+
+class SchemaGraph:
+    """
+    Undirected foreign-key graph over the tables of a schema.
+
+    Built from the `foreign_key` entries ("table.column" or "schema.table.column")
+    of reflected columns. Used to expand the tables a similarity search picked into
+    the smallest set that also contains the tables needed to join them.
+    """
+
+    def __init__(self):
+        self.edges: Dict[str, Dict[str, List[Join]]] = {}
+
+    @classmethod
+    def from_schema_info(cls, tables: Dict[str, Dict]) -> "SchemaGraph":
+        graph = cls()
+        by_name = {}
+        for table_key in tables:
+            by_name.setdefault(table_key.split(".")[-1].lower(), []).append(table_key)
+
+        for table_key, table_info in tables.items():
+            for column_name, attrs in table_info.get("columns", {}).items():
+                target = attrs.get("foreign_key")
+                if not target or "." not in target:
+                    continue
+                ref_table, _, ref_column = target.rpartition(".")
+                if ref_table not in tables:
+                    candidates = by_name.get(ref_table.split(".")[-1].lower(), [])
+                    if len(candidates) != 1:
+                        continue  # referenced table not in scope, or ambiguous across schemas
+                    ref_table = candidates[0]
+                graph.add_join((table_key, column_name, ref_table, ref_column))
+        return graph
+
+    def add_join(self, join: Join):
+        table, _, ref_table, _ = join
+        if table == ref_table:
+            return  # self-references never connect two tables
+        self.edges.setdefault(table, {}).setdefault(ref_table, []).append(join)
+        self.edges.setdefault(ref_table, {}).setdefault(table, []).append(join)
+
+    @property
+    def join_count(self) -> int:
+        return sum(len(joins) for neighbours in self.edges.values() for joins in neighbours.values()) // 2
+
+    def connect(self, seeds: List[str], max_hops: int = 3) -> List[str]:
+        """
+        Seeds plus the tables on short join paths between them, seeds first.
+
+        Greedy Steiner-tree approximation: each seed, in rank order, is attached to
+        the tables chosen so far by its shortest path of at most `max_hops` joins.
+        Seeds with no such path are kept on their own.
+        """
+        chosen: List[str] = []
+        for seed in dict.fromkeys(seeds):
+            if not chosen:
+                chosen.append(seed)
+                continue
+            path = self._shortest_path(set(chosen), seed, max_hops)
+            for table in path or [seed]:
+                if table not in chosen:
+                    chosen.append(table)
+        seeds = list(dict.fromkeys(seeds))
+        return seeds + [table for table in chosen if table not in seeds]
+
+    def joins_within(self, tables: List[str]) -> List[Join]:
+        """Foreign-key joins between members of `tables`, each once."""
+        members = set(tables)
+        joins = []
+        for table in tables:
+            for neighbour, neighbour_joins in self.edges.get(table, {}).items():
+                if neighbour in members:
+                    joins.extend(join for join in neighbour_joins if join not in joins)
+        return joins
+
+    def _shortest_path(self, sources: Set[str], target: str, max_hops: int) -> Optional[List[str]]:
+        """Tables from the nearest source to `target` (inclusive), by breadth-first search."""
+        if target in sources:
+            return [target]
+        previous = {source: None for source in sources}
+        frontier = deque((source, 0) for source in sources)
+        while frontier:
+            table, hops = frontier.popleft()
+            if hops == max_hops:
+                continue
+            for neighbour in self.edges.get(table, {}):
+                if neighbour in previous:
+                    continue
+                previous[neighbour] = table
+                if neighbour == target:
+                    path = [neighbour]
+                    while previous[path[-1]] is not None:
+                        path.append(previous[path[-1]])
+                    return path[::-1]
+                frontier.append((neighbour, hops + 1))
+        return None
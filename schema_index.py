@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores.faiss import FAISS
+
+
+class SchemaIndexUpdate:
+    def __init__(self, vectorstore: FAISS, fingerprint: str, changed: List[str], removed: List[str]):
+        self.vectorstore = vectorstore
+        self.fingerprint = fingerprint
+        self.changed = changed  # tables (re-)embedded
+        self.removed = removed  # tables whose chunks were deleted
+
+
+def table_hash(doc: Document) -> str:
+    return hashlib.sha256(doc.page_content.encode()).hexdigest()
+
+
+def schema_fingerprint(table_hashes: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(table_hashes, sort_keys=True).encode()).hexdigest()
+
+
+def chunk_tables(table_docs: Dict[str, Document], table_hashes: Dict[str, str],
+                 tables) -> Tuple[list, Dict[str, list]]:
+    """Chunks of `tables` and their ids, which carry the table name and a prefix of its hash."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+    chunks, ids_by_table = [], {}
+    for table_name in tables:
+        table_chunks = splitter.split_documents([table_docs[table_name]])
+        ids_by_table[table_name] = [
+            f"{table_name}:{table_hashes[table_name][:12]}:{i}" for i in range(len(table_chunks))
+        ]
+        chunks.extend(table_chunks)
+    return chunks, ids_by_table
+
+
+def update_schema_index(index_path: str, table_docs: Dict[str, Document], embeddings,
+                        manifest_info: Optional[Dict] = None) -> SchemaIndexUpdate:
+    """
+    Load or incrementally update the schema index stored at `index_path`.
+
+    Each table document is hashed; the schema fingerprint is the hash of all table
+    hashes. When the fingerprint stored in the index manifest matches, the index is
+    loaded as-is. Otherwise only the chunks of added, changed or dropped tables are
+    removed/re-embedded. `manifest_info` (dialect, database...) is stored alongside.
+    """
+    manifest_path = os.path.join(index_path, "manifest.json")
+    table_hashes = {name: table_hash(doc) for name, doc in table_docs.items()}
+    fingerprint = schema_fingerprint(table_hashes)
+
+    manifest = None
+    if os.path.exists(manifest_path) and os.path.exists(os.path.join(index_path, "index.faiss")):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if manifest and manifest.get("fingerprint") == fingerprint:
+        vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        return SchemaIndexUpdate(vectorstore, fingerprint, [], [])
+
+    if manifest is None:
+        changed, removed = list(table_docs), []
+        chunks, ids_by_table = chunk_tables(table_docs, table_hashes, changed)
+        ids = [chunk_id for table_name in changed for chunk_id in ids_by_table[table_name]]
+        vectorstore = FAISS.from_documents(chunks, embeddings, ids=ids)
+        indexed_tables = {}
+    else:
+        indexed_tables = manifest.get("tables", {})
+        changed = [
+            name for name, digest in table_hashes.items()
+            if indexed_tables.get(name, {}).get("hash") != digest
+        ]
+        removed = [name for name in indexed_tables if name not in table_hashes]
+
+        vectorstore = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+        stale_ids = [
+            chunk_id for name in changed + removed if name in indexed_tables
+            for chunk_id in indexed_tables[name]["ids"]
+        ]
+        if stale_ids:
+            vectorstore.delete(stale_ids)
+
+        chunks, ids_by_table = chunk_tables(table_docs, table_hashes, changed)
+        if chunks:
+            ids = [chunk_id for table_name in changed for chunk_id in ids_by_table[table_name]]
+            vectorstore.add_documents(chunks, ids=ids)
+
+    for name in removed:
+        indexed_tables.pop(name, None)
+    for name in changed:
+        indexed_tables[name] = {"hash": table_hashes[name], "ids": ids_by_table[name]}
+
+    os.makedirs(index_path, exist_ok=True)
+    vectorstore.save_local(index_path)
+    with open(manifest_path, "w") as f:
+        json.dump({**(manifest_info or {}), "fingerprint": fingerprint, "tables": indexed_tables}, f)
+    return SchemaIndexUpdate(vectorstore, fingerprint, changed, removed)
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from sqlalchemy import MetaData
+from sqlalchemy.pool import StaticPool
+
+
+def reflect_tables(engine, table_keys, workers: int = 8, batch_size: int = 50) -> Dict[str, Dict]:
+    """
+    Column detail ({column: info}) per table key ("table" or "schema.table"), reflected
+    on a thread pool of up to `workers` threads in per-schema batches of `batch_size`.
+    """
+    by_schema = {}
+    for table_key in table_keys:
+        schema_name, _, table_name = table_key.rpartition(".")
+        by_schema.setdefault(schema_name or None, []).append(table_name)
+
+    batches = [
+        (schema_name, tables[i:i + batch_size])
+        for schema_name, tables in by_schema.items()
+        for i in range(0, len(tables), batch_size)
+    ]
+    if not batches:
+        return {}
+
+    def reflect_batch(batch):
+        schema_name, tables = batch
+        metadata = MetaData()
+        metadata.reflect(bind=engine, schema=schema_name, only=tables)
+        return metadata.tables.items()
+
+    # A StaticPool shares one DBAPI connection, which must not be used concurrently
+    workers = 1 if isinstance(engine.pool, StaticPool) else min(workers, len(batches))
+    columns = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for reflected in executor.map(reflect_batch, batches):
+            for table_key, table in reflected:
+                columns[table_key] = column_info(table)
+    return columns
+
+
+def column_info(table) -> Dict:
+    columns = {}
+    for table_column in table.columns:
+        col_info = {
+            'type': str(table_column.type),
+            'primary_key': table_column.primary_key,
+            'nullable': table_column.nullable,
+            'default': str(table_column.default.arg) if table_column.default is not None else None,
+            'foreign_key': None
+        }
+        if table_column.foreign_keys:
+            fk = list(table_column.foreign_keys)[0]
+            col_info['foreign_key'] = str(fk.target_fullname)
+        columns[table_column.name] = col_info
+    return columns
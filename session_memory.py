@@ -0,0 +1,110 @@
+from typing import Any, Dict, List
+
+from langchain.memory import ConversationBufferMemory
+from langchain.schema import AIMessage, SystemMessage
+
+from prompt_builder import count_tokens, truncate_tokens
+
+
+class SessionMemory(ConversationBufferMemory):
+    """
+    Windowed, token-bounded conversation memory for one session.
+
+    The last `window_turns` exchanges are kept verbatim; older messages are cut to
+    `compact_tokens` each, since the history index and the background summarizer
+    already hold their full text. Assistant messages over `payload_tokens` (scripts,
+    ER descriptions) are written to `payload_store` and replaced by a reference
+    with a short preview; the history index reads their full text back from the
+    store when it vectorizes them. If the session still exceeds `max_tokens`, the oldest
+    messages are dropped and counted in a leading marker message, so message
+    positions stay absolute (`omitted + index`) for the history index watermark.
+    """
+    session_id: str = ""
+    window_turns: int = 6
+    max_tokens: int = 4000
+    payload_tokens: int = 300
+    compact_tokens: int = 60
+    payload_store: Any = None  # object with put_payload(session_id, content) / delete_payloads(session_id, ids)
+
+    @property
+    def omitted(self) -> int:
+        """Messages dropped from the front of this session so far."""
+        messages = self.chat_memory.messages
+        if messages and isinstance(messages[0], SystemMessage):
+            return messages[0].additional_kwargs.get("omitted", 0)
+        return 0
+
+    def add_turn(self, user_input: str, output: str):
+        self.chat_memory.add_user_message(user_input)
+        self.chat_memory.add_ai_message(output)
+        self.compact()
+
+    def replace_last_output(self, output: str):
+        """Swap the latest assistant message, e.g. for a rewritten query."""
+        messages = self.chat_memory.messages
+        if not messages or not isinstance(messages[-1], AIMessage):
+            self.chat_memory.add_ai_message(output)
+        else:
+            self._release([messages[-1]])
+            messages[-1] = AIMessage(content=output)
+        self.compact()
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        self.compact()
+
+    def token_count(self) -> int:
+        return sum(count_tokens(message.content) for message in self.chat_memory.messages)
+
+    def compact(self):
+        messages = self.chat_memory.messages
+        omitted = self.omitted
+        if omitted:
+            messages.pop(0)
+
+        for index, message in enumerate(messages):
+            if isinstance(message, AIMessage) and "payload_id" not in message.additional_kwargs:
+                tokens = count_tokens(message.content)
+                if tokens > self.payload_tokens and self.payload_store is not None:
+                    messages[index] = self._offload(message.content, tokens)
+
+        window_start = max(0, len(messages) - 2 * self.window_turns)
+        for index in range(window_start):
+            message = messages[index]
+            if not message.additional_kwargs.get("compacted"):
+                if "payload_id" in message.additional_kwargs:
+                    content = message.content.split("\n", 1)[0]  # the reference without its preview
+                else:
+                    content = truncate_tokens(message.content, self.compact_tokens)
+                messages[index] = type(message)(content=content, additional_kwargs={
+                    **message.additional_kwargs, "compacted": True
+                })
+
+        # Hard ceiling: drop from the front, but never the latest exchange
+        total = sum(count_tokens(message.content) for message in messages)
+        dropped = []
+        while total > self.max_tokens and len(messages) > 2:
+            message = messages.pop(0)
+            total -= count_tokens(message.content)
+            dropped.append(message)
+        self._release(dropped)
+
+        omitted += len(dropped)
+        if omitted:
+            messages.insert(0, SystemMessage(
+                content=f"[{omitted} earlier messages omitted]", additional_kwargs={"omitted": omitted}
+            ))
+
+    def _offload(self, content: str, tokens: int) -> AIMessage:
+        payload_id = self.payload_store.put_payload(self.session_id, content)
+        preview = truncate_tokens(content, self.compact_tokens)
+        return AIMessage(
+            content=f"[response of {tokens} tokens stored as payload {payload_id}]\n{preview}",
+            additional_kwargs={"payload_id": payload_id}
+        )
+
+    def _release(self, messages: List):
+        payload_ids = [message.additional_kwargs["payload_id"] for message in messages
+                       if "payload_id" in message.additional_kwargs]
+        if payload_ids and self.payload_store is not None:
+            self.payload_store.delete_payloads(self.session_id, payload_ids)
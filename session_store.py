@@ -0,0 +1,244 @@
+import json
+import os
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from langchain.schema import SystemMessage, messages_from_dict, messages_to_dict
+
+
+def _position(messages: List) -> int:
+    """Messages a session has had in total: those listed plus those counted by a leading omitted marker."""
+    if messages and isinstance(messages[0], SystemMessage) and "omitted" in messages[0].additional_kwargs:
+        return messages[0].additional_kwargs["omitted"] + len(messages) - 1
+    return len(messages)
+
+
+class _HotEntry:
+    __slots__ = ("memory", "version", "position", "last_access")
+
+    def __init__(self, memory, version: int):
+        self.memory = memory
+        self.version = version
+        self.position = _position(memory.chat_memory.messages)  # as of `version`
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    """
+    Two-tier store for per-session conversation memory.
+
+    The hot tier is an in-process LRU bounded by `max_sessions` and `ttl` seconds of
+    inactivity, in front of a SQLite file that every worker process shares. `save`
+    writes each modified session through to the file, so sessions leaving the hot
+    tier are simply dropped (writing them back could overwrite newer turns saved by
+    another worker) and lazily loaded again on the next access. Each stored session
+    carries a version number; a worker whose hot copy is older than the shared one
+    reloads it, so all gunicorn workers see the same conversation. Saves are
+    compare-and-set on that version: if another worker saved the session first, the
+    messages added here are re-applied on top of its copy and the save retried, so
+    concurrent turns are merged instead of the last writer winning. Large assistant
+    responses are kept out of the message list in a `payloads` table of the same
+    file and referenced by id.
+
+    Args:
+        memory_factory: Callable (session_id) -> empty memory object exposing
+            `.chat_memory.messages`.
+        db_path: SQLite file backing the shared tier.
+        max_sessions: Maximum number of sessions kept in RAM.
+        ttl: Seconds of inactivity after which a session leaves RAM.
+    """
+
+    def __init__(self, memory_factory: Callable[[str], object], db_path: str,
+                 max_sessions: int = 256, ttl: int = 3600):
+        self.memory_factory = memory_factory
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._hot: "OrderedDict[str, _HotEntry]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._init_db()
+
+    def get(self, session_id: str):
+        with self._lock:
+            self._expire()
+            entry = self._hot.get(session_id)
+        # Messages are read and parsed only if another worker has written a newer version
+        stored_version, payload = self._fetch(session_id, entry.version if entry is not None else -1)
+
+        if entry is not None and payload is None:
+            with self._lock:
+                entry.last_access = time.monotonic()
+                if self._hot.get(session_id) is entry:
+                    self._hot.move_to_end(session_id)
+                self.hits += 1
+            return entry.memory
+
+        # Not in RAM, or stale
+        memory = self.memory_factory(session_id)
+        if payload is not None:
+            memory.chat_memory.messages = messages_from_dict(json.loads(payload))
+        fresh = _HotEntry(memory, stored_version or 0)
+        with self._lock:
+            current = self._hot.get(session_id)
+            if current is not None and current is not entry and current.version >= fresh.version:
+                fresh = current  # another thread loaded it meanwhile
+            if payload is not None:
+                self.loads += 1
+            self._hot[session_id] = fresh
+            self._hot.move_to_end(session_id)
+            while len(self._hot) > self.max_sessions:
+                self._hot.popitem(last=False)
+                self.evictions += 1
+        return fresh.memory
+
+    def save(self, memory):
+        """Write a session through to the shared tier after it has been modified."""
+        session_id = memory.session_id
+        with self._lock:
+            entry = self._hot.get(session_id)
+            tracked = entry is not None and entry.memory is memory
+            # A copy that left the hot tier has no known base; treat it as conflicting
+            expected, position = (entry.version, entry.position) if tracked else (None, None)
+
+        while True:
+            if expected is not None:
+                version = self._write(session_id, memory, expected)
+                if version is not None:
+                    break
+            # Another worker saved first: re-apply the messages added since `position` on its copy
+            stored_version, payload = self._fetch(session_id, -1)
+            stored = messages_from_dict(json.loads(payload)) if payload is not None else []
+            messages = memory.chat_memory.messages
+            added = _position(messages) - (_position(stored) if position is None else position)
+            added = max(0, min(added, len(messages)))
+            memory.chat_memory.messages = stored + (messages[len(messages) - added:] if added else [])
+            if hasattr(memory, "compact"):
+                memory.compact()
+            expected, position = stored_version or 0, _position(stored)
+
+        with self._lock:
+            entry = self._hot.get(session_id)
+            if entry is None or entry.memory is memory or entry.version < version:
+                entry = _HotEntry(memory, version)
+                self._hot[session_id] = entry
+            self._hot.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._hot.pop(session_id, None)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM payloads WHERE session_id = ?", (session_id,))
+
+    def put_payload(self, session_id: str, content: str) -> str:
+        payload_id = secrets.token_urlsafe(9)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO payloads (payload_id, session_id, content, created_at) VALUES (?, ?, ?, ?)",
+                (payload_id, session_id, content, time.time())
+            )
+        return payload_id
+
+    def get_payload(self, session_id: str, payload_id: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT content FROM payloads WHERE payload_id = ? AND session_id = ?", (payload_id, session_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete_payloads(self, session_id: str, payload_ids: List[str]):
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM payloads WHERE payload_id = ? AND session_id = ?",
+                [(payload_id, session_id) for payload_id in payload_ids]
+            )
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            payloads = conn.execute("SELECT COUNT(*) FROM payloads").fetchone()[0]
+        with self._lock:
+            return {
+                "hot_sessions": len(self._hot),
+                "stored_sessions": stored,
+                "payloads": payloads,
+                "max_sessions": self.max_sessions,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, entry in self._hot.items()
+            if now - entry.last_access > self.ttl
+        ]
+        for session_id in expired:
+            del self._hot[session_id]
+        self.evictions += len(expired)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, "
+                "messages TEXT NOT NULL, "
+                "version INTEGER NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                "payload_id TEXT PRIMARY KEY, "
+                "session_id TEXT NOT NULL, "
+                "content TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS payloads_session ON payloads (session_id)")
+
+    def _fetch(self, session_id: str, known_version: int):
+        """(stored version or None, serialized messages if newer than `known_version` else None)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT version, CASE WHEN version > ? THEN messages END FROM sessions WHERE session_id = ?",
+                (known_version, session_id)
+            ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def _write(self, session_id: str, memory, expected: int) -> Optional[int]:
+        """Store the messages if the stored version is still `expected`; the new version, or None on conflict."""
+        payload = json.dumps(messages_to_dict(memory.chat_memory.messages))
+        with self._connect() as conn:
+            if expected == 0:
+                written = conn.execute(
+                    "INSERT INTO sessions (session_id, messages, version, updated_at) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(session_id) DO NOTHING", (session_id, payload, time.time())
+                ).rowcount
+            else:
+                written = conn.execute(
+                    "UPDATE sessions SET messages = ?, version = version + 1, updated_at = ? "
+                    "WHERE session_id = ? AND version = ?", (payload, time.time(), session_id, expected)
+                ).rowcount
+        return expected + 1 if written else None
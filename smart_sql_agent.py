@@ -1,27 +1,22 @@
 import os
 import sys
+import atexit
 import time
-import random
-import tiktoken
 import json
 import logging
 import hashlib
+import re
 import nest_asyncio
 import pandas as pd
 import dtale
-from threading import BoundedSemaphore
-from typing import Dict, Tuple, Literal
+from threading import BoundedSemaphore, Lock, Thread
+from typing import Dict, List, Optional, Tuple, Literal
 from dotenv import load_dotenv
 from functools import lru_cache
-from sqlalchemy import create_engine, inspect, text, MetaData
+from sqlalchemy import and_, column, inspect, literal_column, or_, select, text
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import Runnable
-from langchain.docstore.document import Document
-import faiss
 from langchain.vectorstores.faiss import FAISS
-from langchain.docstore import InMemoryDocstore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.chains.summarize import load_summarize_chain
 from langchain.schema import Document
@@ -29,7 +24,26 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.llms import HuggingFaceHub
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
-from db_connection import DBConnection
+from db_connection import DBConnection, guarded_connection
+from history_summarizer import HistorySummarizer
+from history_index import ShardedHistoryIndex
+from session_store import SessionStore
+from session_memory import SessionMemory
+from result_cache import ResultCache
+from schema_graph import SchemaGraph
+from embedding_cache import CachedEmbeddings
+from onnx_embeddings import OnnxEmbeddings
+from result_handles import ResultHandleStore
+from sql_guard import REJECT, CostGuard
+from prompt_builder import PromptBuilder, prompt_budget
+from sql_validator import (SQLValidationStats, ValidationResult, offset_page_sql, pageable_sql,
+                           referenced_tables, sanitize_sql, table_aliases, validate_sql)
+from intent_classifier import LocalIntentClassifier
+from llm_wrapper import SafeLLMWrapper
+from agent_registry import AgentRegistry, connection_fingerprint
+from schema_index import update_schema_index
+from schema_reflection import reflect_tables
+from result_format import read_capped
 # from buildvector import build_vector_index, build_history_vector_index
 
 
@@ -44,9 +58,55 @@ def log_event(event_type, data):
     logging.info(json.dumps({"event": event_type, "data": data}))
 
 # ---------------------- Config ----------------------
-INDEX_FOLDER = "schema_index"
-HISTORY_INDEX_FOLDER = "history_index"
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+# "huggingface" (PyTorch sentence-transformers) or "onnx" (int8 export, see onnx_embeddings.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface").lower()
+# Vectors from different backends are close but not identical, so each keeps its own indexes
+_INDEX_SUFFIX = "" if EMBEDDING_BACKEND == "huggingface" else f"_{EMBEDDING_BACKEND}"
+INDEX_FOLDER = f"schema_index{_INDEX_SUFFIX}"
+HISTORY_INDEX_FOLDER = f"history_index{_INDEX_SUFFIX}"
+INDEX_SAVE_INTERVAL = float(os.getenv("INDEX_SAVE_INTERVAL", 5))
+SCHEMA_SNAPSHOT_FOLDER = "schema_snapshots"
+REFLECTION_WORKERS = int(os.getenv("SCHEMA_REFLECTION_WORKERS", 8))
+REFLECTION_BATCH_SIZE = int(os.getenv("SCHEMA_REFLECTION_BATCH_SIZE", 50))
+SYSTEM_SCHEMAS = {"information_schema", "pg_catalog", "pg_toast", "sys", "mysql", "performance_schema"}
+
+# Schema retrieval: ANN over table chunks, then foreign-key expansion, then a column budget
+SCHEMA_SEARCH_FANOUT = int(os.getenv("SCHEMA_SEARCH_FANOUT", 4))  # chunks fetched per wanted table
+SCHEMA_GRAPH_MAX_HOPS = int(os.getenv("SCHEMA_GRAPH_MAX_HOPS", 3))
+SCHEMA_CONTEXT_COLUMNS = int(os.getenv("SCHEMA_CONTEXT_COLUMNS", 80))
+
+# Catalog queries whose result changes whenever DDL runs; used to key the schema snapshot
+DDL_VERSION_QUERIES = {
+    "sqlite": "PRAGMA schema_version",
+    "mysql": "SELECT MAX(create_time) FROM information_schema.tables WHERE table_schema = DATABASE()",
+    "mariadb": "SELECT MAX(create_time) FROM information_schema.tables WHERE table_schema = DATABASE()",
+    "snowflake": "SELECT MAX(last_ddl) FROM information_schema.tables",
+}
+
+# Per-dialect queries for ResultCache data-version invalidation
+DATA_VERSION_QUERIES = {
+    # In-memory only (files use mtime/size): schema changes plus rows changed by the one shared connection
+    "sqlite": "SELECT (SELECT schema_version FROM pragma_schema_version) || ':' || total_changes()",
+    "postgresql": "SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) FROM pg_stat_user_tables",
+}
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+if EMBEDDING_BACKEND == "onnx":
+    base_embeddings = OnnxEmbeddings(
+        os.getenv("ONNX_MODEL_DIR", os.path.join("onnx_models", "all-MiniLM-L6-v2")),
+        max_batch=int(os.getenv("ONNX_MAX_BATCH", 32)),
+        max_wait_ms=float(os.getenv("ONNX_MAX_WAIT_MS", 5)),
+        threads=int(os.getenv("ONNX_THREADS", 0)) or None
+    )
+else:
+    base_embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+# Content-hash cache shared by all workers: identical text is embedded once
+embedding_model = CachedEmbeddings(
+    base_embeddings,
+    model_name=EMBEDDING_MODEL + _INDEX_SUFFIX,
+    cache_dir=os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"),
+    max_memory=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+)
 huggingface_api_token = os.getenv('HUGGINGFACEHUB_API_TOKEN')
 
 # Optional: HuggingFace summarization model (skip if not summarizing)
@@ -56,117 +116,501 @@ summarizer_llm = HuggingFaceHub(
     huggingfacehub_api_token=huggingface_api_token
 )
 
+# ---------------------- History Summarization ----------------------
+def summarize_history_segment(previous_summary, texts) -> str:
+    """Fold a new segment of conversation into the previous summary with `summarizer_llm`."""
+    docs = [Document(page_content=text) for text in texts]
+    if previous_summary:
+        docs.insert(0, Document(page_content=f"Summary of the conversation so far: {previous_summary}"))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=50)
+    chunks = splitter.split_documents(docs)
+    summarize_chain = load_summarize_chain(summarizer_llm, chain_type="map_reduce") #chain_type="stuff" is directly pass history
+    return summarize_chain.run(chunks)
+
+
+history_summarizer = HistorySummarizer(summarize_history_segment)
+
 # ---------------------- Memory Management ----------------------
-user_memories = {}
+# Per-session memory: last N turns verbatim, older ones compacted, large responses out of band
+MEMORY_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", 6))
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", 4000))
+MEMORY_PAYLOAD_TOKENS = int(os.getenv("MEMORY_PAYLOAD_TOKENS", 300))
+MEMORY_COMPACT_TOKENS = int(os.getenv("MEMORY_COMPACT_TOKENS", 60))
+
+
+def new_session_memory(session_id: str) -> SessionMemory:
+    return SessionMemory(
+        session_id=session_id, memory_key="chat_history", return_messages=True,
+        window_turns=MEMORY_WINDOW_TURNS, max_tokens=MEMORY_MAX_TOKENS,
+        payload_tokens=MEMORY_PAYLOAD_TOKENS, compact_tokens=MEMORY_COMPACT_TOKENS,
+        payload_store=session_store
+    )
+
+
+# Hot LRU/TTL tier in this process, spilling to a SQLite file shared by all workers
+session_store = SessionStore(
+    new_session_memory,
+    db_path=os.getenv("SESSION_STORE_PATH", os.path.join("instance", "sessions.db")),
+    max_sessions=int(os.getenv("SESSION_CACHE_SIZE", 256)),
+    ttl=int(os.getenv("SESSION_CACHE_TTL", 3600))
+)
 
 # @lru_cache(maxsize=100)
 def get_memory_for_session(session_id: str):
-    if session_id not in user_memories:
-        user_memories[session_id] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-    return user_memories[session_id]
+    return session_store.get(session_id)
+
+
+def save_memory_for_session(memory):
+    """Persist a session's memory to the shared tier once a turn has modified it."""
+    session_store.save(memory)
+
+
+def get_session_payload(session_id: str, payload_id: str) -> Optional[str]:
+    """Full text of an assistant response that memory keeps only as a reference."""
+    return session_store.get_payload(session_id, payload_id)
+
+# ---------------------- Index Persistence ----------------------
+class DeferredIndexSaver:
+    """
+    Batches FAISS `save_local` calls and runs them on a background thread.
+
+    Repeated schedules for the same path within one interval collapse into a single
+    write, so the request path only pays for the in-memory `add_documents`.
+    """
+
+    def __init__(self, interval: float = INDEX_SAVE_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # path -> (vectorstore, lock)
+        self._lock = Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def schedule(self, vectorstore, path: str, store_lock=None):
+        with self._lock:
+            self._pending[path] = (vectorstore, store_lock)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="index-saver", daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for path, (vectorstore, store_lock) in pending.items():
+            try:
+                if store_lock is not None:
+                    with store_lock:
+                        vectorstore.save_local(path)
+                else:
+                    vectorstore.save_local(path)
+            except Exception as e:
+                log_event("index_save_error", {"path": path, "error": str(e)})
 
-# ---------------------- SQL Sanitizer (Stub) ----------------------
-def sanitize_sql(sql: str) -> str:
-    return sql.strip()
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+index_saver = DeferredIndexSaver()
+
+# ---------------------- History Index ----------------------
+HISTORY_MAX_LOADED_SHARDS = int(os.getenv("HISTORY_MAX_LOADED_SHARDS", 64))
+HISTORY_MAX_VECTORS_PER_SESSION = int(os.getenv("HISTORY_MAX_VECTORS_PER_SESSION", 2000))
+
+history_index = ShardedHistoryIndex(
+    HISTORY_INDEX_FOLDER,
+    embedding_model,
+    saver=index_saver,
+    max_loaded_shards=HISTORY_MAX_LOADED_SHARDS,
+    max_vectors=HISTORY_MAX_VECTORS_PER_SESSION
+)
+# Index each roll-up summary and drop the chunks it supersedes
+history_summarizer.on_summary = history_index.add_summary
+history_summarizer.load_summary = history_index.summary
+
+# ---------------------- SQL Validation ----------------------
+# Local validation of generated SQL before it reaches the database
+SQL_REPAIR_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", 2))
+sql_stats = SQLValidationStats()
 
 # ---------------------- Query Cache ----------------------
 @lru_cache(maxsize=100)
 def get_query_hash(query: str) -> str:
     return hashlib.md5(query.encode()).hexdigest()
 
-query_cache = {}
+# Bounded, TTL'd and keyed by connection + schema fingerprint + user + normalized question
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", 512)),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", 600))
+)
+CHECK_DATA_VERSION = os.getenv("RESULT_CACHE_CHECK_DATA_VERSION", "true").lower() == "true"
+
+# Paginated results; see DBExpertAgent.run_page
+result_handles = ResultHandleStore(
+    db_path=os.getenv("RESULT_HANDLES_DB", os.path.join("instance", "result_handles.db")),
+    max_handles=int(os.getenv("RESULT_HANDLES_MAX", 256)),
+    ttl=int(os.getenv("RESULT_HANDLES_TTL", 1800))
+)
+# Queries that cannot be paged by primary key without changing their meaning
+NON_KEYSET_SQL = re.compile(
+    r"\b(join|union|intersect|except|group\s+by|distinct|order\s+by|limit|offset|fetch|top)\b", re.I
+)
+
+# ---------------------- Query Limits ----------------------
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", 10000))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", 50 * 1024 * 1024))
+QUERY_CHUNK_SIZE = int(os.getenv("QUERY_CHUNK_SIZE", 1000))
+
+# ---------------------- Cost Guard ----------------------
+# EXPLAIN-based check of generated SQL before it runs; see sql_guard.CostGuard
+GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() == "true"
+GUARD_MAX_REGENERATIONS = int(os.getenv("SQL_GUARD_MAX_REGENERATIONS", 2))
+cost_guard = CostGuard(
+    max_cost=float(os.getenv("SQL_GUARD_MAX_COST", 1e6)),
+    max_rows=QUERY_MAX_ROWS,
+    large_table_rows=int(os.getenv("SQL_GUARD_LARGE_TABLE_ROWS", 100000)),
+    auto_limit=os.getenv("SQL_GUARD_AUTO_LIMIT", "true").lower() == "true"
+)
+
+# ---------------------- LLM Hedging ----------------------
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
 
 # ---------------------- Rate Limiter ----------------------
+# Bounds concurrent local embedding work only; remote LLM calls go through llm_limits
 # semaphore = BoundedSemaphore(value=1)
 semaphore = BoundedSemaphore(value=os.cpu_count() or 4)
 
+# ---------------------- Prompts ----------------------
+# Filled by prompt_builder.PromptBuilder, which keeps each prompt within the model's token budget
+SQL_PROMPT = """
+        As an Expert SQL Developer, based on the schema and chat history, generate an optimized SQL query.
+
+        Schema:
+        {schema}
+
+        History:
+        {summary}
+        {history}
+
+        Request:
+        {request}
+
+        Return only raw SQL query. No explanation.
+        """
+SQL_REPAIR_SUFFIX = """
+        Your previous query:
+        {previous_sql}
+
+        {feedback}
+        Write a corrected query for the same request.
+        """
+CODE_PROMPT = """
+            You are a highly experienced senior software engineer.
+
+            Your task is to generate a complete, production-quality script based on:
+            - the user's request
+            - any relevant schema
+            - prior chat history (if applicable)
+            ---
+            ### 🧾 User Request:
+            {request}
+
+            ---
+            ### 🧬 Relevant Schema or Context:
+            If the schema is relevant to the request, use it. If not, rely on chat history.
+            {schema}
+
+            ---
+            ### 💬 Chat History:
+            {summary}
+            {history}
+
+            ---
+            ### ✅ Code Guidelines:
+            - Follow **PEP8 and pylint** standards.
+            - Use **clear comments and docstrings** for each function or class.
+            - Choose **descriptive, self-explanatory variable names**.
+            - Ensure **code modularity**, readability, and maintainability.
+            - Do **not** include explanations outside code (generate **only code**).
+
+            """
+ERD_PROMPT = """
+        You are a professional data architect. Based on provided schema, describe the Entity-Relationship Diagram (ERD) in short. without any discription of tables.
+
+        Schema:
+        {schema}
+
+        Request:
+        {request}
+        """
+GENERAL_PROMPT = """
+            You are a helpful and intelligent AI assistant.
+
+            Your task is to:
+            - Briefly summarize the relevant parts of the conversation history if useful.
+            - Understand the user's current input in the context of prior messages.
+            - Provide a clear, concise, and informative response.
+
+            Conversation History:
+            {chat_history}
+
+            User's Input:
+            {input}
+
+            Assistant:
+            """
+
 # ---------------------- DB Agent ----------------------
 class DBExpertAgent:
-    def __init__(self, engine):
+    def __init__(self, engine, schemas=None, lazy_columns=None):
+        self.db_connection = engine
         self.engine = engine.get_engine()
+        if self.engine is None:
+            raise ConnectionError(f"Could not connect to {engine.db_type} database")
         self.dialect = self.engine.url.get_backend_name()
         self.db_name = self.engine.url.database.split('/')[-1]
+        self.connection_key = connection_fingerprint(engine)
 
         self.vectorstore = None
-        self.history_vectorstore = None
+        self.schema_fingerprint = None
+
+        # None -> default schema, "*" -> every non-system schema, or an explicit list
+        self.schemas = schemas if schemas is not None else engine._option("schemas")
+        self.lazy_columns = bool(lazy_columns if lazy_columns is not None else engine._option("lazy_columns", False))
+        self._loaded_tables = set()
+        self._ddl_version_at_load = None
+        self._schema_lock = Lock()
+        self._row_counts = None  # (data version, {table: rows}) for the SQLite cost guard
+        self._schema_graph = None  # ((fingerprint, loaded tables), SchemaGraph)
 
         self.schema_info = self._extract_schema()
         self._build_vector_index()
-        self._build_history_vector_index()
+        self.schema_graph()
 
     def _extract_schema(self):
-        inspector = inspect(self.engine)
-        metadata = MetaData()
-        metadata.reflect(bind=self.engine)
-
-        schema = {self.db_name: {}}
-        for table_name, table in metadata.tables.items():
-            schema[self.db_name][table_name] = {'columns': {}}
-            for column in table.columns:
-                col_info = {
-                    'type': str(column.type),
-                    'primary_key': column.primary_key,
-                    'nullable': column.nullable,
-                    'default': str(column.default.arg) if column.default is not None else None,
-                    'foreign_key': None
-                }
-                if column.foreign_keys:
-                    fk = list(column.foreign_keys)[0]
-                    col_info['foreign_key'] = str(fk.target_fullname)
-                schema[self.db_name][table_name]['columns'][column.name] = col_info
-        return schema
+        """
+        Reflect the schema, reusing the on-disk snapshot while the catalog's DDL version is unchanged.
 
-    def _build_vector_index(self):
-        if not os.path.exists(INDEX_FOLDER):
-            docs = []
-
-            for schema_name, tables in self.schema_info.items():
-                for table_name, table_info in tables.items():
-                    lines = []
-                    for col_name, col_attrs in table_info.get("columns", {}).items():
-                        line = f"{col_name} ({col_attrs['type']})"
-                        if col_attrs.get('primary_key'):
-                            line += " [PK]"
-                        if col_attrs.get('foreign_key'):
-                            line += f" [FK → {col_attrs['foreign_key']}]"
-                        lines.append(line)
-
-                    table_doc = f"Schema: {schema_name}\nTable: {table_name}\nColumns:\n" + "\n".join(lines)
-                    docs.append(Document(page_content=table_doc))
+        Tables are reflected in parallel batches per schema. With `lazy_columns` only table
+        names are listed up front; columns are loaded on demand by `load_table_columns`.
+        """
+        ddl_version = self._ddl_version()
+        snapshot_path = self._schema_snapshot_path()
+        if ddl_version is not None and os.path.exists(snapshot_path):
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            if (snapshot.get("ddl_version") == ddl_version
+                    and snapshot.get("schemas") == self.schemas
+                    and snapshot.get("lazy_columns") == self.lazy_columns):
+                self._loaded_tables = set(snapshot.get("loaded_tables", []))
+                self._ddl_version_at_load = ddl_version
+                return snapshot["schema"]
 
-            splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-            chunks = splitter.split_documents(docs)
+        inspector = inspect(self.engine)
+        table_keys = []
+        for schema_name in self._reflection_schemas(inspector):
+            for table_name in inspector.get_table_names(schema=schema_name):
+                table_keys.append(f"{schema_name}.{table_name}" if schema_name else table_name)
+
+        schema = {self.db_name: {table_key: {'columns': {}} for table_key in table_keys}}
+        self._loaded_tables = set()
+        self._ddl_version_at_load = ddl_version
+        if not self.lazy_columns:
+            self._reflect_tables(schema, table_keys)
+        self._save_schema_snapshot(schema)
+        return schema
 
-            self.vectorstore = FAISS.from_documents(chunks, embedding_model)
-            self.vectorstore.save_local(INDEX_FOLDER)
-        else:
-            self.vectorstore = FAISS.load_local(INDEX_FOLDER, embedding_model, allow_dangerous_deserialization=True)
+    def _reflection_schemas(self, inspector) -> list:
+        if not self.schemas:
+            return [None]  # default schema only
+        if self.schemas == "*":
+            return [
+                name for name in inspector.get_schema_names()
+                if name.lower() not in SYSTEM_SCHEMAS
+            ]
+        return list(self.schemas)
+
+    def _reflect_tables(self, schema: Dict, table_keys):
+        """Reflect column detail for `table_keys` on a thread pool, in per-schema batches."""
+        reflected = reflect_tables(self.engine, table_keys, REFLECTION_WORKERS, REFLECTION_BATCH_SIZE)
+        for table_key, columns in reflected.items():
+            schema[self.db_name][table_key] = {'columns': columns}
+            self._loaded_tables.add(table_key)
+
+    def load_table_columns(self, table_keys):
+        """Lazily reflect column detail for tables that have not been loaded yet."""
+        with self._schema_lock:
+            missing = [
+                table_key for table_key in table_keys
+                if table_key in self.schema_info[self.db_name] and table_key not in self._loaded_tables
+            ]
+            if missing:
+                self._reflect_tables(self.schema_info, missing)
+                self._save_schema_snapshot(self.schema_info)
+
+    def _ddl_version(self):
+        """Catalog value that changes whenever DDL runs, or None when the dialect exposes none."""
+        query = DDL_VERSION_QUERIES.get(self.dialect)
+        if query is None:
+            return None
+        try:
+            with self.engine.connect() as conn:
+                value = conn.execute(text(query)).scalar()
+            return None if value is None else str(value)
+        except Exception as e:
+            log_event("ddl_version_error", str(e))
+            return None
 
-    def _build_history_vector_index(self):
-        history_index_path = os.path.join(HISTORY_INDEX_FOLDER)
-        index_file_path = os.path.join(history_index_path, "index.faiss")
+    def _schema_snapshot_path(self) -> str:
+        url = self.engine.url.render_as_string(hide_password=True)
+        key = hashlib.sha256(f"{self.dialect}|{url}".encode()).hexdigest()[:16]
+        return os.path.join(SCHEMA_SNAPSHOT_FOLDER, f"{key}.json")
 
-        if os.path.exists(index_file_path):
-            self.history_vectorstore = FAISS.load_local(
-                history_index_path,
-                embeddings=embedding_model,
-                allow_dangerous_deserialization=True
-            )
-        else:
-            os.makedirs(history_index_path, exist_ok=True)
+    def _save_schema_snapshot(self, schema: Dict):
+        ddl_version = self._ddl_version_at_load
+        if ddl_version is None:
+            return
+        os.makedirs(SCHEMA_SNAPSHOT_FOLDER, exist_ok=True)
+        with open(self._schema_snapshot_path(), "w") as f:
+            json.dump({
+                "ddl_version": ddl_version,
+                "schemas": self.schemas,
+                "lazy_columns": self.lazy_columns,
+                "loaded_tables": sorted(self._loaded_tables),
+                "schema": schema
+            }, f)
+
+    def data_version(self):
+        """
+        Cheap token that changes when the data changes, or None when the dialect offers none.
 
-            # Create dummy document to initialize
-            dummy_doc = [Document(page_content="hello")]
-            self.history_vectorstore = FAISS.from_documents(dummy_doc, embedding_model)
-            self.history_vectorstore.docstore = InMemoryDocstore()
-            self.history_vectorstore.index_to_docstore_id = {}
+        SQLite files use the header's change counter and the mtime/size of the database and
+        its WAL, which every worker and pooled connection sees alike (PRAGMA data_version is per connection and ignores the
+        connection's own writes). In-memory SQLite lives on one shared connection, so its
+        schema_version plus that connection's total_changes() counts every write. Postgres
+        sums the pg_stat_user_tables change counters, which lag by the stats flush interval.
+        """
+        try:
+            if self.dialect == "sqlite":
+                database = self.engine.url.database
+                if database and database != ":memory:":
+                    path = database.removeprefix("file:").split("?", 1)[0]
+                    stats = [os.stat(p) for p in (path, f"{path}-wal") if os.path.exists(p)]
+                    if not stats:
+                        return None
+                    with open(path, "rb") as f:
+                        header = f.read(28)  # bytes 24-27: file change counter, bumped per rollback-journal commit
+                    return "|".join([header[24:28].hex()] + [f"{st.st_mtime_ns}:{st.st_size}" for st in stats])
+            query = DATA_VERSION_QUERIES.get(self.dialect)
+            if query is None:
+                return None
+            with self.engine.connect() as conn:
+                return str(conn.execute(text(query)).scalar())
+        except Exception as e:
+            log_event("data_version_error", str(e))
+            return None
 
-            # Clear dummy doc entry from memory
-            self.history_vectorstore.index.reset()
-            self.history_vectorstore.docstore._dict.clear()
-            self.history_vectorstore.index_to_docstore_id.clear()
+    def table_row_counts(self, tables) -> Dict[str, int]:
+        """
+        Row counts of `tables` (lower-cased bare names) for SQLite, whose plans carry none.
+        Taken from sqlite_stat1 where ANALYZE has run, else counted; cached until the data
+        version changes, so each table is counted at most once per version.
+        """
+        version = self.data_version()
+        if self._row_counts is None or self._row_counts[0] != version or version is None:
+            self._row_counts = (version, {})
+        counts = self._row_counts[1]
+        names = {table.split(".")[-1].lower(): table.split(".")[-1] for table in self.schema_info[self.db_name]}
+        missing = [names[table] for table in tables if table in names and table not in counts]
+        if missing:
+            with self.engine.connect() as conn:
+                estimates = {}
+                try:
+                    # The first number of a stat row counts the entries of its table or index
+                    for table, stat in conn.execute(text("SELECT tbl, stat FROM sqlite_stat1")).fetchall():
+                        estimates[table.lower()] = max(estimates.get(table.lower(), 0), int(stat.split()[0]))
+                except Exception:
+                    pass  # never analyzed
+                for name in missing:
+                    if name.lower() in estimates:
+                        counts[name.lower()] = estimates[name.lower()]
+                        continue
+                    try:
+                        counts[name.lower()] = conn.execute(text(f'SELECT COUNT(*) FROM "{name}"')).scalar()
+                    except Exception as e:
+                        log_event("row_count_error", {"table": name, "error": str(e)})
+        return {table: counts[table] for table in tables if table in counts}
+
+    def guard_sql(self, sql_query: str):
+        """Run the EXPLAIN cost guard on a query; returns a sql_guard.GuardDecision."""
+        table_rows = None
+        if self.dialect == "sqlite":
+            # SQLite plans name each scan by its alias
+            aliases = table_aliases(sql_query, self.dialect)
+            counts = self.table_row_counts(set(aliases.values()))
+            table_rows = {alias: counts[table] for alias, table in aliases.items() if table in counts}
+        decision = cost_guard.check(self.engine, sql_query, table_rows)
+        if decision.reasons:
+            log_event("sql_guard", {"action": decision.action, "reasons": decision.reasons,
+                                    "estimate": decision.estimate.to_dict()})
+        return decision
+
+    def _schema_index_path(self) -> str:
+        """Index folder for this connection: hash of dialect and (password-free) database URL."""
+        url = self.engine.url.render_as_string(hide_password=True)
+        key = hashlib.sha256(f"{self.dialect}|{url}".encode()).hexdigest()[:16]
+        return os.path.join(INDEX_FOLDER, key)
+
+    def _table_documents(self, only=None) -> Dict[str, Document]:
+        docs = {}
+        for schema_name, tables in self.schema_info.items():
+            for table_name, table_info in tables.items():
+                if only is not None and table_name not in only:
+                    continue
+                table_doc = self._table_text(schema_name, table_name, table_info)
+                docs[table_name] = Document(page_content=table_doc, metadata={"table": table_name})
+        return docs
+
+    @staticmethod
+    def _table_text(schema_name: str, table_name: str, table_info: Dict, only_columns=None) -> str:
+        lines = []
+        columns = table_info.get("columns", {})
+        for col_name, col_attrs in columns.items():
+            if only_columns is not None and col_name not in only_columns:
+                continue
+            line = f"{col_name} ({col_attrs['type']})"
+            if col_attrs.get('primary_key'):
+                line += " [PK]"
+            if col_attrs.get('foreign_key'):
+                line += f" [FK → {col_attrs['foreign_key']}]"
+            lines.append(line)
+        if len(lines) < len(columns):
+            lines.append(f"... {len(columns) - len(lines)} more columns")
+        return f"Schema: {schema_name}\nTable: {table_name}\nColumns:\n" + "\n".join(lines)
+
+    def schema_graph(self) -> SchemaGraph:
+        """Foreign-key graph of the reflected tables, rebuilt when the schema or the reflected set changes."""
+        key = (self.schema_fingerprint, len(self._loaded_tables))
+        if self._schema_graph is None or self._schema_graph[0] != key:
+            graph = SchemaGraph.from_schema_info(self.schema_info[self.db_name])
+            self._schema_graph = (key, graph)
+            log_event("schema_graph_build", {"tables": len(graph.edges), "joins": graph.join_count})
+        return self._schema_graph[1]
 
-            self.history_vectorstore.save_local(history_index_path)
+    def _build_vector_index(self):
+        """Load or incrementally update this connection's schema index (see schema_index.py)."""
+        index_path = self._schema_index_path()
+        table_docs = self._table_documents()
+        update = update_schema_index(index_path, table_docs, embedding_model,
+                                     {"dialect": self.dialect, "database": self.db_name})
+        self.vectorstore, self.schema_fingerprint = update.vectorstore, update.fingerprint
+        if update.changed or update.removed:
+            log_event("schema_index_update", {
+                "path": index_path,
+                "embedded_tables": len(update.changed),
+                "removed_tables": len(update.removed),
+                "total_tables": len(table_docs)
+            })
 
     def _vectorize_history(self, memory, summarize_threshold: int = 20, enable_summarization: bool = True):
         """
@@ -174,18 +618,32 @@ class DBExpertAgent:
 
         Parameters:
         - memory: ConversationBufferMemory or any object containing .chat_memory.messages
-        - summarize_threshold (int): Max number of messages before summarization is triggered
-        - enable_summarization (bool): Whether to summarize long chat history before indexing
+        - summarize_threshold (int): Unsummarized messages that trigger a background roll-up
+        - enable_summarization (bool): Whether to feed the background history summarizer
 
         This function:
+        - Reads the full text of offloaded payloads from the memory's payload store
         - Filters out trivial or short messages (e.g., "okay", "thanks")
-        - Optionally summarizes if chat history is long
+        - Optionally queues long history for background summarization
         - Splits content into vector chunks
-        - Updates and saves the history FAISS vectorstore
+        - Skips messages already vectorized for this session and chunks already indexed
+        - Adds the chunks to the session's shard of `history_index`; persistence is deferred
         """
+        session_id = getattr(memory, "session_id", None) or "default"
         messages = memory.chat_memory.messages
-        if not messages:
+        # Positions are absolute: windowed memory drops old messages from the front
+        omitted = getattr(memory, "omitted", 0)
+        if omitted:
+            messages = messages[1:]
+        total = omitted + len(messages)
+
+        # Only messages added since the last call for this session are considered
+        start = history_index.watermark(session_id)
+        if start > total:
+            start = omitted  # memory was cleared or replaced
+        if start == total:
             return
+        start = max(start, omitted)
 
         def is_meaningful(content: str) -> bool:
             content = content.lower().strip()
@@ -197,172 +655,325 @@ class DBExpertAgent:
                 content not in {"yes", "no", "ok", "cool", "great", "fine"}
             )
 
+        def full_text(message) -> str:
+            # Offloaded responses keep only a reference in memory; index what was said
+            payload_id = message.additional_kwargs.get("payload_id")
+            payload_store = getattr(memory, "payload_store", None)
+            if payload_id and payload_store is not None:
+                return payload_store.get_payload(session_id, payload_id) or message.content
+            return message.content
+
         # Filter for useful content
+        texts = [(i, full_text(m)) for i, m in enumerate(messages[start - omitted:], start=start)]
         meaningful_docs = [
-            Document(page_content=m.content.strip())
-            for m in messages
-            if m.content and is_meaningful(m.content)
+            Document(page_content=content.strip(), metadata={"msg_index": i})
+            for i, content in texts
+            if content and is_meaningful(content)
         ]
 
-        if not meaningful_docs:
-            return
+        chunks = []
+        if meaningful_docs:
+            # Long conversations are rolled up in the background; the turn never waits on it
+            if enable_summarization:
+                history_summarizer.add(
+                    session_id, [doc.page_content for doc in meaningful_docs],
+                    threshold=summarize_threshold, upto=total
+                )
 
-        # Optional summarization for long history
-        if enable_summarization and len(meaningful_docs) > summarize_threshold:
-            splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=50)
+            # Final chunking before vectorization
+            splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
             chunks = splitter.split_documents(meaningful_docs)
-            summarize_chain = load_summarize_chain(summarizer_llm, chain_type="map_reduce") #chain_type="stuff" is directly pass history
-            summary = summarize_chain.run(chunks)
-            meaningful_docs = [Document(page_content=summary.strip())]
-
-        # Final chunking before vectorization
-        splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-        chunks = splitter.split_documents(meaningful_docs)
 
-        self.history_vectorstore.add_documents(chunks)
-        self.history_vectorstore.save_local(HISTORY_INDEX_FOLDER)
+        # Deduplicated by content hash inside the session's shard
+        history_index.add_messages(session_id, chunks, watermark=total)
 
     def _get_relevant_context(self, user_input: str, top_k: int = 3) -> str:
-        relevant_docs = self.vectorstore.similarity_search(user_input, k=top_k)
-        return "\n".join([doc.page_content for doc in relevant_docs])
-
-    def _get_relevant_history(self, user_input: str, top_k: int = 3) -> str:
-        relevant_docs = self.history_vectorstore.similarity_search(user_input, k=top_k)
-        return "\n".join([doc.page_content for doc in relevant_docs])
-
-    def generate_sql(self, user_input: str, memory) -> str:
-        with semaphore:            
+        """
+        Schema context for a request, in two stages: the `top_k` tables whose chunks are
+        nearest to it, then the tables on foreign-key paths joining them. Columns are
+        trimmed to SCHEMA_CONTEXT_COLUMNS, keeping primary and join keys of every table.
+        """
+        relevant_docs = self.vectorstore.similarity_search(user_input, k=top_k * SCHEMA_SEARCH_FANOUT)
+        seeds = list(dict.fromkeys(
+            doc.metadata["table"] for doc in relevant_docs if doc.metadata.get("table")
+        ))[:top_k]
+        if not seeds:
+            return "\n".join([doc.page_content for doc in relevant_docs[:top_k]])
+
+        # Lazy mode indexes table names only; pull column detail (and so FKs) for the selected tables
+        if self.lazy_columns:
+            self.load_table_columns(seeds)
+        graph = self.schema_graph()
+        tables = graph.connect(seeds, SCHEMA_GRAPH_MAX_HOPS)
+        if self.lazy_columns:
+            self.load_table_columns(tables)
+        joins = graph.joins_within(tables)
+
+        table_info = self.schema_info[self.db_name]
+        join_keys = {(table, col) for join in joins for table, col in ((join[0], join[1]), (join[2], join[3]))}
+        selected = {
+            table: {
+                name for name, attrs in table_info.get(table, {}).get("columns", {}).items()
+                if attrs.get("primary_key") or (table, name) in join_keys
+            }
+            for table in tables
+        }
+        budget = SCHEMA_CONTEXT_COLUMNS - sum(len(columns) for columns in selected.values())
+        for table in seeds:  # connector tables only contribute their keys
+            for name in table_info.get(table, {}).get("columns", {}):
+                if budget <= 0:
+                    break
+                if name not in selected[table]:
+                    selected[table].add(name)
+                    budget -= 1
+
+        log_event("schema_context", {
+            "seeds": seeds, "connectors": tables[len(seeds):], "joins": len(joins),
+            "columns": sum(len(columns) for columns in selected.values())
+        })
+        parts = [
+            self._table_text(self.db_name, table, table_info.get(table, {}), selected[table])
+            for table in tables
+        ]
+        if joins:
+            parts.append("Joins:\n" + "\n".join(f"{t}.{c} = {rt}.{rc}" for t, c, rt, rc in joins))
+        return "\n".join(parts)
+
+    def _get_relevant_history(self, user_input: str, memory=None, top_k: int = 3) -> str:
+        summary, history = self._get_history_parts(user_input, memory, top_k)
+        return f"{summary}\n{history}" if summary else history
+
+    def _get_history_parts(self, user_input: str, memory=None, top_k: int = 3) -> Tuple[str, str]:
+        """(rolled-up summary of older turns, retrieved relevant messages) for a session."""
+        session_id = getattr(memory, "session_id", None) or "default"
+        relevant_docs = history_index.search(session_id, user_input, k=top_k)
+        history = "\n".join([
+            doc.page_content for doc in relevant_docs if doc.metadata.get("kind") != "summary"
+        ])
+        summary = history_summarizer.latest(session_id)
+        return (f"Conversation summary:\n{summary}\n" if summary else ""), history
+
+    def generate_sql(self, user_input: str, memory, feedback: str = None, previous_sql: str = None) -> str:
+        """
+        Generate SQL for a request. With `feedback`, rewrite `previous_sql` to address it;
+        the rewrite replaces the rejected query in the conversation memory.
+        """
+        with semaphore:
             context = self._get_relevant_context(user_input)
             self._vectorize_history(memory)
-            history = self._get_relevant_history(user_input)
-            prompt = f"""
-            As an Expert SQL Developer, based on the schema and chat history, generate an optimized SQL query.
+            summary, history = self._get_history_parts(user_input, memory)
+        template = SQL_PROMPT + (SQL_REPAIR_SUFFIX if feedback else "")
+        prompt = (PromptBuilder(template, prompt_budget(llm_model_names(sql_llm)), name="generate_sql")
+                  .add("request", user_input)
+                  .add("previous_sql", previous_sql or "")
+                  .add("feedback", feedback or "")
+                  .add("schema", context, priority=1)
+                  .add("history", history, priority=2, keep="head")  # most relevant first
+                  .add("summary", summary, priority=3, keep="tail")
+                  .build())
+        response = sql_llm.invoke(prompt)
+        if feedback and memory.chat_memory.messages:
+            memory.replace_last_output(response.content)
+        else:
+            memory.add_turn(user_input, response.content)
+        return sanitize_sql(response.content)
+
+    def validate_sql(self, sql_query: str) -> ValidationResult:
+        """Parse and check a query against schema_info, reflecting the tables it uses in lazy mode."""
+        tables = self.schema_info[self.db_name]
+        if self.lazy_columns:
+            names = referenced_tables(sql_query, self.dialect)
+            self.load_table_columns([
+                key for key in tables if key.lower() in names or key.split(".")[-1].lower() in names
+            ])
+        schema = {
+            key: set(info['columns']) if not self.lazy_columns or key in self._loaded_tables else None
+            for key, info in tables.items()
+        }
+        column_types = {
+            key: {name: attrs['type'] for name, attrs in tables[key]['columns'].items()}
+            for key, columns in schema.items() if columns is not None
+        }
+        return validate_sql(sql_query, self.dialect, schema, column_types)
+
+    def repair_sql(self, user_input: str, memory, sql_query: str) -> str:
+        """Validate generated SQL and send errors back to sql_llm, at most SQL_REPAIR_ATTEMPTS times."""
+        result = self.validate_sql(sql_query)
+        sql_stats.record(validated=1, invalid=int(not result.ok))
+        if result.ok:
+            return sql_query
+
+        for _ in range(SQL_REPAIR_ATTEMPTS):
+            log_event("sql_validation_failed", {"sql": sql_query, "errors": result.errors})
+            sql_query = self.generate_sql(user_input, memory, feedback=result.feedback(), previous_sql=sql_query)
+            result = self.validate_sql(sql_query)
+            sql_stats.record(reasks=1, validated=1, invalid=int(not result.ok))
+            if result.ok:
+                break
+        sql_stats.record(repaired=int(result.ok), unrepaired=int(not result.ok))
+        return sql_query
+
+    def run_query(self, sql_query: str, max_rows: int = None, max_bytes: int = None,
+                  offset: int = 0, chunk_size: int = None, timeout: float = None,
+                  query_id: str = None) -> pd.DataFrame:
+        """
+        Execute a query through a server-side cursor, keeping at most one page in memory.
 
-            Schema:
-            {context}
+        Rows are fetched in `chunk_size` batches; the first `offset` rows are skipped and
+        fetching stops once `max_rows` rows or `max_bytes` bytes have been collected.
+        `df.attrs` records `truncated`, `next_offset` (pass it back as `offset` for the
+        next page, None when exhausted), `row_count` and `bytes`.
 
-            History:
-            {history}
+        The statement stops after `timeout` seconds (default: the connection's
+        statement timeout) and can be cancelled with db_connection.cancel_query(query_id).
+        """
+        max_rows = max_rows or QUERY_MAX_ROWS
+        max_bytes = max_bytes or QUERY_MAX_BYTES
+        chunk_size = chunk_size or QUERY_CHUNK_SIZE
+        offset = max(int(offset or 0), 0)
+        try:
+            with guarded_connection(self.engine, self._timeout(timeout), query_id) as conn:
+                conn = conn.execution_options(stream_results=True, yield_per=chunk_size)
+                chunks = pd.read_sql(text(sql_query), conn, chunksize=chunk_size)
+                df = read_capped(chunks, offset, max_rows, max_bytes)
+        except Exception as e:
+            log_event("query_error", str(e))
+            return pd.DataFrame({'Error': [str(e)]})
 
-            Request:
-            {user_input}
+        if df.attrs["truncated"]:
+            log_event("query_truncated", {"rows": df.attrs["row_count"], "bytes": df.attrs["bytes"], "offset": offset})
+        return df
 
-            Return only raw SQL query. No explanation.
-            """
-            response = sql_llm.invoke(prompt)
-            memory.chat_memory.add_user_message(user_input)
-            memory.chat_memory.add_ai_message(response.content)
-            # return sanitize_sql(response.content.strip("```sql").strip("```").strip())
-            return sanitize_sql(response.content.strip().removeprefix("```sql").removesuffix("```"))
+    def result_key_columns(self, sql_query: str) -> Optional[List[str]]:
+        """
+        Primary key columns to keyset-paginate a query by, [] for offset paging, or
+        None when the query cannot be paged and must run in one shot.
 
-    def run_query(self, sql_query: str) -> pd.DataFrame:
+        Keyset paging needs a plain single-table SELECT that returns every primary
+        key column; offset paging needs a top-level ORDER BY and no limit of its own.
+        """
+        sql_query = pageable_sql(sql_query, self.dialect)
+        if sql_query is None:
+            return None
+        offset_paging = [] if offset_page_sql(sql_query, self.dialect, 0, 1) else None
+        if NON_KEYSET_SQL.search(sql_query):
+            return offset_paging
+        match = re.search(r"\bfrom\s+([\w\"`\[\].]+)", sql_query, re.I)
+        if not match:
+            return offset_paging
+        parts = [part.strip('"`[]') for part in match.group(1).split(".")]
+        table, schema = parts[-1], (parts[-2] if len(parts) > 1 else None)
         try:
+            primary_key = inspect(self.engine).get_pk_constraint(table, schema=schema)["constrained_columns"]
             with self.engine.connect() as conn:
-                return pd.read_sql(text(sql_query), conn)
+                returned = set(conn.execute(self._page_statement(sql_query, [], limit=0)).keys())
+        except Exception as e:
+            log_event("page_key_detection_error", str(e))
+            return offset_paging
+        return primary_key if primary_key and set(primary_key) <= returned else offset_paging
+
+    def run_page(self, sql_query: str, key_columns: List[str], after: list = None,
+                 offset: int = 0, limit: int = 500, timeout: float = None,
+                 query_id: str = None) -> pd.DataFrame:
+        """
+        Fetch one page of a query: ordered by `key_columns` and starting after the
+        `after` key values (keyset), or at `offset` in the query's own ORDER BY when
+        there are no key columns. See result_key_columns for which queries qualify.
+        """
+        try:
+            if key_columns:
+                statement = self._page_statement(pageable_sql(sql_query, self.dialect), key_columns,
+                                                 after=after, limit=limit)
+            else:
+                statement = text(offset_page_sql(sql_query, self.dialect, offset, limit))
+            with guarded_connection(self.engine, self._timeout(timeout), query_id) as conn:
+                return pd.read_sql(statement, conn)
         except Exception as e:
             log_event("query_error", str(e))
             return pd.DataFrame({'Error': [str(e)]})
 
+    def _timeout(self, timeout: float = None) -> float:
+        """An explicit per-call timeout, else the connection's statement timeout."""
+        return self.db_connection.statement_timeout() if timeout is None else float(timeout)
+
+    @staticmethod
+    def _page_statement(sql_query: str, key_columns: List[str], after: list = None, limit: int = 500):
+        # The comment-free query becomes a subquery; SQLAlchemy renders LIMIT for the dialect
+        page = text(sql_query).columns(*[column(key) for key in key_columns]).subquery("_page")
+        statement = select(literal_column("*")).select_from(page)
+        if key_columns:
+            if after is not None:
+                # Lexicographic (k1, k2, ...) > (v1, v2, ...) without row-value syntax
+                statement = statement.where(or_(*[
+                    and_(*[page.c[key] == value for key, value in zip(key_columns[:i], after[:i])],
+                         page.c[key_columns[i]] > after[i])
+                    for i in range(len(key_columns))
+                ]))
+            statement = statement.order_by(*[page.c[key] for key in key_columns])
+        return statement.limit(limit)
+
     def generate_coding_script(self, user_input: str, memory) -> str:
         with semaphore:
             context = self._get_relevant_context(user_input)
             self._vectorize_history(memory)
-            history = self._get_relevant_history(user_input)
-            prompt = f"""
-                You are a highly experienced senior software engineer.
-
-                Your task is to generate a complete, production-quality script based on:
-                - the user's request
-                - any relevant schema
-                - prior chat history (if applicable)
-                ---
-                ### 🧾 User Request:
-                {user_input}
-
-                ---
-                ### 🧬 Relevant Schema or Context:
-                If the schema is relevant to the request, use it. If not, rely on chat history.
-                {context}
-
-                ---
-                ### 💬 Chat History:
-                {history}
-
-                ---
-                ### ✅ Code Guidelines:
-                - Follow **PEP8 and pylint** standards.
-                - Use **clear comments and docstrings** for each function or class.
-                - Choose **descriptive, self-explanatory variable names**.
-                - Ensure **code modularity**, readability, and maintainability.
-                - Do **not** include explanations outside code (generate **only code**).
-
-                """
-
-            response = code_llm.invoke(prompt)
-            memory.chat_memory.add_user_message(user_input)
-            memory.chat_memory.add_ai_message(response.content)
-            return response.content
+            summary, history = self._get_history_parts(user_input, memory)
+        prompt = (PromptBuilder(CODE_PROMPT, prompt_budget(llm_model_names(code_llm)), name="generate_coding_script")
+                  .add("request", user_input)
+                  .add("schema", context, priority=1)
+                  .add("history", history, priority=2, keep="head")  # most relevant first
+                  .add("summary", summary, priority=3, keep="tail")
+                  .build())
+
+        response = code_llm.invoke(prompt)
+        memory.add_turn(user_input, response.content)
+        return response.content
 
     def generate_er_diagram_description(self, user_input: str, memory) -> str:
         with semaphore:
             context = self._get_relevant_context(user_input)
             self._vectorize_history(memory)
-            history = self._get_relevant_history(user_input)
-            prompt = f"""
-            You are a professional data architect. Based on provided schema, describe the Entity-Relationship Diagram (ERD) in short. without any discription of tables.
-
-            Schema:
-            {context}
-
-            Request:
-            {user_input}
-            """
-            response = code_llm.invoke(prompt)
-            memory.chat_memory.add_user_message(user_input)
-            memory.chat_memory.add_ai_message(response.content)
-            return response.content
+        prompt = (PromptBuilder(ERD_PROMPT, prompt_budget(llm_model_names(code_llm)), name="generate_er_diagram")
+                  .add("request", user_input)
+                  .add("schema", context, priority=1)
+                  .build())
+        response = code_llm.invoke(prompt)
+        memory.add_turn(user_input, response.content)
+        return response.content
 
     def explain_data(self, df: pd.DataFrame) -> str:
         if df.empty:
             return "No data available."
-        with semaphore:
-            prompt = f"As a senior data analyst, explain the following data table:\n{df.head().to_string(index=False)}"
-            return code_llm.invoke(prompt).content
+        prompt = f"As a senior data analyst, explain the following data table:\n{df.head().to_string(index=False)}"
+        return code_llm.invoke(prompt).content
 
     def visualize_data(self, df: pd.DataFrame):
         if not df.empty:
             dtale.show(df).open_browser()
 
-class SafeLLMWrapper(Runnable):
-    def __init__(self, llm, retries=3, delay_base=2, jitter=True):
-        self.llm = llm
-        self.retries = retries
-        self.delay_base = delay_base
-        self.jitter = jitter
-
-    def invoke(self, input, config=None, **kwargs):
-        for attempt in range(self.retries):
-            try:
-                return self.llm.invoke(input, config=config, **kwargs)
-            except Exception as e:
-                if "429" in str(e) or "quota" in str(e).lower():
-                    wait_time = self.delay_base ** attempt
-                    if self.jitter:
-                        wait_time += random.uniform(0, 1)
-                    print(f"⚠️ Retry in {wait_time:.1f}s (Attempt {attempt+1}/{self.retries})...")
-                    time.sleep(wait_time)
-                else:
-                    raise
-        raise RuntimeError("LLM quota exhausted or API call failed after retries.")
+# ---------------------- Agent Registry ----------------------
+agent_registry = AgentRegistry(
+    lambda db_connection: DBExpertAgent(engine=db_connection),
+    max_size=int(os.getenv("AGENT_CACHE_SIZE", 16)),
+    ttl=int(os.getenv("AGENT_CACHE_TTL", 1800))
+)
 
-    def __getattr__(self, name):
-        return getattr(self.llm, name)
+def _create_llm(provider: str, model_name: str, temperature: float = 0):
+    if provider == "groq":
+        return ChatGroq(model=model_name, temperature=temperature)
+    elif provider == "openai":
+        return ChatOpenAI(model=model_name, temperature=temperature)
+    elif provider == "google":
+        return ChatGoogleGenerativeAI(model=model_name, temperature=temperature)
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
 
 def initialize_llm(
         provider: Literal["groq", "openai", "google"],
         model_name: str,
         temperature: float = 0,
-        safe: bool = False
+        safe: bool = False,
+        fallbacks: Optional[List[Tuple[str, str]]] = None,
+        hedge: bool = False
     ):
     """
     Initialize a language model, optionally wrapped with SafeLLMWrapper.
@@ -372,26 +983,47 @@ def initialize_llm(
         model_name: Model name.
         temperature: LLM temperature.
         safe: If True, returns a safe wrapper around the LLM.
+        fallbacks: Ordered (provider, model_name) pairs the safe wrapper fails over to.
+        hedge: If True, the safe wrapper sends a backup request when the primary is slow.
 
     Returns:
         Either the raw LLM or a safe LLM wrapper.
     """
-    if provider == "groq":
-        llm = ChatGroq(model=model_name, temperature=temperature)
-    elif provider == "openai":
-        llm = ChatOpenAI(model=model_name, temperature=temperature)
-    elif provider == "google":
-        llm = ChatGoogleGenerativeAI(model=model_name, temperature=temperature)
-    else:
-        raise ValueError(f"Unsupported provider: {provider}")
-
-    return SafeLLMWrapper(llm) if safe else llm
+    llm = _create_llm(provider, model_name, temperature)
+    if not safe:
+        return llm
+
+    fallback_llms = [
+        (_create_llm(fallback_provider, fallback_model, temperature), fallback_provider, fallback_model)
+        for fallback_provider, fallback_model in fallbacks or []
+    ]
+    return SafeLLMWrapper(llm, provider=provider, model_name=model_name, fallbacks=fallback_llms, hedge=hedge)
     # return llm
 
 # --------- CHANGE THIS TO SWITCH LLM PROVIDER ---------
-conversational_llm = initialize_llm(provider="google", model_name="gemini-2.0-flash-lite", safe=True)
-sql_llm = initialize_llm(provider="groq", model_name="llama3-70b-8192", safe=True)
-code_llm = initialize_llm(provider="groq", model_name="llama-3.3-70b-versatile", safe=True)
+# Hedging is opt-in: LLM_HEDGING=true hedges the SQL and code models
+conversational_llm = initialize_llm(provider="google", model_name="gemini-2.0-flash-lite", safe=True,
+                                    fallbacks=[("groq", "llama-3.1-8b-instant")])
+sql_llm = initialize_llm(provider="groq", model_name="llama3-70b-8192", safe=True,
+                         fallbacks=[("google", "gemini-2.0-flash")], hedge=LLM_HEDGING)
+code_llm = initialize_llm(provider="groq", model_name="llama-3.3-70b-versatile", safe=True,
+                          fallbacks=[("google", "gemini-2.0-flash")], hedge=LLM_HEDGING)
+
+
+def llm_model_names(llm) -> List[str]:
+    """Models a prompt sent to `llm` may reach, primary first."""
+    if isinstance(llm, SafeLLMWrapper):
+        return [route.model_name for route in llm.routes]
+    return [getattr(llm, "model_name", None) or getattr(llm, "model", None) or "default"]
+
+
+def llm_stats() -> Dict:
+    """Hedging counters for each wrapped model."""
+    return {
+        name: llm.hedge_stats()
+        for name, llm in (("conversational_llm", conversational_llm), ("sql_llm", sql_llm), ("code_llm", code_llm))
+        if isinstance(llm, SafeLLMWrapper)
+    }
 
 # ---------------------- Intent Classifier ----------------------
 INTENT_PROMPT = PromptTemplate.from_template(
@@ -414,22 +1046,56 @@ INTENT_PROMPT = PromptTemplate.from_template(
     )
 intent_chain = LLMChain(llm=conversational_llm, prompt=INTENT_PROMPT)
 
+# Local k-NN + keyword classifier; the LLM chain only sees inputs it is unsure about
+intent_classifier = LocalIntentClassifier(
+    embedding_model, threshold=float(os.getenv("INTENT_LOCAL_THRESHOLD", 0.75))
+)
+
+
+def classify_intent(user_input: str) -> str:
+    return intent_classifier.classify(
+        user_input, fallback=lambda text: intent_chain.run(text)
+    ).strip().upper()
+
 # ---------------------- Router ----------------------
 def chat_router(user_input: str, db_agent: DBExpertAgent, memory):
-    intent = intent_chain.run(user_input).strip().upper()
-    print(f"[Intent: {intent}]")
+    """Returns (DataFrame or None, response text, visualize flag); routes pick the wire format."""
+    # The cache is consulted before any LLM call, including intent classification
+    cache_key = ResultCache.make_key(
+        db_agent.connection_key,
+        db_agent.schema_fingerprint,
+        getattr(memory, "session_id", None),
+        user_input
+    )
+    data_version = db_agent.data_version() if CHECK_DATA_VERSION else None
+    cached = result_cache.get(cache_key, data_version)
+    if cached is not None:
+        return cached
 
-    query_id = get_query_hash(user_input)
-    if query_id in query_cache:
-        return query_cache[query_id]
+    intent = classify_intent(user_input)
+    print(f"[Intent: {intent}]")
 
     visualize_flag = False  # Return this to trigger visualization later
 
     if "SQL_ANALYSIS" in intent:
-        sql = db_agent.generate_sql(user_input, memory)
-        df = db_agent.run_query(sql)
+        sql = db_agent.repair_sql(user_input, memory, db_agent.generate_sql(user_input, memory))
+        if GUARD_ENABLED:
+            decision = db_agent.guard_sql(sql)
+            for _ in range(GUARD_MAX_REGENERATIONS):
+                if decision.action != REJECT:
+                    break
+                # Regenerated SQL goes through schema validation again before the guard
+                sql = db_agent.repair_sql(user_input, memory, db_agent.generate_sql(
+                    user_input, memory, feedback=decision.feedback(), previous_sql=sql))
+                decision = db_agent.guard_sql(sql)
+            sql = decision.sql
+        if GUARD_ENABLED and decision.action == REJECT:
+            df = pd.DataFrame({'Error': [decision.feedback()]})
+        else:
+            df = db_agent.run_query(sql)
+            sql_stats.record(executions=1, execution_errors=int(list(df.columns) == ["Error"]))
         insights = db_agent.explain_data(df)
-        result = (df.to_dict(orient="records"), insights)
+        result = (df, insights)
         visualize_flag = True
 
     elif "CODE_SCRIPTING" in intent:
@@ -441,30 +1107,18 @@ def chat_router(user_input: str, db_agent: DBExpertAgent, memory):
         result = (None, erd)
 
     else:
-        prompt = PromptTemplate.from_template(
-            """
-            You are a helpful and intelligent AI assistant.
-
-            Your task is to:
-            - Briefly summarize the relevant parts of the conversation history if useful.
-            - Understand the user's current input in the context of prior messages.
-            - Provide a clear, concise, and informative response.
-
-            Conversation History:
-            {chat_history}
-
-            User's Input:
-            {input}
-
-            Assistant:
-            """
-        )
-        general_chain = LLMChain(llm=conversational_llm, prompt=prompt, memory=memory)
-        response = general_chain.run(input=user_input)
+        prompt = (PromptBuilder(GENERAL_PROMPT, prompt_budget(llm_model_names(conversational_llm)), name="general")
+                  .add("input", user_input)
+                  .add("chat_history", memory.buffer_as_str, priority=2, keep="tail")
+                  .build())
+        response = conversational_llm.invoke(prompt).content
+        memory.save_context({"input": user_input}, {"output": response})
         result = (None, response)
 
-    query_cache[query_id] = result
-    return (*result, visualize_flag)
+    result = (*result, visualize_flag)
+    if not (visualize_flag and list(df.columns) == ["Error"]):
+        result_cache.put(cache_key, result, data_version)
+    return result
 
 # ---------------------- CLI Runner ----------------------
 def main():
@@ -488,15 +1142,16 @@ def main():
             break
         log_event("user_input", user_q)
 
-        df_dict, response, visualize_flag = chat_router(user_q, agent, memory)
-        
-        if df_dict:
-            df = pd.DataFrame(df_dict)
+        df, response, visualize_flag = chat_router(user_q, agent, memory)
+        save_memory_for_session(memory)
+        has_rows = df is not None and not df.empty
+
+        if has_rows:
             print("📊 Result:\n", df.head())
 
         print("🤖", response)
 
-        if visualize_flag and df_dict:
+        if visualize_flag and has_rows:
             if sys.stdin.isatty() and input("📊 Visualize the data? (yes/no): ").strip().lower() == "yes":
                 agent.visualize_data(df)
 
@@ -0,0 +1,219 @@
+import json
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import literal_column, select, text
+
+ALLOW, LIMIT, REJECT = "allow", "limit", "reject"
+
+_SELECT = re.compile(r"^\s*(with|select)\b", re.I)
+_HAS_LIMIT = re.compile(r"\b(limit\s+\d+|fetch\s+first|top\s+\d+)\b", re.I)
+_CROSS_JOIN = re.compile(r"\bcross\s+join\b", re.I)
+_JOIN_WITHOUT_CONDITION = re.compile(
+    r"\bjoin\s+[\w.\"`\[\]]+(?:\s+(?:as\s+)?\w+)?"
+    r"(?:\s+(?=(?:inner|left|right|full|cross|join|where|group|order|limit)\b)|\s*$)",
+    re.I
+)
+_NATURAL = re.compile(r"\bnatural(?:\s+(?:inner|left|right|full))?(?:\s+outer)?\s*$", re.I)
+_COMMA_FROM = re.compile(r"\bfrom\s+[\w.\"`\[\]]+(?:\s+(?:as\s+)?\w+)?\s*,", re.I)
+
+
+class PlanEstimate:
+    """What the planner expects a query to cost, reduced to what the guard needs."""
+
+    def __init__(self, rows: Optional[float] = None, cost: Optional[float] = None,
+                 full_scans: Dict[str, float] = None, cartesian: bool = False, available: bool = True):
+        self.rows = rows  # estimated rows returned
+        self.cost = cost  # planner cost units; rows scanned where the planner reports no cost
+        self.full_scans = full_scans or {}  # table -> estimated rows scanned
+        self.cartesian = cartesian
+        self.available = available
+
+    def to_dict(self) -> Dict:
+        return {
+            "rows": self.rows,
+            "cost": self.cost,
+            "full_scans": self.full_scans,
+            "cartesian": self.cartesian,
+            "available": self.available
+        }
+
+
+class GuardDecision:
+    def __init__(self, action: str, sql: str, reasons: List[str], estimate: PlanEstimate):
+        self.action = action
+        self.sql = sql
+        self.reasons = reasons
+        self.estimate = estimate
+
+    def feedback(self) -> str:
+        """Rejection reasons phrased for the LLM that has to rewrite the query."""
+        return "The query was rejected before execution because:\n- " + "\n- ".join(self.reasons)
+
+
+class CostGuard:
+    """
+    Pre-execution check of generated SQL using the database's EXPLAIN.
+
+    Queries with a missing join predicate (cartesian product) or a planner cost over
+    `max_cost` are rejected so the caller can ask for a rewrite. Queries expected to
+    return more than `max_rows` rows, or that fully scan a table larger than
+    `large_table_rows` without a LIMIT, get a LIMIT of `max_rows` injected. Cost units
+    are the planner's own (Postgres cost, MySQL query_cost); SQLite has no cost, so
+    the rows scanned by full table scans stand in for it.
+    """
+
+    def __init__(self, max_cost: float = 1e6, max_rows: int = 10000,
+                 large_table_rows: int = 100000, auto_limit: bool = True):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.large_table_rows = large_table_rows
+        self.auto_limit = auto_limit
+        self.checked = 0
+        self.limited = 0
+        self.rejected = 0
+
+    def check(self, engine, sql: str, table_rows: Dict[str, int] = None) -> GuardDecision:
+        """
+        Decide whether `sql` may run as is, with a LIMIT, or not at all.
+
+        `table_rows` maps lower-cased table names or aliases, as the plan names the
+        scans, to row counts for dialects whose plans do not carry row estimates (SQLite).
+        """
+        self.checked += 1
+        if not _SELECT.match(sql):
+            return GuardDecision(ALLOW, sql, [], PlanEstimate(available=False))
+
+        try:
+            estimate = self.explain(engine, sql, table_rows or {})
+        except Exception as e:
+            # An unexplainable query will fail the same way when executed; let it report there
+            return GuardDecision(ALLOW, sql, [f"EXPLAIN failed: {e}"], PlanEstimate(available=False))
+
+        reasons = []
+        if estimate.cartesian or has_cartesian_join(sql):
+            estimate.cartesian = True
+            reasons.append("it joins tables without a join condition (cartesian product)")
+        if estimate.cost is not None and estimate.cost > self.max_cost:
+            reasons.append(f"its estimated cost {estimate.cost:,.0f} exceeds the budget of {self.max_cost:,.0f}")
+        if reasons:
+            self.rejected += 1
+            return GuardDecision(REJECT, sql, reasons, estimate)
+
+        large_scans = {table: rows for table, rows in estimate.full_scans.items() if rows >= self.large_table_rows}
+        if large_scans:
+            reasons.append("it fully scans " + ", ".join(f"{table} (~{rows:,.0f} rows)" for table, rows in large_scans.items()))
+        if estimate.rows is not None and estimate.rows > self.max_rows:
+            reasons.append(f"it is expected to return ~{estimate.rows:,.0f} rows")
+        if reasons and self.auto_limit and not _HAS_LIMIT.search(sql):
+            self.limited += 1
+            return GuardDecision(LIMIT, limit_query(engine, sql, self.max_rows), reasons, estimate)
+        return GuardDecision(ALLOW, sql, reasons, estimate)
+
+    def explain(self, engine, sql: str, table_rows: Dict[str, int]) -> PlanEstimate:
+        dialect = engine.dialect.name
+        sql = sql.strip().rstrip(";")
+        with engine.connect() as conn:
+            if dialect == "sqlite":
+                plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+                return _sqlite_estimate([row[-1] for row in plan], table_rows)
+            if dialect == "postgresql":
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                return _postgres_estimate(plan[0]["Plan"])
+            if dialect in ("mysql", "mariadb"):
+                plan = conn.execute(text(f"EXPLAIN FORMAT=JSON {sql}")).scalar()
+                return _mysql_estimate(json.loads(plan)["query_block"])
+        return PlanEstimate(available=False)
+
+    def stats(self) -> Dict:
+        return {
+            "checked": self.checked,
+            "limited": self.limited,
+            "rejected": self.rejected,
+            "max_cost": self.max_cost,
+            "max_rows": self.max_rows
+        }
+
+
+def has_cartesian_join(sql: str) -> bool:
+    """Textual check for CROSS JOIN, JOIN without ON/USING (other than NATURAL), or comma joins with no WHERE."""
+    flat = re.sub(r"\s+", " ", sql)
+    if _CROSS_JOIN.search(flat):
+        return True
+    # NATURAL JOIN has no ON/USING; it joins on the columns both sides share
+    if any(not _NATURAL.search(flat[:match.start()]) for match in _JOIN_WITHOUT_CONDITION.finditer(flat)):
+        return True
+    return bool(_COMMA_FROM.search(flat)) and not re.search(r"\bwhere\b", flat, re.I)
+
+
+def limit_query(engine, sql: str, limit: int) -> str:
+    """Wrap a query so that at most `limit` rows come back, in the engine's SQL dialect."""
+    inner = text(sql.strip().rstrip(";")).columns().subquery("_guarded")
+    statement = select(literal_column("*")).select_from(inner).limit(limit)
+    return str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+
+
+def _sqlite_estimate(details: List[str], table_rows: Dict[str, int]) -> PlanEstimate:
+    # SCAN <table> is a full scan; SEARCH <table> USING INDEX is not
+    full_scans = {}
+    for detail in details:
+        match = re.match(r"SCAN (?:TABLE )?(\w+)(.*)", detail)
+        if match and "COVERING INDEX" not in match.group(2):
+            full_scans[match.group(1)] = float(table_rows.get(match.group(1).lower(), 0))
+    rows = None
+    if full_scans:
+        rows = 1.0
+        for scanned in full_scans.values():
+            rows *= max(scanned, 1.0)
+    return PlanEstimate(rows=rows, cost=sum(full_scans.values()) if full_scans else None, full_scans=full_scans)
+
+
+def _postgres_estimate(plan: Dict) -> PlanEstimate:
+    full_scans = {}
+    cartesian = False
+
+    def walk(node):
+        nonlocal cartesian
+        if node.get("Node Type") == "Seq Scan":
+            full_scans[node.get("Relation Name", "?")] = float(node.get("Plan Rows", 0))
+        if node.get("Node Type") == "Nested Loop" and not node.get("Join Filter"):
+            children = node.get("Plans", [])
+            # Without a join filter the inner side must be parameterized by an index condition
+            if not any("Index Cond" in child or "Recheck Cond" in child for child in children):
+                cartesian = True
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan)
+    return PlanEstimate(rows=float(plan.get("Plan Rows", 0)), cost=float(plan.get("Total Cost", 0)),
+                        full_scans=full_scans, cartesian=cartesian)
+
+
+def _mysql_estimate(block: Dict) -> PlanEstimate:
+    full_scans = {}
+    cartesian = False
+    rows = None
+
+    def walk(node):
+        nonlocal cartesian, rows
+        if isinstance(node, dict):
+            table = node.get("table")
+            if isinstance(table, dict):
+                examined = float(table.get("rows_examined_per_scan", 0))
+                if table.get("access_type") == "ALL":
+                    full_scans[table.get("table_name", "?")] = examined
+                if table.get("using_join_buffer") and not table.get("attached_condition"):
+                    cartesian = True
+                produced = float(table.get("rows_produced_per_join", examined))
+                rows = produced if rows is None else max(rows, produced)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(block)
+    cost = block.get("cost_info", {}).get("query_cost")
+    return PlanEstimate(rows=rows, cost=float(cost) if cost is not None else None,
+                        full_scans=full_scans, cartesian=cartesian)
@@ -0,0 +1,374 @@
+import difflib
+import re
+from threading import Lock
+from typing import Dict, List, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+
+# SQLAlchemy backend name -> sqlglot dialect
+SQLGLOT_DIALECTS = {
+    "postgresql": "postgres",
+    "redshift": "redshift",
+    "cockroachdb": "postgres",
+    "mysql": "mysql",
+    "mariadb": "mysql",
+    "sqlite": "sqlite",
+    "mssql": "tsql",
+    "oracle": "oracle",
+    "snowflake": "snowflake",
+    "bigquery": "bigquery",
+    "duckdb": "duckdb",
+    "hive": "hive",
+    "clickhouse": "clickhouse",
+    "awsathena": "athena",
+}
+
+_MISSING = object()
+
+# A fenced code block, with or without a language tag line; the SQL is its body
+_SQL_FENCE = re.compile(r"```(?:[\w-]*[ \t]*\n|(?:sql\b)?[ \t]*)(.*?)(?:```|\Z)", re.S | re.I)
+# A line that starts a statement, possibly after a "SQL:" label or opening parentheses
+_SQL_START = re.compile(
+    r"^[ \t]*(?:(?:sql|query)[ \t]*:[ \t]*)?(?=\(*[ \t]*(?:with|select|insert|update|delete)\b)", re.I | re.M
+)
+
+
+class ValidationResult:
+    def __init__(self, errors: List[str] = None, tables: Set[str] = None):
+        self.errors = errors or []
+        self.tables = tables or set()
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def feedback(self) -> str:
+        """Validation errors phrased for the LLM that has to repair the query."""
+        return "The query failed validation against the schema:\n- " + "\n- ".join(self.errors)
+
+
+def sanitize_sql(reply: str) -> str:
+    """
+    Extract the SQL statement from an LLM reply. The body of the first fenced code
+    block wins; otherwise the statement starts at the first line that begins with a
+    query keyword, so prose like "this will select..." before it is dropped.
+    """
+    fenced = _SQL_FENCE.search(reply)
+    if fenced:
+        return fenced.group(1).strip().rstrip(";").strip()
+    start = _SQL_START.search(reply)
+    if start:
+        reply = reply[start.end():]
+    return reply.strip().rstrip(";").strip()
+
+
+def referenced_tables(sql: str, dialect: str) -> Set[str]:
+    """Lower-cased names (schema.table and bare table) of real tables a query reads; empty if unparseable."""
+    try:
+        tree = sqlglot.parse_one(sql, read=SQLGLOT_DIALECTS.get(dialect))
+    except SqlglotError:
+        return set()
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    names = set()
+    for table in tree.find_all(exp.Table):
+        if table.name.lower() in cte_names:
+            continue
+        names.add(table.name.lower())
+        if table.db:
+            names.add(f"{table.db}.{table.name}".lower())
+    return names
+
+
+def table_aliases(sql: str, dialect: str) -> Dict[str, str]:
+    """Lower-cased alias (or bare name) -> bare table name for each real table a query reads."""
+    try:
+        tree = sqlglot.parse_one(sql, read=SQLGLOT_DIALECTS.get(dialect))
+    except SqlglotError:
+        return {}
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    return {
+        table.alias_or_name.lower(): table.name.lower()
+        for table in tree.find_all(exp.Table) if table.name.lower() not in cte_names
+    }
+
+
+def _page_query(sql: str, dialect: str) -> Optional[exp.Query]:
+    """The single SELECT/WITH/UNION query in `sql`, or None for anything else or unparseable SQL."""
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=SQLGLOT_DIALECTS.get(dialect)) if statement]
+    except SqlglotError:
+        return None
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query) or statements[0].args.get("into"):
+        return None
+    return statements[0]
+
+
+def pageable_sql(sql: str, dialect: str) -> Optional[str]:
+    """
+    `sql` re-rendered without comments if it is a single SELECT/WITH/UNION query,
+    else None. Only such queries may be wrapped in a subquery for paging; PRAGMA,
+    SHOW, EXPLAIN, DML and multi-statement text must run unwrapped.
+    """
+    tree = _page_query(sql, dialect)
+    return None if tree is None else tree.sql(dialect=SQLGLOT_DIALECTS.get(dialect), comments=False)
+
+
+def offset_page_sql(sql: str, dialect: str, offset: int, limit: int) -> Optional[str]:
+    """
+    `sql` with LIMIT/OFFSET (or OFFSET/FETCH) applied in its own dialect, or None
+    unless it is a query with a top-level ORDER BY and no row limit of its own:
+    without an order, pages fetched by separate statements may overlap or skip rows.
+    """
+    tree = _page_query(sql, dialect)
+    if tree is None or not tree.args.get("order") or any(tree.args.get(arg) for arg in ("limit", "offset")):
+        return None
+    if offset:
+        tree = tree.offset(offset)
+    return tree.limit(limit).sql(dialect=SQLGLOT_DIALECTS.get(dialect), comments=False)
+
+
+def validate_sql(sql: str, dialect: str, schema: Dict[str, Optional[Set[str]]],
+                 column_types: Optional[Dict[str, Dict[str, str]]] = None) -> ValidationResult:
+    """
+    Parse `sql` in the connection's dialect and check it against `schema`.
+
+    `schema` maps table keys ("table" or "schema.table") to their column names, or to
+    None when the columns are unknown (not reflected yet), which skips column checks
+    for that table. Reports syntax errors, unknown tables, unknown or mis-qualified
+    columns and unqualified columns that are ambiguous across joined tables. With
+    `column_types` (table key -> {column: SQL type}), also reports SUM/AVG over
+    non-numeric columns and comparisons of numeric columns with text or dates.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=SQLGLOT_DIALECTS.get(dialect)) if statement]
+    except ParseError as e:
+        detail = e.errors[0] if e.errors else {}
+        return ValidationResult([
+            f"syntax error near line {detail.get('line')}, column {detail.get('col')}: {detail.get('description', e)}"
+        ])
+    except SqlglotError as e:
+        return ValidationResult([f"syntax error: {str(e).splitlines()[0]}"])
+    if len(statements) != 1:
+        return ValidationResult([f"expected exactly one statement, got {len(statements)}"])
+    tree = statements[0]
+
+    tables = _lookup(schema)
+    errors = []
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    for table in tree.find_all(exp.Table):
+        if table.name.lower() in cte_names or _resolve(tables, table) is not _MISSING:
+            continue
+        suggestion = difflib.get_close_matches(table.name.lower(), list(tables), n=1)
+        hint = f"; did you mean {suggestion[0]}?" if suggestion else ""
+        errors.append(f"table {table.sql()} does not exist{hint}")
+    if errors:
+        return ValidationResult(errors, referenced_tables(sql, dialect))
+
+    try:
+        scopes = traverse_scope(tree)
+    except SqlglotError as e:
+        return ValidationResult([f"could not resolve query scopes: {e}"])
+    # A scope also lists the outer references of its subqueries; check each column once,
+    # in the innermost scope that contains it (traverse_scope yields inner scopes first)
+    owner = {}
+    for scope in scopes:
+        for column in scope.columns:
+            owner.setdefault(id(column), scope)
+    for scope in scopes:
+        errors.extend(_check_scope(scope, [column for column in scope.columns if owner[id(column)] is scope], tables))
+    if column_types and not errors:
+        types = {key: {column: _type_class(type_name) for column, type_name in columns.items()}
+                 for key, columns in column_types.items()}
+        types = _lookup_types(types)
+        for scope in scopes:
+            errors.extend(_check_types(scope, types))
+    return ValidationResult(list(dict.fromkeys(errors)), referenced_tables(sql, dialect))
+
+
+def _scope_sources(scope, tables: Dict[str, Optional[Set[str]]]):
+    """(alias -> column set or None if unknown, for real tables; aliases of derived tables and CTEs)."""
+    sources = {}
+    opaque = set()
+    for alias, source in scope.sources.items():
+        if isinstance(source, exp.Table):
+            columns = _resolve(tables, source)
+            sources[alias.lower()] = None if columns is _MISSING else columns
+        else:
+            opaque.add(alias.lower())
+    return sources, opaque
+
+
+def _check_scope(scope, own_columns: List[exp.Column], tables: Dict[str, Optional[Set[str]]]) -> List[str]:
+    errors = []
+    sources, opaque = _scope_sources(scope, tables)
+    # Enclosing scopes a correlated subquery may reference, innermost first
+    outer = []
+    current = scope
+    while current.parent is not None and (current.is_subquery or current.is_set_operation):
+        current = current.parent
+        outer.append(_scope_sources(current, tables))
+
+    select_aliases = set()
+    if isinstance(scope.expression, exp.Select):
+        select_aliases = {projection.alias.lower() for projection in scope.expression.selects if projection.alias}
+
+    for column in own_columns:
+        if isinstance(column.this, exp.Star):
+            continue
+        name = column.name.lower()
+        qualifier = column.table.lower()
+
+        if qualifier:
+            level = next(((level_sources, level_opaque) for level_sources, level_opaque in [(sources, opaque)] + outer
+                          if qualifier in level_sources or qualifier in level_opaque), None)
+            if level is None:
+                errors.append(f"column {column.sql()} uses unknown table or alias '{column.table}'")
+                continue
+            level_sources, level_opaque = level
+            if qualifier in level_opaque:
+                continue
+            columns = level_sources[qualifier]
+            if columns is not None and name not in columns:
+                hint = _closest(name, columns)
+                errors.append(f"column {column.sql()} does not exist in {column.table}{hint}")
+            continue
+
+        if name in select_aliases:
+            continue
+        # Unqualified names bind to the innermost scope that has them
+        for level_sources, level_opaque in [(sources, opaque)] + outer:
+            if level_opaque or any(columns is None for columns in level_sources.values()):
+                break  # may come from a subquery, a CTE or an unreflected table
+            owners = [alias for alias, columns in level_sources.items() if name in columns]
+            if len(owners) > 1:
+                errors.append(f"column {column.sql()} is ambiguous between {', '.join(sorted(owners))}; qualify it")
+            if owners:
+                break
+        else:
+            known = set().union(*sources.values()) if sources else set()
+            errors.append(f"column {column.sql()} does not exist in {', '.join(sorted(sources)) or 'the query'}"
+                          f"{_closest(name, known)}")
+    return errors
+
+
+def _type_class(type_name: str) -> Optional[str]:
+    """numeric, text, temporal or boolean for a SQL type name; None when unsure."""
+    name = str(type_name).upper()
+    if any(word in name for word in ("INT", "NUMERIC", "DECIMAL", "REAL", "FLOAT", "DOUBLE", "NUMBER", "MONEY")):
+        return "numeric"
+    if any(word in name for word in ("DATE", "TIME")):
+        return "temporal"
+    if any(word in name for word in ("CHAR", "TEXT", "CLOB", "STRING")):
+        return "text"
+    if "BOOL" in name:
+        return "boolean"
+    return None
+
+
+def _lookup_types(types: Dict[str, Dict[str, Optional[str]]]) -> Dict[str, Dict[str, Optional[str]]]:
+    """Index type classes by lower-cased full key and bare table name, with lower-cased column names."""
+    tables = {}
+    for key, columns in types.items():
+        columns = {column.lower(): type_class for column, type_class in columns.items()}
+        tables[key.lower()] = columns
+        tables.setdefault(key.split(".")[-1].lower(), columns)
+    return tables
+
+
+def _check_types(scope, types: Dict[str, Dict[str, Optional[str]]]) -> List[str]:
+    """Type errors among the columns of this scope's own tables; unknown types are never reported."""
+    sources = {}
+    for alias, source in scope.sources.items():
+        if isinstance(source, exp.Table):
+            columns = _resolve(types, source)
+            if columns is not _MISSING:
+                sources[alias.lower()] = columns
+
+    def type_class(node) -> Optional[str]:
+        if isinstance(node, exp.Literal):
+            if not node.is_string:
+                return "numeric"
+            return None if _is_number(node.this) else "text"
+        if not isinstance(node, exp.Column) or isinstance(node.this, exp.Star):
+            return None
+        if node.table:
+            return (sources.get(node.table.lower()) or {}).get(node.name.lower())
+        owners = [columns for columns in sources.values() if node.name.lower() in columns]
+        return owners[0][node.name.lower()] if len(owners) == 1 and len(sources) == len(scope.sources) else None
+
+    errors = []
+    for aggregate in scope.find_all(exp.Sum, exp.Avg):
+        found = type_class(aggregate.this)
+        if found not in (None, "numeric"):
+            errors.append(f"{aggregate.sql()} aggregates {aggregate.this.sql()}, which is {found}, not numeric")
+    for comparison in scope.find_all(exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE):
+        pair = {type_class(comparison.left), type_class(comparison.right)}
+        if "numeric" in pair and pair & {"text", "temporal"}:
+            errors.append(f"{comparison.sql()} compares a numeric value with a "
+                          f"{'text' if 'text' in pair else 'date/time'} value")
+    return errors
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _lookup(schema: Dict[str, Optional[Set[str]]]) -> Dict[str, Optional[Set[str]]]:
+    """Index schema entries by lower-cased full key and bare table name."""
+    tables = {}
+    for key, columns in schema.items():
+        columns = None if columns is None else {column.lower() for column in columns}
+        tables[key.lower()] = columns
+        tables.setdefault(key.split(".")[-1].lower(), columns)
+    return tables
+
+
+def _resolve(tables: Dict[str, Optional[Set[str]]], table: exp.Table):
+    """Column set for a table reference (None if not reflected yet), or _MISSING for unknown tables."""
+    if table.db and f"{table.db}.{table.name}".lower() in tables:
+        return tables[f"{table.db}.{table.name}".lower()]
+    return tables.get(table.name.lower(), _MISSING)
+
+
+def _closest(name: str, candidates) -> str:
+    match = difflib.get_close_matches(name, list(candidates or ()), n=1)
+    return f"; did you mean {match[0]}?" if match else ""
+
+
+class SQLValidationStats:
+    """Counters for generated SQL: validation failures, LLM re-asks and database executions."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.validated = 0
+        self.invalid = 0
+        self.reasks = 0
+        self.repaired = 0
+        self.unrepaired = 0
+        self.executions = 0
+        self.execution_errors = 0
+
+    def record(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "validated": self.validated,
+                "invalid": self.invalid,
+                "reasks": self.reasks,
+                "repaired": self.repaired,
+                "unrepaired": self.unrepaired,
+                "executions": self.executions,
+                "execution_errors": self.execution_errors,
+                "execution_error_rate": round(self.execution_errors / self.executions, 4) if self.executions else 0.0
+            }
@@ -7,6 +7,11 @@ let sqlEditor; // CodeMirror editor instance
 let activeConnectionId = null;
 let schemaCache = {}; // Cache schema information by connection ID
 
+const RESULT_PAGE_SIZE = 200; // Rows fetched per result page
+const VIRTUAL_ROW_HEIGHT = 37; // Fixed row height in px used by the virtual table
+const VIRTUAL_TABLE_HEIGHT = 480;
+const VIRTUAL_OVERSCAN = 10; // Rows rendered above and below the viewport
+
 document.addEventListener('DOMContentLoaded', function() {
     // Initialize SQL editor
     initSqlEditor();
@@ -377,21 +382,30 @@ function executeQuery() {
         },
         body: JSON.stringify({
             connection_id: activeConnectionId,
-            query: query
+            query: query,
+            format: 'columnar',
+            page_size: RESULT_PAGE_SIZE
         })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
+            const table = decodeResultTable(data);
+            
             // Display query results with visualization and explanation if available
             displayQueryResults(
-                data.columns, 
-                data.data, 
+                table.columns, 
+                table.rows, 
                 data.execution_time, 
                 data.visualization, 
-                data.explanation
+                data.explanation,
+                data.cursor
             );
             
+            if (data.truncated && !data.cursor) {
+                showToast(`Showing the first ${data.row_count} rows; the result was truncated`, 'info');
+            }
+            
             // Show success message
             showToast(`Query executed successfully in ${data.execution_time.toFixed(2)}s`, 'success');
             
@@ -423,6 +437,28 @@ function executeQuery() {
     });
 }
 
+/**
+ * Normalize a query result payload to column names plus row arrays
+ * @param {Object} data - Response body in columnar or row format
+ * @returns {Object} Object with columns and rows arrays
+ */
+function decodeResultTable(data) {
+    if (data.format !== 'columnar') {
+        return { columns: data.columns || [], rows: data.data || [] };
+    }
+    
+    // Columnar payloads carry one value array per column; transpose to rows
+    const rows = new Array(data.row_count);
+    for (let i = 0; i < data.row_count; i++) {
+        const row = new Array(data.columns.length);
+        for (let c = 0; c < data.columns.length; c++) {
+            row[c] = data.values[c][i];
+        }
+        rows[i] = row;
+    }
+    return { columns: data.columns, rows: rows };
+}
+
 /**
  * Display query results in the results container
  * @param {Array} columns - Array of column names
@@ -430,8 +466,9 @@ function executeQuery() {
  * @param {number} executionTime - Query execution time in seconds
  * @param {string} visualization - Base64 encoded visualization image
  * @param {string} explanation - Text explanation of the data
+ * @param {string} cursor - Cursor of the next result page, if there is one
  */
-function displayQueryResults(columns, data, executionTime, visualization, explanation) {
+function displayQueryResults(columns, data, executionTime, visualization, explanation, cursor) {
     const resultsContainer = document.getElementById('query-results');
     
     if (resultsContainer) {
@@ -469,9 +506,9 @@ function displayQueryResults(columns, data, executionTime, visualization, explan
                 
                 <!-- Table View Section -->
                 <div id="view-table" class="tab-content active">
-                    <div class="overflow-x-auto rounded-md border border-gray-200">
+                    <div id="virtual-table" class="overflow-auto rounded-md border border-gray-200" style="max-height: ${VIRTUAL_TABLE_HEIGHT}px;">
                         <table class="min-w-full divide-y divide-gray-200">
-                            <thead class="bg-gray-50">
+                            <thead class="bg-gray-50 sticky top-0">
                                 <tr>
             `;
             
@@ -483,29 +520,10 @@ function displayQueryResults(columns, data, executionTime, visualization, explan
             html += `
                                 </tr>
                             </thead>
-                            <tbody class="bg-white divide-y divide-gray-200">
-            `;
-            
-            // Add rows
-            data.forEach((row, rowIndex) => {
-                html += `<tr class="${rowIndex % 2 === 0 ? 'bg-white' : 'bg-gray-50'}">`;
-                
-                row.forEach(cell => {
-                    // Handle null values
-                    const cellValue = cell === null ? '<span class="text-gray-400 italic">NULL</span>' : encodeHTML(String(cell));
-                    html += `<td class="px-6 py-4 whitespace-nowrap text-sm text-gray-500">${cellValue}</td>`;
-                });
-                
-                html += '</tr>';
-            });
-            
-            html += `
-                            </tbody>
+                            <tbody class="bg-white divide-y divide-gray-200"></tbody>
                         </table>
                     </div>
-                    <div class="mt-2 text-sm text-gray-500">
-                        ${data.length} row${data.length !== 1 ? 's' : ''} returned
-                    </div>
+                    <div id="virtual-table-status" class="mt-2 text-sm text-gray-500"></div>
                 </div>
                 
                 <!-- Visualization Section -->
@@ -537,6 +555,12 @@ function displayQueryResults(columns, data, executionTime, visualization, explan
         
         resultsContainer.innerHTML = html;
         
+        // Rows are rendered by the virtual table, which fetches further pages on scroll
+        const virtualTable = document.getElementById('virtual-table');
+        if (virtualTable) {
+            initVirtualTable(virtualTable, columns.length, data, cursor);
+        }
+        
         // Initialize Feather icons
         if (window.feather) {
             feather.replace();
@@ -565,6 +589,89 @@ function displayQueryResults(columns, data, executionTime, visualization, explan
     }
 }
 
+/**
+ * Render only the visible rows of a result and fetch further pages while scrolling
+ * @param {HTMLElement} container - Scrollable element holding the results table
+ * @param {number} columnCount - Number of result columns
+ * @param {Array} rows - Rows of the first page
+ * @param {string} cursor - Cursor of the next page, or null when complete
+ */
+function initVirtualTable(container, columnCount, rows, cursor) {
+    const tbody = container.querySelector('tbody');
+    const status = document.getElementById('virtual-table-status');
+    let loading = false;
+    let framePending = false;
+    
+    function renderRow(row, rowIndex) {
+        let html = `<tr class="${rowIndex % 2 === 0 ? 'bg-white' : 'bg-gray-50'}" style="height: ${VIRTUAL_ROW_HEIGHT}px;">`;
+        row.forEach(cell => {
+            // Handle null values
+            const cellValue = cell === null ? '<span class="text-gray-400 italic">NULL</span>' : encodeHTML(String(cell));
+            html += `<td class="px-6 py-2 whitespace-nowrap text-sm text-gray-500">${cellValue}</td>`;
+        });
+        return html + '</tr>';
+    }
+    
+    function spacer(height) {
+        return height > 0 ? `<tr style="height: ${height}px;"><td colspan="${columnCount}"></td></tr>` : '';
+    }
+    
+    function render() {
+        framePending = false;
+        const visible = Math.ceil(container.clientHeight / VIRTUAL_ROW_HEIGHT);
+        const start = Math.max(0, Math.floor(container.scrollTop / VIRTUAL_ROW_HEIGHT) - VIRTUAL_OVERSCAN);
+        const end = Math.min(rows.length, start + visible + 2 * VIRTUAL_OVERSCAN);
+        
+        let html = spacer(start * VIRTUAL_ROW_HEIGHT);
+        for (let i = start; i < end; i++) {
+            html += renderRow(rows[i], i);
+        }
+        html += spacer((rows.length - end) * VIRTUAL_ROW_HEIGHT);
+        tbody.innerHTML = html;
+        
+        if (status) {
+            status.textContent = `${rows.length} row${rows.length !== 1 ? 's' : ''} loaded${cursor ? ' (scroll for more)' : ''}`;
+        }
+        if (cursor && !loading && end >= rows.length - VIRTUAL_OVERSCAN) {
+            loadNextPage();
+        }
+    }
+    
+    function loadNextPage() {
+        loading = true;
+        fetch(`/api/result-page?cursor=${encodeURIComponent(cursor)}&format=columnar&limit=${RESULT_PAGE_SIZE}`, {
+            headers: { 'Accept': 'application/json' }
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                cursor = null;
+                showToast(`Error: ${data.message}`, 'error');
+                return;
+            }
+            rows.push(...decodeResultTable(data).rows);
+            cursor = data.cursor;
+        })
+        .catch(error => {
+            console.error('Result page error:', error);
+            cursor = null;
+            showToast('Error loading more rows', 'error');
+        })
+        .finally(() => {
+            loading = false;
+            render();
+        });
+    }
+    
+    container.addEventListener('scroll', () => {
+        if (!framePending) {
+            framePending = true;
+            requestAnimationFrame(render);
+        }
+    });
+    render();
+}
+
 /**
  * Load schema information for a database connection
  * @param {string} connectionId - Connection ID
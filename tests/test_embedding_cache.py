@@ -0,0 +1,88 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+from embedding_cache import GROWTH_ROWS, CachedEmbeddings  # noqa: E402
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic 4-d vectors; records every text it is asked to embed."""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return self._vector(text)
+
+    @staticmethod
+    def _vector(text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0, -1.0]
+
+
+def make_cache(cache_dir, **kwargs):
+    return CachedEmbeddings(CountingEmbeddings(), "test-model", str(cache_dir), **kwargs)
+
+
+def embed_in_worker(cache_dir, texts):
+    cache = make_cache(cache_dir)
+    cache.embed_documents(texts)
+    assert cache.embeddings.calls == []  # every vector came from the shared file
+
+
+def test_duplicates_and_repeats_hit_the_cache(tmp_path):
+    cache = make_cache(tmp_path)
+    first = cache.embed_documents(["a", "bb", "a"])
+    assert cache.embeddings.calls == ["a", "bb"]
+    assert cache.embed_documents(["bb", "a"]) == [first[1], first[0]]
+    assert cache.embeddings.calls == ["a", "bb"]
+
+    cache.embed_query("a")  # queries are keyed separately from documents
+    assert cache.embeddings.calls == ["a", "bb", "a"]
+    stats = cache.stats()
+    assert (stats["misses"], stats["memory_hits"], stats["stored_vectors"]) == (3, 2, 3)
+
+
+def test_vectors_survive_a_restart_via_the_mapped_file(tmp_path):
+    expected = make_cache(tmp_path).embed_documents(["x", "yy"])
+    restarted = make_cache(tmp_path, max_memory=1)
+    assert restarted.embed_documents(["yy", "x"]) == expected[::-1]
+    assert restarted.embeddings.calls == []
+    assert restarted.stats()["disk_hits"] == 2
+
+
+def test_other_process_reads_vectors_written_by_this_one(tmp_path):
+    make_cache(tmp_path).embed_documents(["shared", "text"])
+    worker = multiprocessing.get_context("fork").Process(target=embed_in_worker, args=(tmp_path, ["text", "shared"]))
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+
+
+def test_reader_remaps_after_another_worker_grows_the_file(tmp_path):
+    reader, writer = make_cache(tmp_path), make_cache(tmp_path)
+    reader.embed_documents(["first"])
+    texts = [f"text {i}" for i in range(GROWTH_ROWS + 10)]
+    expected = writer.embed_documents(texts)
+
+    assert reader.embed_documents(texts[-3:]) == expected[-3:]
+    assert reader.embeddings.calls == ["first"]
+    assert reader._mmap.shape[0] > GROWTH_ROWS
+
+
+def test_dimension_change_is_rejected(tmp_path):
+    make_cache(tmp_path).embed_documents(["a"])
+    cache = make_cache(tmp_path)
+    cache.embeddings._vector = lambda text: [1.0, 2.0]
+    with pytest.raises(ValueError):
+        cache.embed_documents(["new text"])
+    assert np.isfinite(cache.embed_documents(["a"])).all()
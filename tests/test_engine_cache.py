@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from sqlalchemy import text  # noqa: E402
+
+import db_connection  # noqa: E402
+from db_connection import DBConnection  # noqa: E402
+
+ECOMMERCE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ecommerce.db")
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    db_connection.dispose_all_engines()
+    yield
+    db_connection.dispose_all_engines()
+
+
+def test_pool_settings_are_part_of_the_cache_key():
+    small = DBConnection("sqlite", database=ECOMMERCE_DB, pool={"pool_size": 1})
+    large = DBConnection("sqlite", database=ECOMMERCE_DB, pool={"pool_size": 8})
+    assert small.get_engine() is not large.get_engine()
+    assert DBConnection("sqlite", database=ECOMMERCE_DB, pool={"pool_size": 1}).get_engine() is small.get_engine()
+
+
+def test_dispose_keeps_an_engine_other_connections_still_use():
+    first = DBConnection("sqlite", database=ECOMMERCE_DB)
+    second = DBConnection("sqlite", database=ECOMMERCE_DB)
+    engine = first.get_engine()
+    assert second.get_engine() is engine
+    first.dispose()
+    assert second.get_engine() is engine
+    second.dispose()
+    assert DBConnection("sqlite", database=ECOMMERCE_DB).get_engine() is not engine
+
+
+def test_connection_test_leaves_no_cached_engine():
+    success, _ = DBConnection("sqlite", database=ECOMMERCE_DB).test_connection()
+    assert success
+    assert db_connection._engine_cache == {}
+    success, message = DBConnection("nosuchdb", database="x").test_connection()
+    assert not success and "Unsupported" in message
+
+
+def test_duckdb_pool_hands_each_thread_its_own_connection():
+    pytest.importorskip("duckdb_engine")
+    engine = DBConnection("duckdb", database=":memory:").get_engine()
+    with engine.connect() as first, engine.connect() as second:
+        first.execute(text("CREATE OR REPLACE TABLE t AS SELECT 1 AS a"))
+        first.commit()
+        assert first.connection.dbapi_connection is not second.connection.dbapi_connection
+        assert second.execute(text("SELECT COUNT(*) FROM t")).scalar() == 1
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("faiss")
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+
+from history_index import ShardedHistoryIndex  # noqa: E402
+
+
+class ParkedSaver:
+    """A deferred saver whose interval never elapses during the test."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, vectorstore, path, store_lock=None):
+        self.scheduled.append(path)
+
+
+def chunks(count):
+    return [Document(page_content=f"message number {i}", metadata={"msg_index": i}) for i in range(count)]
+
+
+def test_evicted_shard_is_written_before_it_is_dropped(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    index = ShardedHistoryIndex(str(tmp_path), embeddings, saver=ParkedSaver(), max_loaded_shards=1)
+    index.add_messages("s1", chunks(4), watermark=4)
+    index.add_messages("s2", chunks(2), watermark=2)  # evicts s1 while its save is still deferred
+
+    assert index.stats()["evicted_shards"] == 1
+    assert index.watermark("s1") == 4
+    assert len(index.search("s1", "message", k=10)) == 4
+    assert ShardedHistoryIndex(str(tmp_path), embeddings).watermark("s1") == 4
+
+
+def test_each_session_gets_one_loaded_shard(tmp_path):
+    index = ShardedHistoryIndex(str(tmp_path), DeterministicFakeEmbedding(size=16), max_loaded_shards=2)
+    assert index.shard("s1") is index.shard("s1")
+    index.shard("s2")
+    index.shard("s3")
+    assert index.stats()["loaded_shards"] == 2
+
+
+def test_only_unseen_chunks_are_embedded(tmp_path):
+    index = ShardedHistoryIndex(str(tmp_path), DeterministicFakeEmbedding(size=16))
+    assert index.add_messages("s1", chunks(3), watermark=3) == 3
+    assert index.add_messages("s1", chunks(5), watermark=5) == 2
+    assert index.add_messages("s1", chunks(5), watermark=5) == 0
+    assert index.watermark("s1") == 5
+    assert index.shard("s1").size == 5
+    assert index.search("s2", "message") == []
+
+
+def test_shards_persist_without_a_deferred_saver(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    ShardedHistoryIndex(str(tmp_path), embeddings).add_messages("s1", chunks(2), watermark=2)
+    reloaded = ShardedHistoryIndex(str(tmp_path), embeddings)
+    assert reloaded.watermark("s1") == 2
+    assert reloaded.add_messages("s1", chunks(2), watermark=2) == 0
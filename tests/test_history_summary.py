@@ -0,0 +1,59 @@
+import pytest
+
+from history_summarizer import HistorySummarizer
+
+
+def fold(previous, texts):
+    return " | ".join(([previous] if previous else []) + texts)
+
+
+def test_latest_falls_back_to_persisted_summary():
+    persisted = {"s1": "earlier summary"}
+    summarizer = HistorySummarizer(fold, load_summary=persisted.get)
+    assert summarizer.latest("s1") == "earlier summary"
+    assert summarizer.latest("s2") is None
+
+
+def test_roll_up_after_restart_folds_into_persisted_summary():
+    persisted = {}
+    first = HistorySummarizer(fold, on_summary=lambda session_id, summary, upto: persisted.update({session_id: summary}))
+    first.add("s1", ["a", "b"], threshold=1)
+    first.join()
+
+    restarted = HistorySummarizer(fold, load_summary=persisted.get)
+    restarted.add("s1", ["c", "d"], threshold=1)
+    restarted.join()
+    assert restarted.latest("s1") == "a | b | c | d"
+
+
+def test_summary_survives_restart_of_history_index(tmp_path):
+    pytest.importorskip("faiss")
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from history_index import ShardedHistoryIndex
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    index = ShardedHistoryIndex(str(tmp_path), embeddings)
+    chunks = [Document(page_content=f"message number {i}", metadata={"msg_index": i}) for i in range(4)]
+    index.add_messages("s1", chunks, watermark=4)
+    index.add_summary("s1", "the user asked about orders", upto=4)
+
+    # Compaction removed the summarized messages; the summary must remain available
+    assert [doc.metadata.get("kind") for doc in index.search("s1", "orders", k=10)] == ["summary"]
+    assert ShardedHistoryIndex(str(tmp_path), embeddings).summary("s1") == "the user asked about orders"
+
+
+def test_summaries_in_ram_are_bounded_and_reloaded_on_a_miss():
+    persisted = {}
+    summarizer = HistorySummarizer(
+        fold, max_sessions=2,
+        on_summary=lambda session_id, summary, upto: persisted.update({session_id: summary}),
+        load_summary=persisted.get
+    )
+    for session_id in ("s1", "s2", "s3"):
+        summarizer.add(session_id, [session_id, "x"], threshold=1)
+    summarizer.join()
+
+    assert summarizer.stats()["sessions"] == 2
+    assert summarizer.latest("s1") == "s1 | x"
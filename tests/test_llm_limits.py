@@ -0,0 +1,85 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from llm_limits import CircuitBreaker, LLMQueueTimeout, ModelLimiter, get_limiter
+
+
+def test_breaker_opens_after_threshold_and_recovers_through_one_probe():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+def test_released_probe_lets_the_next_call_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_request_unit_is_refunded_when_the_token_budget_times_out():
+    limiter = ModelLimiter("test", concurrency=2, rpm=2, tpm=100)
+    with limiter.acquire(tokens=90, timeout=0.05):
+        pass
+    with pytest.raises(LLMQueueTimeout):
+        with limiter.acquire(tokens=50, timeout=0.05):
+            pass
+    # The second request unit is still there for a call that fits the token budget
+    with limiter.acquire(tokens=5, timeout=0.05):
+        pass
+    assert limiter.timeouts == 1
+
+
+def test_async_acquire_refunds_on_timeout():
+    limiter = ModelLimiter("test", concurrency=2, rpm=2, tpm=100)
+
+    async def calls():
+        async with limiter.acquire_async(tokens=90, timeout=0.05):
+            pass
+        with pytest.raises(LLMQueueTimeout):
+            async with limiter.acquire_async(tokens=50, timeout=0.05):
+                pass
+        async with limiter.acquire_async(tokens=5, timeout=0.05):
+            pass
+
+    asyncio.run(calls())
+
+
+def test_models_of_one_provider_share_the_provider_budget(monkeypatch):
+    provider = f"test-{uuid.uuid4().hex[:8]}"
+    monkeypatch.setenv("LLM_RATE_LIMITS", f'{{"{provider}": {{"rpm": 2, "concurrency": 4}}}}')
+    first, second = get_limiter(provider, "a"), get_limiter(provider, "b")
+    assert first.parent is second.parent
+    with first.acquire(timeout=0.05), second.acquire(timeout=0.05):
+        pass
+    with pytest.raises(LLMQueueTimeout):
+        with first.acquire(timeout=0.05):
+            pass
+    assert first.parent.stats()["calls"] == 2
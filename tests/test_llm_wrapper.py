@@ -0,0 +1,209 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from llm_limits import LLMQueueTimeout, LLMUnavailable  # noqa: E402
+import llm_wrapper  # noqa: E402
+from llm_wrapper import SafeLLMWrapper  # noqa: E402
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubLLM:
+    """Chat model stand-in: fails with `fail_status` while set, else answers after `latency`."""
+
+    def __init__(self, answer: str = "ok", fail_status: int = None, latency: float = 0.0):
+        self.answer = answer
+        self.fail_status = fail_status
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail_status:
+            raise ProviderError(self.fail_status)
+        return self.answer
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.fail_status:
+            raise ProviderError(self.fail_status)
+        return self.answer
+
+
+def make_wrapper(primary, fallback=None, **kwargs):
+    # Limiters and breakers are shared per provider:model, so every test gets fresh names
+    suffix = uuid.uuid4().hex[:8]
+    fallbacks = [(fallback, "stub", f"fallback-{suffix}")] if fallback is not None else None
+    wrapper = SafeLLMWrapper(primary, retries=1, provider="stub", model_name=f"primary-{suffix}",
+                             fallbacks=fallbacks, **kwargs)
+    for route in wrapper.routes:
+        route.breaker.failure_threshold = 2
+        route.breaker.reset_timeout = 0.05
+    return wrapper
+
+
+def test_fails_over_to_next_provider_on_retryable_error():
+    primary, fallback = StubLLM(fail_status=503), StubLLM(answer="from fallback")
+    wrapper = make_wrapper(primary, fallback)
+    assert wrapper.invoke("hi") == "from fallback"
+    assert primary.calls == 1
+    assert wrapper.routes[0].breaker.stats()["consecutive_failures"] == 1
+
+
+def test_bad_request_is_raised_without_failover():
+    primary, fallback = StubLLM(fail_status=400), StubLLM()
+    wrapper = make_wrapper(primary, fallback)
+    with pytest.raises(ProviderError):
+        wrapper.invoke("hi")
+    assert fallback.calls == 0
+    assert wrapper.routes[0].breaker.state == "closed"
+
+
+def test_breaker_opens_then_half_open_probe_recovers():
+    primary, fallback = StubLLM(fail_status=503), StubLLM(answer="from fallback")
+    wrapper = make_wrapper(primary, fallback)
+    wrapper.invoke("hi")
+    wrapper.invoke("hi")
+    assert wrapper.routes[0].breaker.state == "open"
+
+    wrapper.invoke("hi")
+    assert primary.calls == 2  # skipped while open
+
+    time.sleep(0.06)
+    primary.fail_status = None
+    assert wrapper.invoke("hi") == "ok"
+    assert wrapper.routes[0].breaker.state == "closed"
+
+
+def test_all_providers_failing_raises_unavailable():
+    wrapper = make_wrapper(StubLLM(fail_status=503), StubLLM(fail_status=429))
+    with pytest.raises(LLMUnavailable):
+        wrapper.invoke("hi")
+
+
+def test_queue_timeout_when_no_slot_is_free():
+    wrapper = make_wrapper(StubLLM())
+    limiter = wrapper.routes[0].limiter
+    held = [limiter.acquire(timeout=1) for _ in range(limiter.concurrency)]
+    for slot in held:
+        slot.__enter__()
+    try:
+        started = time.monotonic()
+        with pytest.raises(LLMQueueTimeout):
+            wrapper.invoke("hi", queue_timeout=0.05)
+        assert time.monotonic() - started < 1
+    finally:
+        for slot in held:
+            slot.__exit__(None, None, None)
+    assert limiter.stats()["timeouts"] == 1
+
+
+def test_probe_ending_in_queue_timeout_does_not_wedge_breaker():
+    primary = StubLLM(fail_status=503)
+    wrapper = make_wrapper(primary)
+    route = wrapper.routes[0]
+    with pytest.raises(LLMUnavailable):
+        wrapper.invoke("hi")
+    with pytest.raises(LLMUnavailable):
+        wrapper.invoke("hi")
+    time.sleep(0.06)
+
+    held = [route.limiter.acquire(timeout=1) for _ in range(route.limiter.concurrency)]
+    for slot in held:
+        slot.__enter__()
+    try:
+        with pytest.raises(LLMQueueTimeout):
+            wrapper.invoke("hi", queue_timeout=0.05)
+    finally:
+        for slot in held:
+            slot.__exit__(None, None, None)
+
+    primary.fail_status = None
+    assert wrapper.invoke("hi") == "ok"
+    assert route.breaker.state == "closed"
+
+
+def test_cancelled_async_probe_releases_breaker():
+    primary = StubLLM(fail_status=503)
+    wrapper = make_wrapper(primary)
+    route = wrapper.routes[0]
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            wrapper.invoke("hi")
+    time.sleep(0.06)
+    primary.fail_status = None
+    primary.latency = 1.0
+
+    async def cancelled_probe():
+        task = asyncio.ensure_future(wrapper.ainvoke("hi"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_probe())
+    assert route.breaker.allow()
+
+
+@pytest.fixture
+def short_hedge_delay(monkeypatch):
+    monkeypatch.setattr(llm_wrapper, "HEDGE_DEFAULT_DELAY", 0.05)
+
+
+def test_slow_primary_is_hedged_and_backup_wins(short_hedge_delay):
+    primary, fallback = StubLLM(answer="slow", latency=0.5), StubLLM(answer="fast")
+    wrapper = make_wrapper(primary, fallback, hedge=True, hedge_budget=1.0)
+    started = time.monotonic()
+    assert wrapper.invoke("hi") == "fast"
+    assert time.monotonic() - started < 0.4
+    stats = wrapper.hedge_stats()
+    assert (stats["calls"], stats["hedges_sent"], stats["hedge_wins"]) == (1, 1, 1)
+
+
+def test_fast_primary_is_not_hedged(short_hedge_delay):
+    primary, fallback = StubLLM(answer="primary"), StubLLM(answer="fallback")
+    wrapper = make_wrapper(primary, fallback, hedge=True, hedge_budget=1.0)
+    assert wrapper.invoke("hi") == "primary"
+    assert fallback.calls == 0
+    assert wrapper.hedge_stats()["hedges_sent"] == 0
+
+
+def test_hedges_stay_within_budget(short_hedge_delay):
+    primary, fallback = StubLLM(answer="slow", latency=0.1), StubLLM(answer="fast")
+    wrapper = make_wrapper(primary, fallback, hedge=True, hedge_budget=0.5)
+    answers = [wrapper.invoke("hi") for _ in range(4)]
+    assert wrapper.hedge_stats()["hedges_sent"] == 2
+    assert answers.count("fast") == 2
+
+
+def test_failed_hedged_primary_falls_back_to_backup(short_hedge_delay):
+    primary, fallback = StubLLM(fail_status=503, latency=0.1), StubLLM(answer="fast", latency=0.2)
+    wrapper = make_wrapper(primary, fallback, hedge=True, hedge_budget=1.0)
+    assert wrapper.invoke("hi") == "fast"
+    assert wrapper.routes[0].breaker.stats()["consecutive_failures"] == 1
+
+
+def test_async_hedge_cancels_the_losing_request(short_hedge_delay):
+    primary, fallback = StubLLM(answer="slow", latency=1.0), StubLLM(answer="fast")
+    wrapper = make_wrapper(primary, fallback, hedge=True, hedge_budget=1.0)
+
+    async def call():
+        started = time.monotonic()
+        answer = await wrapper.ainvoke("hi")
+        return answer, time.monotonic() - started
+
+    answer, elapsed = asyncio.run(call())
+    assert answer == "fast" and elapsed < 0.5
+    assert wrapper.hedge_stats()["hedge_wins"] == 1
+    assert wrapper.routes[0].breaker.allow()  # the cancelled primary left no probe behind
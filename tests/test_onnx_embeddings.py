@@ -0,0 +1,71 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from onnx_embeddings import OnnxEmbeddings  # noqa: E402
+
+
+class RecordingModel(OnnxEmbeddings):
+    """OnnxEmbeddings with the inference call replaced, to observe how texts are batched."""
+
+    def __init__(self, max_batch=32, max_wait_ms=200.0, fail=False):
+        self.model_path = "recording"
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = Lock()
+        self.batches = 0
+        self.texts = 0
+        self.runs = []
+        self.fail = fail
+
+    def _run(self, texts):
+        if self.fail:
+            raise RuntimeError("inference failed")
+        self.runs.append((threading.current_thread().name, list(texts)))
+        with self._lock:
+            self.batches += 1
+            self.texts += len(texts)
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_concurrent_small_calls_share_a_batch():
+    model = RecordingModel()
+    queries = [f"q{'x' * i}" for i in range(8)]
+    barrier = threading.Barrier(len(queries))
+
+    def embed(text):
+        barrier.wait()
+        return model.embed_query(text)
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        vectors = list(executor.map(embed, queries))
+
+    assert vectors == [[float(len(text)), 1.0] for text in queries]
+    assert model.batches < len(queries)
+    assert all(name == "onnx-embeddings" for name, _ in model.runs)
+
+
+def test_batches_are_length_sorted_and_results_keep_input_order():
+    model = RecordingModel(max_batch=2)
+    texts = ["ccc", "a", "dddd", "bb"]
+    vectors = model.embed_documents(texts)
+    assert [vector[0] for vector in vectors] == [3.0, 1.0, 4.0, 2.0]
+    assert [batch for _, batch in model.runs] == [["a", "bb"], ["ccc", "dddd"]]
+    assert model._worker is None  # full batches run on the calling thread
+    assert model.stats()["avg_batch"] == 2.0
+
+
+def test_inference_errors_reach_every_waiting_caller():
+    model = RecordingModel(max_wait_ms=1.0, fail=True)
+    with pytest.raises(RuntimeError, match="inference failed"):
+        model.embed_query("question")
+    with pytest.raises(RuntimeError):
+        model.embed_query("the worker keeps serving after a failure")
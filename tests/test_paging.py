@@ -0,0 +1,54 @@
+import os
+import sqlite3
+
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from sql_validator import offset_page_sql, pageable_sql  # noqa: E402
+
+ECOMMERCE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ecommerce.db")
+
+
+def test_trailing_comment_is_stripped_before_wrapping():
+    sql = pageable_sql("SELECT * FROM users -- all users", "sqlite")
+    assert "--" not in sql
+    with sqlite3.connect(ECOMMERCE_DB) as conn:
+        conn.execute(f"SELECT * FROM ({sql}) AS _page LIMIT 1").fetchall()
+
+
+@pytest.mark.parametrize("sql", [
+    "PRAGMA table_info(users)",
+    "EXPLAIN SELECT * FROM users",
+    "DELETE FROM users",
+    "SELECT 1; SELECT 2",
+    "SELEC nonsense",
+])
+def test_non_queries_are_not_pageable(sql):
+    assert pageable_sql(sql, "sqlite") is None
+    assert offset_page_sql(sql, "sqlite", 0, 10) is None
+
+
+def test_offset_paging_needs_an_order_and_no_own_limit():
+    assert offset_page_sql("SELECT * FROM users", "sqlite", 0, 10) is None
+    assert offset_page_sql("SELECT * FROM users ORDER BY 1 LIMIT 5", "sqlite", 0, 10) is None
+    assert offset_page_sql("SELECT TOP 5 * FROM users ORDER BY 1", "mssql", 0, 10) is None
+
+
+def test_offset_pages_cover_the_ordered_result_once():
+    sql = "SELECT u.* FROM users u JOIN orders o ON o.user_id = u.id ORDER BY o.id -- newest last"
+    with sqlite3.connect(ECOMMERCE_DB) as conn:
+        expected = conn.execute(sql).fetchall()
+        pages, offset = [], 0
+        while True:
+            page = conn.execute(offset_page_sql(sql, "sqlite", offset, 7)).fetchall()
+            pages.extend(page)
+            offset += len(page)
+            if len(page) < 7:
+                break
+    assert pages == expected
+
+
+def test_mssql_offset_paging_renders_offset_fetch():
+    sql = offset_page_sql("SELECT name FROM users ORDER BY name", "mssql", 20, 10)
+    assert sql.endswith("ORDER BY name OFFSET 20 ROWS FETCH FIRST 10 ROWS ONLY")
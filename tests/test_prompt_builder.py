@@ -0,0 +1,46 @@
+import pytest
+
+import prompt_builder
+from prompt_builder import TRIM_MARKER, PromptBuilder, count_tokens, prompt_budget, truncate_tokens
+
+
+@pytest.fixture(autouse=True)
+def length_estimate(monkeypatch):
+    """Count tokens as len // 4 so budgets are deterministic without a tokenizer."""
+    monkeypatch.setattr(prompt_builder, "_encoding", lambda: None)
+
+
+def test_truncate_keeps_the_requested_end():
+    text = "a" * 40 + "b" * 40
+    assert truncate_tokens(text, 5, keep="head") == "a" * 20 + TRIM_MARKER
+    assert truncate_tokens(text, 5, keep="tail") == TRIM_MARKER + "b" * 20
+    assert truncate_tokens(text, 100) == text
+    assert truncate_tokens(text, 0) == ""
+
+
+def test_lower_priority_sections_are_trimmed_first():
+    builder = PromptBuilder("{question}|{history}|{schema}", budget=30, name="test")
+    builder.add("question", "q" * 40)
+    builder.add("schema", "s" * 40, priority=1)
+    builder.add("history", "h" * 400, priority=2, keep="tail")
+    prompt = builder.build()
+
+    question, history, schema = prompt.split("|")
+    assert question == "q" * 40 and schema == "s" * 40
+    assert history.startswith(TRIM_MARKER) and history.endswith("h")
+    sections = builder.report["sections"]
+    assert sections["history"]["kept"] < sections["history"]["tokens"]
+    assert builder.report["total_tokens"] <= 30 + count_tokens(TRIM_MARKER)
+    assert prompt_builder.prompt_stats.stats()["test"]["calls"] >= 1
+
+
+def test_priority_zero_sections_are_never_trimmed():
+    builder = PromptBuilder("{question}", budget=5).add("question", "q" * 400)
+    assert builder.build() == "q" * 400
+
+
+def test_failover_chain_uses_the_smallest_budget(monkeypatch):
+    assert prompt_budget(["llama-3.3-70b-versatile", "llama3-70b-8192"]) == 6000
+    assert prompt_budget(["unknown-model"]) == prompt_builder.DEFAULT_BUDGETS["default"]
+    monkeypatch.setenv("PROMPT_BUDGETS", '{"llama3-70b-8192": 5000}')
+    assert prompt_budget(["llama3-70b-8192", "gemini-2.0-flash"]) == 5000
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from query_jobs import CANCELLED, FAILED, RUNNING, SUCCEEDED, JobLimitExceeded, QueryJobManager
+
+
+def make_manager(tmp_path, **kwargs):
+    return QueryJobManager(spill_dir=str(tmp_path / "spill"), db_path=str(tmp_path / "jobs.db"),
+                           poll_interval=0.02, **kwargs)
+
+
+def wait_for(manager, job_id, owner, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id, owner)
+        if job.status in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {job.status}")
+
+
+def test_other_worker_sees_status_and_result(tmp_path):
+    worker_a, worker_b = make_manager(tmp_path), make_manager(tmp_path)
+    job = worker_a.submit(1, 7, "SELECT 1", lambda job: pd.DataFrame({"x": [1, 2, 3]}))
+    finished = wait_for(worker_b, job.job_id, 1, (SUCCEEDED,))
+    assert finished.row_count == 3
+    assert worker_b.result(job.job_id, 1)["x"].tolist() == [1, 2, 3]
+    assert worker_b.get(job.job_id, 2) is None
+
+
+def test_cancel_from_other_worker_interrupts_the_statement(tmp_path):
+    worker_a, worker_b = make_manager(tmp_path), make_manager(tmp_path)
+    interrupted = threading.Event()
+
+    def run(job):
+        job.cancel_fn = interrupted.set
+        if not interrupted.wait(5):
+            return pd.DataFrame({"x": [1]})
+        raise RuntimeError("interrupted")
+
+    job = worker_a.submit(1, 7, "SELECT slow()", run)
+    wait_for(worker_b, job.job_id, 1, (RUNNING,))
+    worker_b.cancel(job.job_id, 1)
+    assert wait_for(worker_b, job.job_id, 1, (CANCELLED, FAILED, SUCCEEDED)).status == CANCELLED
+    assert interrupted.is_set()
+
+
+def test_per_user_limit_spans_workers(tmp_path):
+    worker_a, worker_b = make_manager(tmp_path, per_user_limit=1), make_manager(tmp_path, per_user_limit=1)
+    release = threading.Event()
+    job = worker_a.submit(1, 7, "SELECT 1", lambda job: release.wait(5) and pd.DataFrame({"x": [1]}))
+    try:
+        with pytest.raises(JobLimitExceeded):
+            worker_b.submit(1, 7, "SELECT 2", lambda job: pd.DataFrame())
+    finally:
+        release.set()
+    wait_for(worker_b, job.job_id, 1, (SUCCEEDED,))
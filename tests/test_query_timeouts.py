@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from db_connection import QueryCancelled, QueryTimeout, RunningQuery, cancel_query, guarded_connection  # noqa: E402
+
+ECOMMERCE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ecommerce.db")
+SLOW_SQL = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+            "SELECT COUNT(*) FROM n")
+
+
+def test_sqlite_timeout_stops_a_slow_query_on_ecommerce_db():
+    engine = create_engine(f"sqlite:///{ECOMMERCE_DB}")
+    started = time.monotonic()
+    with pytest.raises(QueryTimeout):
+        with guarded_connection(engine, timeout=0.2) as conn:
+            conn.execute(text(SLOW_SQL)).scalar()
+    assert time.monotonic() - started < 5
+    with guarded_connection(engine, timeout=5) as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM users")).scalar() > 0
+
+
+def test_duckdb_timeout_cancels_through_the_timer():
+    pytest.importorskip("duckdb_engine")
+    engine = create_engine("duckdb:///:memory:")
+    started = time.monotonic()
+    with pytest.raises(QueryTimeout):
+        with guarded_connection(engine, timeout=0.2) as conn:
+            conn.execute(text("SELECT COUNT(*) FROM range(100000000000) a")).scalar()
+    assert time.monotonic() - started < 10
+
+
+def test_cancel_of_an_unknown_query_id_is_a_no_op():
+    assert cancel_query("no-such-query") is False
+
+
+class _Dialect:
+    name = "exoticdb"
+
+
+class _Engine:
+    dialect = _Dialect()
+
+
+def test_driver_without_cancel_is_reported_up_front():
+    running = RunningQuery("q", _Engine(), object(), timeout=1)
+    assert not running.cancellable
+    with pytest.raises(NotImplementedError):
+        running.cancel()
+    assert not running.cancelled
+
+
+def test_explicit_cancel_raises_query_cancelled():
+    engine = create_engine(f"sqlite:///{ECOMMERCE_DB}")
+    canceller = threading.Timer(0.2, cancel_query, ("cancel-me",))
+    canceller.start()
+    with pytest.raises(QueryCancelled):
+        with guarded_connection(engine, query_id="cancel-me") as conn:
+            conn.execute(text(SLOW_SQL)).scalar()
+    canceller.join()
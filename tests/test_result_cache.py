@@ -0,0 +1,45 @@
+import time
+
+from result_cache import ResultCache
+
+
+def test_equivalent_questions_share_a_key():
+    key = ResultCache.make_key("conn", "fp", "alice", "How many users?")
+    assert ResultCache.make_key("conn", "fp", "alice", "  how many   USERS ") == key
+    assert ResultCache.make_key("other", "fp", "alice", "How many users?") != key
+    assert ResultCache.make_key("conn", "fp2", "alice", "How many users?") != key
+    assert ResultCache.make_key("conn", "fp", "bob", "How many users?") != key
+
+
+def test_hit_and_miss():
+    cache = ResultCache()
+    assert cache.get("k") is None
+    cache.put("k", "answer")
+    assert cache.get("k") == "answer"
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_changed_data_version_invalidates():
+    cache = ResultCache()
+    cache.put("k", "answer", data_version="v1")
+    assert cache.get("k", data_version="v1") == "answer"
+    assert cache.get("k", data_version="v2") is None
+    assert cache.get("k", data_version="v1") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = ResultCache(ttl=0.05)
+    cache.put("k", "answer")
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
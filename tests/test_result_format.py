@@ -0,0 +1,113 @@
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+import result_format
+from result_format import (MIN_COMPRESS_BYTES, compress, encode_columnar, encode_json, encode_records, encode_rows,
+                           negotiate_encoding, negotiate_format, read_capped)
+
+
+def chunked(rows, size):
+    df = pd.DataFrame({"id": range(rows), "name": [f"row {i}" for i in range(rows)]})
+    return (df.iloc[start:start + size] for start in range(0, rows, size))
+
+
+def test_row_cap_truncates_mid_chunk():
+    df = read_capped(chunked(25, 10), offset=0, max_rows=15, max_bytes=10 ** 9)
+    assert list(df["id"]) == list(range(15))
+    assert df.attrs == {"truncated": True, "next_offset": 15, "row_count": 15, "bytes": df.attrs["bytes"]}
+
+
+def test_next_offset_pages_through_the_whole_result():
+    pages, offset = [], 0
+    while offset is not None:
+        page = read_capped(chunked(25, 10), offset=offset, max_rows=7, max_bytes=10 ** 9)
+        pages.extend(page["id"])
+        offset = page.attrs["next_offset"]
+    assert pages == list(range(25))
+
+
+def test_byte_cap_stops_after_the_chunk_that_crosses_it():
+    df = read_capped(chunked(100, 10), offset=0, max_rows=1000, max_bytes=1)
+    assert len(df) == 10
+    assert df.attrs["truncated"] and df.attrs["next_offset"] == 10
+    assert df.attrs["bytes"] >= 1
+
+
+def test_exact_fit_is_not_truncated():
+    df = read_capped(chunked(20, 10), offset=0, max_rows=20, max_bytes=10 ** 9)
+    assert len(df) == 20
+    assert not df.attrs["truncated"] and df.attrs["next_offset"] is None
+
+
+def test_offset_past_the_end_keeps_the_columns():
+    df = read_capped(chunked(5, 10), offset=50, max_rows=10, max_bytes=10 ** 9)
+    assert df.empty and list(df.columns) == ["id", "name"]
+    assert df.attrs["next_offset"] is None
+
+
+def sample_frame():
+    return pd.DataFrame({
+        "id": [1, 2],
+        "price": [1.5, None],
+        "active": [True, False],
+        "name": ["a", "b"],
+        "created": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+    })
+
+
+def test_columnar_and_rows_carry_the_same_values_as_records():
+    df = sample_frame()
+    records = encode_records(df)
+    rows = encode_rows(df)
+    columnar = encode_columnar(df)
+
+    assert columnar["types"] == ["int", "float", "bool", "string", "datetime"]
+    assert columnar["row_count"] == 2
+    assert rows["columns"] == columnar["columns"] == list(records[0])
+    assert [dict(zip(rows["columns"], row)) for row in rows["data"]] == records
+    assert [dict(zip(columnar["columns"], row)) for row in zip(*columnar["values"])] == records
+
+
+def test_format_negotiation(monkeypatch):
+    assert negotiate_format(None) == "records"
+    assert negotiate_format("COLUMNAR") == "columnar"
+    with pytest.raises(ValueError):
+        negotiate_format("xml")
+    monkeypatch.setattr(result_format, "pa", None)
+    assert negotiate_format("arrow") == "columnar"
+
+
+def test_encoding_negotiation(monkeypatch):
+    monkeypatch.setattr(result_format, "brotli", None)
+    assert negotiate_encoding("br, gzip;q=0.5") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("gzip; q=bogus, deflate") is None
+    assert negotiate_encoding(None) is None
+    monkeypatch.setattr(result_format, "brotli", object())
+    assert negotiate_encoding("gzip, br") == "br"
+
+
+def test_small_bodies_are_sent_uncompressed():
+    small = b"x" * (MIN_COMPRESS_BYTES - 1)
+    assert compress(small, "gzip") == (small, None)
+    large = b"x" * MIN_COMPRESS_BYTES
+    body, encoding = compress(large, "gzip")
+    assert encoding == "gzip" and gzip.decompress(body) == large
+
+
+def test_encode_json_round_trips_through_gzip(monkeypatch):
+    monkeypatch.setattr(result_format, "brotli", None)
+    payload = {"data": encode_records(pd.DataFrame({"id": range(500)}))}
+    body, encoding = encode_json(payload, "gzip, br")
+    assert encoding == "gzip"
+    assert json.loads(gzip.decompress(body)) == payload
+
+
+def test_arrow_stream_round_trips():
+    pa = pytest.importorskip("pyarrow")
+    df = sample_frame()
+    table = pa.ipc.open_stream(result_format.encode_arrow(df)).read_all()
+    assert table.to_pandas().equals(df)
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from result_handles import ResultHandleStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "handles.db")
+
+
+def test_handle_opened_by_one_worker_is_served_by_another(db_path):
+    opener, server = ResultHandleStore(db_path), ResultHandleStore(db_path)
+    handle = opener.open(7, 3, "SELECT id FROM users", ["id"])
+
+    served = server.get(handle.handle_id, 7)
+    assert (served.connection_id, served.sql, served.key_columns, served.mode) == (3, "SELECT id FROM users",
+                                                                                   ["id"], "keyset")
+    assert server.get(handle.handle_id, 8) is None
+
+    server.close(handle.handle_id)
+    assert opener.get(handle.handle_id, 7) is None
+
+
+def test_idle_handles_expire(db_path):
+    store = ResultHandleStore(db_path, ttl=1)
+    handle = store.open(7, 3, "SELECT * FROM t", [])
+    time.sleep(1.2)
+    assert store.get(handle.handle_id, 7) is None
+    store.open(7, 3, "SELECT * FROM t", [])
+    assert store.stats()["expired"] == 1
+
+
+def test_least_recently_used_handles_are_evicted(db_path):
+    store = ResultHandleStore(db_path, max_handles=2)
+    first = store.open(7, 3, "SELECT 1", [])
+    second = store.open(7, 3, "SELECT 2", [])
+    store.get(first.handle_id, 7)
+    store.open(7, 3, "SELECT 3", [])
+    assert store.get(first.handle_id, 7) is not None
+    assert store.get(second.handle_id, 7) is None
+    assert store.stats()["handles"] == 2
+
+
+def test_cursor_round_trip(db_path):
+    handle = ResultHandleStore(db_path).open(7, 3, "SELECT id FROM users", ["id"])
+    cursor = ResultHandleStore.encode_cursor(handle, {"after": [42]})
+    assert ResultHandleStore.decode_cursor(cursor) == (handle.handle_id, {"after": [42]})
+    with pytest.raises(ValueError):
+        ResultHandleStore.decode_cursor("not a cursor")
@@ -0,0 +1,35 @@
+from schema_graph import SchemaGraph
+
+
+def fk(target):
+    return {"type": "INTEGER", "foreign_key": target}
+
+
+SCHEMA = {
+    "users": {"columns": {"id": {"type": "INTEGER"}, "manager_id": fk("users.id")}},
+    "orders": {"columns": {"id": {"type": "INTEGER"}, "user_id": fk("users.id")}},
+    "order_items": {"columns": {"order_id": fk("orders.id"), "product_id": fk("sales.products.id")}},
+    "sales.products": {"columns": {"id": {"type": "INTEGER"}, "category_id": fk("categories.id")}},
+    "reviews": {"columns": {"product_id": fk("products.id"), "user_id": fk("missing.id")}},
+    "audit_log": {"columns": {"id": {"type": "INTEGER"}}},
+}
+
+
+def test_foreign_keys_resolve_across_schema_prefixes():
+    graph = SchemaGraph.from_schema_info(SCHEMA)
+    # users.manager_id is a self-reference; categories/missing are not in scope
+    assert graph.join_count == 4
+    assert graph.joins_within(["reviews", "sales.products"]) == [
+        ("reviews", "product_id", "sales.products", "id")
+    ]
+
+
+def test_connect_adds_the_tables_on_the_join_path():
+    graph = SchemaGraph.from_schema_info(SCHEMA)
+    assert graph.connect(["users", "sales.products"]) == ["users", "sales.products", "orders", "order_items"]
+
+
+def test_connect_keeps_unreachable_seeds_and_respects_max_hops():
+    graph = SchemaGraph.from_schema_info(SCHEMA)
+    assert graph.connect(["users", "audit_log", "users"]) == ["users", "audit_log"]
+    assert graph.connect(["users", "sales.products"], max_hops=2) == ["users", "sales.products"]
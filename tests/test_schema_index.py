@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("faiss")
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+
+from schema_index import update_schema_index  # noqa: E402
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: list = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def table_docs(**tables):
+    return {
+        name: Document(page_content=f"Table: {name}\nColumns:\n{columns}", metadata={"table": name})
+        for name, columns in tables.items()
+    }
+
+
+def test_unchanged_schema_is_loaded_without_embedding(tmp_path):
+    docs = table_docs(users="id (INTEGER) [PK]", orders="id (INTEGER) [PK]\nuser_id (INTEGER)")
+    first = update_schema_index(str(tmp_path), docs, CountingEmbeddings(size=16, embedded=[]), {"dialect": "sqlite"})
+    assert sorted(first.changed) == ["orders", "users"]
+
+    embeddings = CountingEmbeddings(size=16, embedded=[])
+    again = update_schema_index(str(tmp_path), docs, embeddings)
+    assert (again.changed, again.removed, again.fingerprint) == ([], [], first.fingerprint)
+    assert embeddings.embedded == []
+    assert again.vectorstore.index.ntotal == 2
+
+
+def test_only_changed_tables_are_re_embedded(tmp_path):
+    docs = table_docs(users="id (INTEGER) [PK]", orders="id (INTEGER) [PK]", payments="id (INTEGER) [PK]")
+    first = update_schema_index(str(tmp_path), docs, CountingEmbeddings(size=16, embedded=[]))
+
+    docs = table_docs(users="id (INTEGER) [PK]\nemail (TEXT)", orders="id (INTEGER) [PK]")
+    embeddings = CountingEmbeddings(size=16, embedded=[])
+    update = update_schema_index(str(tmp_path), docs, embeddings)
+
+    assert (update.changed, update.removed) == (["users"], ["payments"])
+    assert embeddings.embedded == [docs["users"].page_content]
+    assert update.fingerprint != first.fingerprint
+    found = {doc.metadata["table"] for doc in update.vectorstore.similarity_search("id", k=10)}
+    assert found == {"users", "orders"}
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from schema_reflection import reflect_tables  # noqa: E402
+
+ECOMMERCE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ecommerce.db")
+TABLES = ["categories", "order_items", "orders", "payments", "products", "users"]
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine(f"sqlite:///{ECOMMERCE_DB}")
+    yield engine
+    engine.dispose()
+
+
+def test_parallel_batches_reflect_the_same_schema(engine):
+    batched = reflect_tables(engine, TABLES, workers=4, batch_size=2)
+    assert batched == reflect_tables(engine, TABLES, workers=1, batch_size=len(TABLES))
+    assert sorted(batched) == TABLES
+
+
+def test_column_detail_includes_keys(engine):
+    orders = reflect_tables(engine, ["orders"])["orders"]
+    assert orders["id"]["primary_key"]
+    assert orders["user_id"]["foreign_key"] == "users.id"
+    assert orders["total"]["type"] == "REAL"
+
+
+def test_static_pool_is_reflected_on_one_thread():
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=StaticPool,
+                                      connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        for name in ("a", "b", "c"):
+            conn.execute(sqlalchemy.text(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY)"))
+    assert sorted(reflect_tables(engine, ["a", "b", "c"], workers=8, batch_size=1)) == ["a", "b", "c"]
+    assert reflect_tables(engine, []) == {}
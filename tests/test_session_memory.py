@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+import prompt_builder  # noqa: E402
+from session_memory import SessionMemory  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def length_estimate(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "_encoding", lambda: None)
+
+
+class FakePayloadStore:
+    def __init__(self):
+        self.payloads = {}
+
+    def put_payload(self, session_id, content):
+        payload_id = f"p{len(self.payloads)}"
+        self.payloads[payload_id] = content
+        return payload_id
+
+    def delete_payloads(self, session_id, ids):
+        for payload_id in ids:
+            self.payloads.pop(payload_id, None)
+
+
+def make_memory(**kwargs):
+    return SessionMemory(session_id="s1", memory_key="chat_history", return_messages=True, **kwargs)
+
+
+def test_messages_outside_the_window_are_compacted():
+    memory = make_memory(window_turns=1, compact_tokens=5)
+    memory.add_turn("q" * 100, "a" * 100)
+    memory.add_turn("latest question", "latest answer")
+    messages = memory.chat_memory.messages
+    assert [m.additional_kwargs.get("compacted", False) for m in messages] == [True, True, False, False]
+    assert messages[0].content == "q" * 20 + prompt_builder.TRIM_MARKER
+    assert [m.content for m in messages[2:]] == ["latest question", "latest answer"]
+
+
+def test_large_answers_are_offloaded_to_the_payload_store():
+    store = FakePayloadStore()
+    memory = make_memory(payload_tokens=10, payload_store=store)
+    memory.add_turn("show the script", "x" * 400)
+    answer = memory.chat_memory.messages[-1]
+    assert answer.additional_kwargs["payload_id"] == "p0"
+    assert store.payloads["p0"] == "x" * 400
+    assert answer.content.startswith("[response of 100 tokens stored as payload p0]")
+
+    memory.replace_last_output("short")
+    assert store.payloads == {}
+    assert memory.chat_memory.messages[-1].content == "short"
+
+
+def test_token_ceiling_drops_oldest_messages_and_counts_them():
+    store = FakePayloadStore()
+    memory = make_memory(window_turns=10, max_tokens=30, payload_tokens=20, payload_store=store)
+    memory.add_turn("q" * 40, "a" * 100)
+    for i in range(3):
+        memory.add_turn("q" * 40, "short answer")
+    assert memory.token_count() <= 30 + 10  # plus the omitted marker
+    omitted = memory.omitted
+    assert omitted > 0
+    assert memory.chat_memory.messages[0].content == f"[{omitted} earlier messages omitted]"
+    assert store.payloads == {}  # the dropped answer's payload is released
+    assert omitted + len(memory.chat_memory.messages) - 1 == 8
+
+    memory.add_turn("q" * 40, "short answer")
+    assert memory.omitted + len(memory.chat_memory.messages) - 1 == 10
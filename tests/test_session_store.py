@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("langchain")
+
+from session_memory import SessionMemory  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+
+def make_store(db_path, max_sessions=8):
+    def factory(session_id):
+        return SessionMemory(session_id=session_id, memory_key="chat_history", return_messages=True)
+    return SessionStore(factory, db_path=str(db_path), max_sessions=max_sessions, ttl=3600)
+
+
+def contents(memory):
+    return [message.content for message in memory.chat_memory.messages]
+
+
+def test_other_worker_sees_saved_turns(tmp_path):
+    worker_a, worker_b = make_store(tmp_path / "s.db"), make_store(tmp_path / "s.db")
+    memory = worker_a.get("s1")
+    memory.add_turn("question", "answer")
+    worker_a.save(memory)
+    assert contents(worker_b.get("s1")) == ["question", "answer"]
+
+
+def test_evicting_a_stale_copy_keeps_newer_turns_from_another_worker(tmp_path):
+    worker_a = make_store(tmp_path / "s.db", max_sessions=1)
+    worker_b = make_store(tmp_path / "s.db")
+
+    stale = worker_a.get("s1")
+    stale.add_turn("first", "one")
+    worker_a.save(stale)
+
+    fresh = worker_b.get("s1")
+    fresh.add_turn("second", "two")
+    worker_b.save(fresh)
+
+    worker_a.get("s2")  # evicts worker A's copy of s1
+    assert worker_a.stats()["evictions"] == 1
+    assert contents(make_store(tmp_path / "s.db").get("s1")) == ["first", "one", "second", "two"]
+
+
+def test_concurrent_turns_from_two_workers_are_merged(tmp_path):
+    worker_a, worker_b = make_store(tmp_path / "s.db"), make_store(tmp_path / "s.db")
+    seed = worker_a.get("s1")
+    seed.add_turn("first", "one")
+    worker_a.save(seed)
+
+    memory_a, memory_b = worker_a.get("s1"), worker_b.get("s1")
+    memory_a.add_turn("from a", "answer a")
+    memory_b.add_turn("from b", "answer b")
+    worker_a.save(memory_a)
+    worker_b.save(memory_b)  # conflicts with A's save, merges and retries
+
+    expected = ["first", "one", "from a", "answer a", "from b", "answer b"]
+    assert contents(memory_b) == expected
+    assert contents(worker_a.get("s1")) == expected
+    assert contents(make_store(tmp_path / "s.db").get("s1")) == expected
+
+
+def test_unchanged_session_is_not_reloaded(tmp_path):
+    store = make_store(tmp_path / "s.db")
+    memory = store.get("s1")
+    memory.add_turn("question", "answer")
+    store.save(memory)
+    assert store.get("s1") is memory
+    assert store.stats()["loads"] == 0
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+from sql_guard import ALLOW, LIMIT, REJECT, CostGuard, has_cartesian_join  # noqa: E402
+
+ECOMMERCE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ecommerce.db")
+
+
+@pytest.fixture
+def engine():
+    engine = sqlalchemy.create_engine(f"sqlite:///{ECOMMERCE_DB}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM users CROSS JOIN orders",
+    "SELECT * FROM users u JOIN orders o",
+    "SELECT * FROM users u JOIN orders o WHERE u.id = 1",
+    "SELECT * FROM users u JOIN orders o ON o.user_id = u.id JOIN payments p",
+    "SELECT * FROM users, orders",
+])
+def test_joins_without_a_condition_are_cartesian(sql):
+    assert has_cartesian_join(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM users u JOIN orders o ON o.user_id = u.id",
+    "SELECT * FROM users JOIN orders USING (id)",
+    "SELECT * FROM users NATURAL JOIN orders",
+    "SELECT * FROM users u\n  natural left outer join orders o WHERE u.id = 1",
+    "SELECT * FROM users, orders WHERE users.id = orders.user_id",
+])
+def test_joins_with_a_condition_are_not_cartesian(sql):
+    assert not has_cartesian_join(sql)
+
+
+def test_cartesian_product_is_rejected(engine):
+    decision = CostGuard().check(engine, "SELECT * FROM users u JOIN orders o", {"u": 100, "o": 100})
+    assert decision.action == REJECT
+    assert decision.estimate.cartesian
+    assert "cartesian product" in decision.feedback()
+
+
+def test_natural_join_is_allowed(engine):
+    assert CostGuard().check(engine, "SELECT * FROM users NATURAL JOIN orders", {}).action == ALLOW
+
+
+def test_cost_over_budget_is_rejected(engine):
+    decision = CostGuard(max_cost=50).check(engine, "SELECT * FROM orders", {"orders": 100})
+    assert decision.action == REJECT
+    assert "exceeds the budget" in decision.reasons[0]
+
+
+def test_large_scan_gets_a_limit(engine):
+    guard = CostGuard(max_rows=10, large_table_rows=50)
+    decision = guard.check(engine, "SELECT * FROM orders", {"orders": 100})
+    assert decision.action == LIMIT
+    with engine.connect() as conn:
+        assert len(conn.execute(sqlalchemy.text(decision.sql)).fetchall()) == 10
+    assert guard.check(engine, "SELECT * FROM orders LIMIT 5", {"orders": 100}).action == ALLOW
+    assert guard.stats()["limited"] == 1
+
+
+def test_statements_other_than_queries_are_not_explained(engine):
+    decision = CostGuard().check(engine, "PRAGMA table_info(users)")
+    assert decision.action == ALLOW
+    assert not decision.estimate.available
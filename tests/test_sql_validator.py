@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip("sqlglot")
+
+from sql_validator import sanitize_sql, table_aliases, validate_sql  # noqa: E402
+
+SCHEMA = {"users": {"id", "name"}, "orders": {"id", "user_id", "total"}}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT u.id FROM users u WHERE EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.id)",
+    "SELECT u.name, (SELECT SUM(o.total) FROM orders o WHERE o.user_id = u.id) AS spent FROM users u",
+    "SELECT name FROM users u WHERE EXISTS (SELECT 1 FROM orders WHERE user_id = u.id AND total > 0)",
+    "SELECT name FROM users u WHERE id IN "
+    "(SELECT user_id FROM orders UNION SELECT o2.user_id FROM orders o2 WHERE o2.id = u.id)",
+])
+def test_correlated_subqueries_resolve_outer_aliases(sql):
+    assert validate_sql(sql, "sqlite", SCHEMA).errors == []
+
+
+def test_correlated_subquery_still_reports_bad_references():
+    errors = validate_sql(
+        "SELECT u.id FROM users u WHERE EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.nope AND x.id = 1)",
+        "sqlite", SCHEMA
+    ).errors
+    assert errors == ["column u.nope does not exist in u", "column x.id uses unknown table or alias 'x'"]
+
+
+def test_unqualified_column_in_a_cte_does_not_resolve_to_the_outer_query():
+    errors = validate_sql("WITH c AS (SELECT name FROM orders) SELECT u.id FROM users u", "sqlite", SCHEMA).errors
+    assert errors == ["column name does not exist in orders"]
+
+
+def test_ambiguous_unqualified_column_is_reported():
+    errors = validate_sql("SELECT id FROM users JOIN orders ON orders.user_id = users.id", "sqlite", SCHEMA).errors
+    assert errors == ["column id is ambiguous between orders, users; qualify it"]
+
+
+def test_table_aliases_map_plan_names_to_tables():
+    sql = "WITH recent AS (SELECT * FROM orders) SELECT * FROM Users u JOIN recent r ON r.user_id = u.id"
+    assert table_aliases(sql, "sqlite") == {"orders": "orders", "u": "users"}
+
+
+@pytest.mark.parametrize("reply, sql", [
+    ("Here is the query:\n```sql\nSELECT name FROM users;\n```\nIt selects every user.", "SELECT name FROM users"),
+    ("```\nWITH t AS (SELECT 1) SELECT * FROM t\n```", "WITH t AS (SELECT 1) SELECT * FROM t"),
+    ("```sql SELECT 1```", "SELECT 1"),
+    ("To select the users, run:\nSELECT * FROM users;", "SELECT * FROM users"),
+    ("SQL: SELECT id FROM orders", "SELECT id FROM orders"),
+    ("(SELECT id FROM users) UNION (SELECT user_id FROM orders)",
+     "(SELECT id FROM users) UNION (SELECT user_id FROM orders)"),
+    ("  select 1;  ", "select 1"),
+])
+def test_sanitize_sql_extracts_the_statement(reply, sql):
+    assert sanitize_sql(reply) == sql
+
+
+TYPES = {"users": {"id": "INTEGER", "name": "VARCHAR(100)"},
+         "orders": {"id": "INTEGER", "user_id": "INTEGER", "total": "DECIMAL(10, 2)", "created_at": "DATETIME"}}
+TYPED_SCHEMA = {table: set(columns) for table, columns in TYPES.items()}
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELECT SUM(name) FROM users", "SUM(name) aggregates name, which is text"),
+    ("SELECT AVG(o.created_at) FROM orders o", "AVG(o.created_at) aggregates o.created_at, which is temporal"),
+    ("SELECT * FROM users u JOIN orders o ON o.user_id = u.name", "compares a numeric value with a text value"),
+    ("SELECT * FROM orders WHERE total > 'large'", "compares a numeric value with a text value"),
+])
+def test_type_errors_are_reported(sql, error):
+    errors = validate_sql(sql, "sqlite", TYPED_SCHEMA, TYPES).errors
+    assert len(errors) == 1 and error in errors[0]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT SUM(o.total), AVG(user_id) FROM orders o WHERE o.total > '10.5'",
+    "SELECT * FROM orders WHERE created_at >= '2024-01-01' AND id = 3",
+    "SELECT u.name FROM users u WHERE u.id IN (SELECT user_id FROM orders WHERE total > 100)",
+    "SELECT SUM(x) FROM (SELECT name AS x FROM users) AS t",
+])
+def test_well_typed_queries_pass(sql):
+    assert validate_sql(sql, "sqlite", TYPED_SCHEMA, TYPES).errors == []